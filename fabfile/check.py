@@ -18,7 +18,7 @@ def security():
 
 
 @task
-def unit(target='website operations api transactions wallet'):
+def unit(target='website operations api transactions wallet common'):
     with prefix('. venv/bin/activate'):
         local('coverage run '
               'xbterminal/manage.py test {}'.format(target))
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.utils import crypto
+
+
+class Command(BaseCommand):
+
+    help = 'Measure signature verification rate on withdrawal API path'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=1000)
+        parser.add_argument('--key-size', type=int, default=2048)
+
+    def _run(self, public_key_pem, message, signature, iterations,
+             cached):
+        crypto._public_key_cache.clear()
+        start_time = time.time()
+        for _ in range(iterations):
+            if not cached:
+                crypto._public_key_cache.clear()
+            assert crypto.verify_signature(public_key_pem,
+                                           message,
+                                           signature,
+                                           device_key='benchmark')
+        return iterations / (time.time() - start_time)
+
+    def handle(self, *args, **options):
+        message = '{"device": "benchmark", "amount": "1.00"}'
+        public_key_pem, signature = crypto.create_test_signature(
+            message, key_size=options['key_size'])
+        for cached in [False, True]:
+            rate = self._run(public_key_pem, message, signature,
+                             options['iterations'], cached)
+            self.stdout.write('{0}: {1:.0f} verifications/s'.format(
+                'cached' if cached else 'uncached', rate))
+        crypto._public_key_cache.clear()
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from api.utils.aptly import refresh_index
+
+
+class Command(BaseCommand):
+
+    help = ('Update cached package versions for firmware repository. '
+            'Should be called by publishing script')
+
+    def add_arguments(self, parser):
+        parser.add_argument('machine', type=str)
+
+    def handle(self, *args, **options):
+        index = refresh_index(options['machine'])
+        self.stdout.write('{0} packages indexed'.format(len(index)))
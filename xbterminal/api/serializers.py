@@ -2,7 +2,7 @@ from decimal import Decimal
 import re
 from rest_framework import serializers
 
-from api.utils.salt import Salt
+from api.utils.salt import get_salt
 from transactions.models import Deposit, Withdrawal
 from website.models import (
     Language,
@@ -13,6 +13,8 @@ from website.models import (
     DeviceBatch)
 from website.validators import validate_public_key
 
+DEPOSIT_BULK_MAX_SIZE = 100
+
 
 class MerchantSerializer(serializers.ModelSerializer):
 
@@ -61,6 +63,32 @@ class DepositInitSerializer(serializers.Serializer):
         return data
 
 
+class DepositBulkInitSerializer(serializers.Serializer):
+
+    account = serializers.CharField()
+    amounts = serializers.ListField(
+        child=serializers.DecimalField(
+            max_digits=9,
+            decimal_places=2,
+            min_value=Decimal('0.01')))
+
+    def validate_account(self, value):
+        try:
+            account = Account.objects.get(pk=value)
+        except Account.DoesNotExist:
+            raise serializers.ValidationError('Invalid account ID.')
+        return account
+
+    def validate_amounts(self, value):
+        if not value:
+            raise serializers.ValidationError('This list may not be empty.')
+        if len(value) > DEPOSIT_BULK_MAX_SIZE:
+            raise serializers.ValidationError(
+                'Ensure this field has no more than {0} elements.'.format(
+                    DEPOSIT_BULK_MAX_SIZE))
+        return value
+
+
 class DepositSerializer(serializers.ModelSerializer):
 
     fiat_amount = serializers.DecimalField(
@@ -227,11 +255,6 @@ class DeviceRegistrationSerializer(serializers.ModelSerializer):
             'salt_fingerprint',
         ]
 
-    def __init__(self, *args, **kwargs):
-        self._salt = Salt()
-        self._salt.login()
-        super(DeviceRegistrationSerializer, self).__init__(*args, **kwargs)
-
     def validate_batch(self, value):
         try:
             batch = DeviceBatch.objects.get(batch_number=value)
@@ -249,8 +272,9 @@ class DeviceRegistrationSerializer(serializers.ModelSerializer):
         return value
 
     def validate(self, data):
-        if not self._salt.check_fingerprint(data['key'],
-                                            data['salt_fingerprint']):
+        salt = get_salt()
+        if not salt.check_fingerprint(data['key'],
+                                      data['salt_fingerprint']):
             raise serializers.ValidationError({
                 'salt_fingerprint': 'Invalid salt key fingerprint.'})
         return data
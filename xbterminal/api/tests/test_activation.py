@@ -2,14 +2,13 @@ import datetime
 from mock import Mock, patch
 
 from django.test import TestCase
+from django.utils import timezone
 
 from django_fsm import TransitionNotAllowed
-from rq.job import NoSuchJobError
+import requests
 
-from api.utils.activation import (
-    start,
-    prepare_device,
-    wait_for_activation)
+from api.utils.activation import start, run_activation
+from api.utils.salt import SaltError
 from website.models import Device
 from website.tests.factories import (
     MerchantAccountFactory,
@@ -19,9 +18,8 @@ from website.tests.factories import (
 
 class ActivationTestCase(TestCase):
 
-    @patch('api.utils.activation.rq_helpers.run_task')
     @patch('api.utils.activation.rq_helpers.run_periodic_task')
-    def test_start(self, run_periodic_mock, run_mock):
+    def test_start(self, run_periodic_mock):
         merchant = MerchantAccountFactory.create(currency__name='USD')
         account_gbp = AccountFactory(merchant=merchant,  # noqa: F841
                                      currency__name='GBP')
@@ -33,11 +31,16 @@ class ActivationTestCase(TestCase):
                                       currency__name='TBTC')
         device = DeviceFactory.create(status='registered')
         start(device, merchant)
-        self.assertTrue(run_mock.called)
-        self.assertEqual(run_mock.call_args[1]['timeout'], 2400)
-        self.assertTrue(run_periodic_mock.called)
+        self.assertEqual(run_periodic_mock.call_args[0][0].__name__,
+                         'run_activation')
+        self.assertEqual(run_periodic_mock.call_args[0][1], [device.key])
+        self.assertEqual(run_periodic_mock.call_args[1]['queue'], 'low')
         device_updated = Device.objects.get(pk=device.pk)
         self.assertEqual(device_updated.status, 'activation_in_progress')
+        self.assertEqual(device_updated.activation_step, 'accept_key')
+        self.assertIsNotNone(device_updated.activation_step_time)
+        self.assertEqual(device_updated.activation_time_started,
+                         device_updated.activation_step_time)
         self.assertEqual(device_updated.merchant.pk, merchant.pk)
         self.assertEqual(device_updated.account.pk, account_btc.pk)
         self.assertEqual(device.amount_1,
@@ -51,16 +54,14 @@ class ActivationTestCase(TestCase):
         self.assertEqual(device.max_payout,
                          account_btc.currency.max_payout)
 
-    @patch('api.utils.activation.rq_helpers.run_task')
     @patch('api.utils.activation.rq_helpers.run_periodic_task')
-    def test_start_with_activation(self, run_periodic_mock, run_mock):
+    def test_start_with_activation(self, run_periodic_mock):
 
-        def activate(fun, args, queue=None, timeout=None):
+        def activate(fun, args, queue=None, interval=None):
             device = Device.objects.get(key=args[0])
             device.activate()
             device.save()
-            return Mock()
-        run_mock.side_effect = activate
+        run_periodic_mock.side_effect = activate
 
         merchant = MerchantAccountFactory.create(currency__name='USD')
         account = AccountFactory.create(merchant=merchant,
@@ -80,97 +81,223 @@ class ActivationTestCase(TestCase):
         with self.assertRaises(TransitionNotAllowed):
             start(device, merchant)
 
-    @patch('api.utils.activation.Salt')
-    @patch('api.utils.activation.get_latest_version')
-    def test_prepare_device(self, get_version_mock, salt_cls_mock):
-        salt_cls_mock.return_value = salt_mock = Mock(**{
-            'ping.return_value': True,
-            'get_grain.return_value': 'qemuarm',
+
+class RunActivationTestCase(TestCase):
+
+    def _create_device(self, step, jid=None, **kwargs):
+        kwargs.setdefault('activation_time_started', timezone.now())
+        return DeviceFactory.create(
+            status='activation_in_progress',
+            activation_step=step,
+            activation_step_time=timezone.now(),
+            activation_jid=jid,
+            **kwargs)
+
+    @patch('api.utils.activation.get_salt')
+    @patch('api.utils.activation.rq_helpers.cancel_current_task')
+    def test_accept_key(self, cancel_mock, get_salt_mock):
+        get_salt_mock.return_value = salt_mock = Mock(**{
+            'start_job.return_value': 'jid-1',
+        })
+        device = self._create_device('accept_key')
+        run_activation(device.key)
+
+        self.assertEqual(salt_mock.accept.call_args[0][0], device.key)
+        self.assertEqual(salt_mock.start_job.call_args[0],
+                         (device.key, 'test.ping'))
+        device = Device.objects.get(pk=device.pk)
+        self.assertEqual(device.activation_step, 'await_ping')
+        self.assertEqual(device.activation_jid, 'jid-1')
+        self.assertIs(cancel_mock.called, False)
+
+    @patch('api.utils.activation.get_salt')
+    def test_await_ping_offline(self, get_salt_mock):
+        get_salt_mock.return_value = salt_mock = Mock(**{
+            'get_job_result.return_value': None,
+            'start_job.return_value': 'jid-2',
+        })
+        device = self._create_device('await_ping', jid='jid-1')
+        run_activation(device.key)
+
+        self.assertEqual(salt_mock.get_job_result.call_args[0],
+                         ('jid-1', device.key))
+        device = Device.objects.get(pk=device.pk)
+        self.assertEqual(device.activation_step, 'await_ping')
+        self.assertEqual(device.activation_jid, 'jid-2')
+
+    @patch('api.utils.activation.get_salt')
+    @patch('api.utils.activation.get_latest_versions')
+    def test_await_ping_online(self, get_version_mock, get_salt_mock):
+        get_salt_mock.return_value = salt_mock = Mock(**{
+            'get_job_result.side_effect': [True, None],
+            'start_job.return_value': 'jid-2',
         })
-        get_version_mock.side_effect = ['1.0', '1.1', '1.1-theme']
-        device = DeviceFactory.create(status='activation_in_progress')
-
-        prepare_device(device.key)
-        self.assertTrue(salt_mock.accept.called)
-        self.assertTrue(salt_mock.ping.called)
-        self.assertEqual(salt_mock.get_grain.call_count, 1)
-        self.assertEqual(get_version_mock.call_count, 3)
-        self.assertEqual(get_version_mock.call_args_list[0][0][0],
-                         'qemuarm')
-        self.assertEqual(get_version_mock.call_args_list[0][0][1],
-                         'xbterminal-rpc')
-        self.assertEqual(get_version_mock.call_args_list[1][0][1],
-                         'xbterminal-gui')
-        self.assertEqual(get_version_mock.call_args_list[2][0][1],
-                         'xbterminal-gui-theme-default')
-
-        self.assertTrue(salt_mock.highstate.called)
-        self.assertEqual(salt_mock.highstate.call_args[0][0], device.key)
-        self.assertEqual(salt_mock.highstate.call_args[0][2], 1800)
-        pillar_data = salt_mock.highstate.call_args[0][1]
+        device = self._create_device('await_ping', jid='jid-1')
+        run_activation(device.key)
+
+        self.assertEqual(salt_mock.start_job.call_args[0],
+                         (device.key, 'grains.item'))
+        self.assertEqual(salt_mock.start_job.call_args[1]['arg'],
+                         ['machine'])
+        self.assertIs(get_version_mock.called, False)
+        device = Device.objects.get(pk=device.pk)
+        self.assertEqual(device.activation_step, 'fetch_grains')
+        self.assertEqual(device.activation_jid, 'jid-2')
+
+    @patch('api.utils.activation.get_salt')
+    @patch('api.utils.activation.get_latest_versions')
+    def test_fetch_grains(self, get_version_mock, get_salt_mock):
+        get_salt_mock.return_value = salt_mock = Mock(**{
+            'get_job_result.side_effect': [{'machine': 'qemuarm'}, None],
+            'start_highstate.return_value': 'jid-3',
+        })
+        get_version_mock.return_value = {
+            'xbterminal-rpc': '1.0',
+            'xbterminal-gui': '1.1',
+            'xbterminal-gui-theme-default': '1.1-theme',
+        }
+        device = self._create_device('fetch_grains', jid='jid-2')
+        run_activation(device.key)
+
+        self.assertEqual(get_version_mock.call_count, 1)
+        self.assertEqual(get_version_mock.call_args[0][0], 'qemuarm')
+
+        self.assertEqual(salt_mock.start_highstate.call_args[0][0],
+                         device.key)
+        pillar_data = salt_mock.start_highstate.call_args[0][1]
         self.assertEqual(pillar_data['xbt']['rpc_version'], '1.0')
         self.assertEqual(pillar_data['xbt']['gui_version'], '1.1')
         self.assertEqual(pillar_data['xbt']['themes']['default'], '1.1-theme')
         self.assertEqual(pillar_data['xbt']['rpc_config'], {})
         self.assertEqual(pillar_data['xbt']['gui_config']['theme'], 'default')
+        # Highstate result is checked on the same run
+        self.assertEqual(salt_mock.get_job_result.call_args[0],
+                         ('jid-3', device.key))
+        device = Device.objects.get(pk=device.pk)
+        self.assertEqual(device.activation_step, 'await_highstate')
+        self.assertEqual(device.activation_jid, 'jid-3')
 
-        self.assertFalse(salt_mock.reboot.called)
+    @patch('api.utils.activation.get_salt')
+    def test_fetch_grains_waiting(self, get_salt_mock):
+        get_salt_mock.return_value = Mock(**{
+            'get_job_result.return_value': None,
+        })
+        device = self._create_device('fetch_grains', jid='jid-2')
+        run_activation(device.key)
+        device = Device.objects.get(pk=device.pk)
+        self.assertEqual(device.activation_step, 'fetch_grains')
+        self.assertEqual(device.activation_jid, 'jid-2')
+
+    @patch('api.utils.activation.get_salt')
+    @patch('api.utils.activation.get_latest_versions')
+    @patch('api.utils.activation.rq_helpers.cancel_current_task')
+    def test_package_not_found(self, cancel_mock, get_version_mock,
+                               get_salt_mock):
+        get_salt_mock.return_value = salt_mock = Mock(**{
+            'get_job_result.return_value': {'machine': 'qemuarm'},
+        })
+        get_version_mock.return_value = {
+            'xbterminal-rpc': '1.0',
+            'xbterminal-gui': '1.1',
+        }
+        device = self._create_device('fetch_grains', jid='jid-2')
+        run_activation(device.key)
 
-        device_updated = Device.objects.get(key=device.key)
-        self.assertEqual(device_updated.status,
-                         'activation_in_progress')  # Not changed
+        self.assertIs(salt_mock.start_highstate.called, False)
+        self.assertIs(cancel_mock.called, True)
+        device = Device.objects.get(pk=device.pk)
+        self.assertEqual(device.status, 'activation_error')
 
-    @patch('api.utils.activation.Job.fetch')
+    @patch('api.utils.activation.get_salt')
+    def test_resumed(self, get_salt_mock):
+        get_salt_mock.return_value = salt_mock = Mock(**{
+            'start_job.return_value': 'jid-2',
+        })
+        device = self._create_device('resolve_versions')
+        run_activation(device.key)
+
+        self.assertEqual(salt_mock.start_job.call_args[0],
+                         (device.key, 'grains.item'))
+        device = Device.objects.get(pk=device.pk)
+        self.assertEqual(device.activation_step, 'fetch_grains')
+        self.assertEqual(device.activation_jid, 'jid-2')
+
+    @patch('api.utils.activation.get_salt')
     @patch('api.utils.activation.rq_helpers.cancel_current_task')
-    def test_wait_for_activation(self, cancel_mock, job_fetch_mock):
-        job_fetch_mock.return_value = Mock(
-            is_failed=False,
-            started_at=datetime.datetime.now(),
-            timeout=600)
-        device = DeviceFactory.create(status='activation_in_progress')
-        job_id = 'test'
-        wait_for_activation(device.key, job_id)
-        self.assertFalse(cancel_mock.called)
+    def test_await_highstate(self, cancel_mock, get_salt_mock):
+        get_salt_mock.return_value = salt_mock = Mock(**{
+            'get_job_result.return_value': {'state': {'result': True}},
+        })
+        device = self._create_device('await_highstate', jid='jid-3')
+        run_activation(device.key)
+
+        self.assertIs(salt_mock.check_highstate_result.called, True)
+        device = Device.objects.get(pk=device.pk)
+        self.assertEqual(device.activation_step, 'await_activation')
+        self.assertIsNone(device.activation_jid)
+        self.assertIs(cancel_mock.called, False)
 
+    @patch('api.utils.activation.get_salt')
     @patch('api.utils.activation.rq_helpers.cancel_current_task')
-    def test_wait_for_activation_finished(self, cancel_mock):
-        device = DeviceFactory.create(status='active')
-        job_id = 'test'
-        wait_for_activation(device.key, job_id)
-        self.assertTrue(cancel_mock.called)
+    def test_highstate_error(self, cancel_mock, get_salt_mock):
+        get_salt_mock.return_value = Mock(**{
+            'get_job_result.return_value': ['error'],
+            'check_highstate_result.side_effect': SaltError,
+        })
+        device = self._create_device('await_highstate', jid='jid-3')
+        run_activation(device.key)
+
+        self.assertIs(cancel_mock.called, True)
+        self.assertEqual(cancel_mock.call_args[1]['queue'], 'low')
+        device = Device.objects.get(pk=device.pk)
+        self.assertEqual(device.status, 'activation_error')
+
+    @patch('api.utils.activation.get_salt')
+    @patch('api.utils.activation.rq_helpers.cancel_current_task')
+    def test_salt_api_error(self, cancel_mock, get_salt_mock):
+        get_salt_mock.return_value = Mock(**{
+            'accept.side_effect': requests.ConnectionError,
+        })
+        device = self._create_device('accept_key')
+        run_activation(device.key)
+
+        self.assertIs(cancel_mock.called, False)
+        device = Device.objects.get(pk=device.pk)
+        self.assertEqual(device.status, 'activation_in_progress')
+        self.assertEqual(device.activation_step, 'accept_key')
 
-    @patch('api.utils.activation.Job.fetch')
+    @patch('api.utils.activation.get_salt')
     @patch('api.utils.activation.rq_helpers.cancel_current_task')
-    def test_wait_for_activation_no_such_job(self, cancel_mock, job_fetch_mock):
-        job_fetch_mock.side_effect = NoSuchJobError
-        device = DeviceFactory.create(status='activation_in_progress')
-        job_id = 'test'
-        wait_for_activation(device.key, job_id)
-        self.assertFalse(cancel_mock.called)
-
-    @patch('api.utils.activation.Job.fetch')
+    def test_timeout(self, cancel_mock, get_salt_mock):
+        device = self._create_device('await_ping', jid='jid-1')
+        device.activation_step_time -= datetime.timedelta(hours=1)
+        device.save()
+        run_activation(device.key)
+
+        self.assertIs(get_salt_mock.called, False)
+        self.assertIs(cancel_mock.called, True)
+        device = Device.objects.get(pk=device.pk)
+        self.assertEqual(device.status, 'activation_error')
+
+    @patch('api.utils.activation.get_salt')
     @patch('api.utils.activation.rq_helpers.cancel_current_task')
-    def test_wait_for_activation_timeout(self, cancel_mock, job_fetch_mock):
-        job_fetch_mock.return_value = Mock(
-            started_at=datetime.datetime.now() - datetime.timedelta(minutes=20),
-            timeout=600)
-        device = DeviceFactory.create(status='activation_in_progress')
-        job_id = 'test'
-        wait_for_activation(device.key, job_id)
-        self.assertTrue(cancel_mock.called)
-        device_updated = Device.objects.get(pk=device.pk)
-        self.assertEqual(device_updated.status, 'activation_error')
+    def test_overall_timeout(self, cancel_mock, get_salt_mock):
+        # Step without timeout, retried because of Salt API errors
+        device = self._create_device(
+            'accept_key',
+            activation_time_started=timezone.now() - datetime.timedelta(
+                hours=1))
+        run_activation(device.key)
+
+        self.assertIs(get_salt_mock.called, False)
+        self.assertIs(cancel_mock.called, True)
+        device = Device.objects.get(pk=device.pk)
+        self.assertEqual(device.status, 'activation_error')
 
-    @patch('api.utils.activation.Job.fetch')
+    @patch('api.utils.activation.get_salt')
     @patch('api.utils.activation.rq_helpers.cancel_current_task')
-    def test_wait_for_activation_error(self, cancel_mock, job_fetch_mock):
-        job_fetch_mock.return_value = Mock(
-            is_failed=True,
-            started_at=datetime.datetime.now(),
-            timeout=600)
-        device = DeviceFactory.create(status='activation_in_progress')
-        job_id = 'test'
-        wait_for_activation(device.key, job_id)
-        self.assertTrue(cancel_mock.called)
-        device_updated = Device.objects.get(pk=device.pk)
-        self.assertEqual(device_updated.status, 'activation_error')
+    def test_finished(self, cancel_mock, get_salt_mock):
+        device = DeviceFactory.create(status='active')
+        run_activation(device.key)
+        self.assertIs(get_salt_mock.called, False)
+        self.assertIs(cancel_mock.called, True)
@@ -1,4 +1,5 @@
 from mock import Mock, patch
+from django.core.cache import cache
 from django.test import TestCase
 from django.test.utils import override_settings
 
@@ -15,15 +16,44 @@ from api.utils import aptly
 })
 class AptlyTestCase(TestCase):
 
+    def setUp(self):
+        cache.clear()
+
     @patch('api.utils.aptly.requests.get')
-    def test_get_latest_version(self, get_mock):
+    def test_get_latest_versions(self, get_mock):
         get_mock.return_value = Mock(**{
-            'json.return_value': [{
-                'Version': '0.9.6.20160822-b1-master-r0.0',
-            }],
+            'json.return_value': [
+                'Parmhf xbterminal-gui 0.9.6.20160822-b1-master-r0.0 a1',
+                'Parmhf xbterminal-gui 0.9.10.20160901-b1-master-r0.0 a2',
+                'Parmhf xbterminal-rpc 0.9.6.20160822-b1-master-r0.0 a3',
+            ],
+        })
+        versions = aptly.get_latest_versions('qemuarm')
+        self.assertEqual(versions, {
+            'xbterminal-gui': '0.9.10.20160901-b1-master-r0.0',
+            'xbterminal-rpc': '0.9.6.20160822-b1-master-r0.0',
         })
-        latest = aptly.get_latest_version('qemuarm', 'xbterminal-gui')
-        self.assertEqual(latest, '0.9.6.20160822-b1-master-r0.0')
         self.assertEqual(
             get_mock.call_args[0][0],
             'https://test/api/repos/xbtfw-qemuarm-dev/packages')
+        # Index is cached
+        self.assertEqual(aptly.get_latest_versions('qemuarm'), versions)
+        self.assertEqual(get_mock.call_count, 1)
+        # Other machine
+        aptly.get_latest_versions('raspberrypi')
+        self.assertEqual(get_mock.call_count, 2)
+
+    @patch('api.utils.aptly.requests.get')
+    def test_refresh_index(self, get_mock):
+        get_mock.return_value = Mock(**{
+            'json.return_value': ['Parmhf xbterminal-gui 1.0 a1'],
+        })
+        self.assertEqual(aptly.get_latest_versions('qemuarm'),
+                         {'xbterminal-gui': '1.0'})
+        get_mock.return_value = Mock(**{
+            'json.return_value': ['Parmhf xbterminal-gui 1.1 a2'],
+        })
+        aptly.refresh_index('qemuarm')
+        self.assertEqual(aptly.get_latest_versions('qemuarm'),
+                         {'xbterminal-gui': '1.1'})
+        self.assertEqual(get_mock.call_count, 2)
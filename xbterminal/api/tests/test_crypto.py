@@ -0,0 +1,40 @@
+from django.test import SimpleTestCase
+from mock import patch
+
+from api.utils import crypto
+
+
+class CryptoTestCase(SimpleTestCase):
+
+    def setUp(self):
+        crypto._public_key_cache.clear()
+
+    def test_verify_signature(self):
+        message = 'test'
+        public_key_pem, signature = crypto.create_test_signature(message)
+        self.assertIs(
+            crypto.verify_signature(public_key_pem, message, signature),
+            True)
+        self.assertIs(
+            crypto.verify_signature(public_key_pem, 'other', signature),
+            False)
+        self.assertIs(
+            crypto.verify_signature(public_key_pem, message, 'invalid'),
+            False)
+
+    @patch('api.utils.crypto.load_public_key',
+           wraps=crypto.load_public_key)
+    def test_get_public_key(self, load_mock):
+        public_key_pem_1 = crypto.create_test_public_key()
+        public_key_1 = crypto.get_public_key(public_key_pem_1, 'device')
+        self.assertIs(crypto.get_public_key(public_key_pem_1, 'device'),
+                      public_key_1)
+        self.assertEqual(load_mock.call_count, 1)
+        # API key changed
+        public_key_pem_2 = crypto.create_test_public_key()
+        public_key_2 = crypto.get_public_key(public_key_pem_2, 'device')
+        self.assertIsNot(public_key_2, public_key_1)
+        self.assertEqual(load_mock.call_count, 2)
+        # Other device
+        crypto.get_public_key(public_key_pem_1, 'other')
+        self.assertEqual(load_mock.call_count, 3)
@@ -0,0 +1,62 @@
+from django.test import SimpleTestCase
+from mock import Mock
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+from rest_framework.views import APIView
+
+from api.utils.idempotency import idempotent
+
+
+class IdempotentTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.handler_mock = handler_mock = Mock(
+            return_value=Response({'uid': 'test'}))
+
+        class TestView(APIView):
+
+            @idempotent
+            def post(self, request):
+                return handler_mock(request)
+
+        self.view = TestView.as_view()
+
+    def test_no_key(self):
+        for _ in range(2):
+            response = self.view(self.factory.post('/test/', {}))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.handler_mock.call_count, 2)
+
+    def test_in_progress(self):
+        view = self.view
+
+        def handler(request):
+            retry = view(self.factory.post(
+                '/test/', {}, HTTP_IDEMPOTENCY_KEY='in-progress'))
+            self.assertEqual(retry.status_code, status.HTTP_409_CONFLICT)
+            return Response({'uid': 'test'})
+
+        self.handler_mock.side_effect = handler
+        response = view(self.factory.post(
+            '/test/', {}, HTTP_IDEMPOTENCY_KEY='in-progress'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.handler_mock.call_count, 1)
+
+    def test_exception(self):
+        self.handler_mock.side_effect = [ValueError, Response({})]
+        request = self.factory.post('/test/', {},
+                                    HTTP_IDEMPOTENCY_KEY='exception')
+        with self.assertRaises(ValueError):
+            self.view(request)
+        response = self.view(self.factory.post(
+            '/test/', {}, HTTP_IDEMPOTENCY_KEY='exception'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.handler_mock.call_count, 2)
+
+    def test_key_too_long(self):
+        response = self.view(self.factory.post(
+            '/test/', {}, HTTP_IDEMPOTENCY_KEY='a' * 101))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIs(self.handler_mock.called, False)
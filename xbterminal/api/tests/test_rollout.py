@@ -0,0 +1,250 @@
+import datetime
+from mock import Mock, patch
+
+from django.test import TestCase
+from django.utils import timezone
+
+import requests
+
+from api.utils.rollout import start, run_rollout
+from api.utils.salt import SaltError
+from website.models import FirmwareRollout, FirmwareRolloutDevice
+from website.tests.factories import DeviceBatchFactory, DeviceFactory
+
+
+class RolloutTestCase(TestCase):
+
+    def _create_rollout(self, device_count, canary_count=0, **kwargs):
+        batch = DeviceBatchFactory.create()
+        rollout = FirmwareRollout.objects.create(batch=batch, **kwargs)
+        for idx in range(device_count):
+            FirmwareRolloutDevice.objects.create(
+                rollout=rollout,
+                device=DeviceFactory.create(batch=batch),
+                is_canary=idx < canary_count)
+        return rollout
+
+    def _get_statuses(self, rollout):
+        return list(rollout.devices.values_list('status', flat=True))
+
+    @patch('api.utils.rollout.rq_helpers.run_periodic_task')
+    def test_start(self, run_periodic_mock):
+        batch = DeviceBatchFactory.create()
+        DeviceFactory.create_batch(10, batch=batch)
+        DeviceFactory.create(batch=batch, status='registered')
+        rollout = FirmwareRollout.objects.create(
+            batch=batch, canary_percent=15)
+        start(rollout)
+
+        self.assertEqual(rollout.devices.count(), 10)
+        self.assertEqual(rollout.devices.filter(is_canary=True).count(), 2)
+        self.assertEqual(run_periodic_mock.call_args[0][0].__name__,
+                         'run_rollout')
+        self.assertEqual(run_periodic_mock.call_args[0][1], [rollout.pk])
+        self.assertEqual(run_periodic_mock.call_args[1]['queue'], 'low')
+
+    @patch('api.utils.rollout.get_salt')
+    @patch('api.utils.rollout.rq_helpers.cancel_current_task')
+    def test_canaries_first(self, cancel_mock, get_salt_mock):
+        get_salt_mock.return_value = salt_mock = Mock(**{
+            'start_job.return_value': 'jid-1',
+        })
+        rollout = self._create_rollout(5, canary_count=2, concurrency=3)
+        run_rollout(rollout.pk)
+
+        self.assertEqual(salt_mock.start_job.call_count, 2)
+        self.assertEqual(salt_mock.start_job.call_args[0][1], 'grains.item')
+        self.assertEqual(
+            list(rollout.devices.filter(status='fetch_grains').
+                 values_list('is_canary', flat=True)),
+            [True, True])
+        self.assertIs(cancel_mock.called, False)
+
+    @patch('api.utils.rollout.get_salt')
+    @patch('api.utils.rollout.rq_helpers.cancel_current_task')
+    def test_concurrency_window(self, cancel_mock, get_salt_mock):
+        get_salt_mock.return_value = salt_mock = Mock(**{
+            'start_job.return_value': 'jid-1',
+            'get_job_result.return_value': None,
+        })
+        rollout = self._create_rollout(5, concurrency=2)
+        run_rollout(rollout.pk)
+        self.assertEqual(salt_mock.start_job.call_count, 2)
+        # Window is full
+        run_rollout(rollout.pk)
+        self.assertEqual(salt_mock.start_job.call_count, 2)
+        self.assertEqual(self._get_statuses(rollout).count('pending'), 3)
+
+    @patch('api.utils.rollout.get_salt')
+    @patch('api.utils.rollout.get_pillar_data')
+    @patch('api.utils.rollout.rq_helpers.cancel_current_task')
+    def test_device_steps(self, cancel_mock, get_pillar_mock,
+                          get_salt_mock):
+        get_salt_mock.return_value = salt_mock = Mock(**{
+            'start_job.return_value': 'jid-1',
+            'get_job_result.return_value': {'machine': 'qemuarm'},
+            'start_highstate.return_value': 'jid-2',
+        })
+        get_pillar_mock.return_value = pillar_data = {'xbt': {}}
+        rollout = self._create_rollout(1)
+        run_rollout(rollout.pk)
+        run_rollout(rollout.pk)
+
+        rollout_device = rollout.devices.get()
+        self.assertEqual(get_pillar_mock.call_args[0][1], 'qemuarm')
+        self.assertEqual(salt_mock.start_highstate.call_args[0],
+                         (rollout_device.device.key, pillar_data))
+        self.assertEqual(rollout_device.status, 'highstate')
+        self.assertEqual(rollout_device.jid, 'jid-2')
+
+        run_rollout(rollout.pk)
+        self.assertEqual(salt_mock.check_highstate_result.call_count, 1)
+        rollout_device = rollout.devices.get()
+        self.assertEqual(rollout_device.status, 'succeeded')
+        rollout = FirmwareRollout.objects.get(pk=rollout.pk)
+        self.assertEqual(rollout.status, 'completed')
+        self.assertIsNotNone(rollout.time_finished)
+        self.assertEqual(cancel_mock.call_args[1]['queue'], 'low')
+
+    @patch('api.utils.rollout.get_salt')
+    @patch('api.utils.rollout.rq_helpers.cancel_current_task')
+    def test_device_timeout(self, cancel_mock, get_salt_mock):
+        get_salt_mock.return_value = Mock(**{
+            'get_job_result.return_value': None,
+        })
+        rollout = self._create_rollout(1)
+        rollout.devices.update(
+            status='highstate',
+            jid='jid-2',
+            time_step_started=timezone.now() - datetime.timedelta(hours=1))
+        run_rollout(rollout.pk)
+        rollout_device = rollout.devices.get()
+        self.assertEqual(rollout_device.status, 'failed')
+        self.assertEqual(rollout_device.error, 'timeout')
+
+    @patch('api.utils.rollout.get_salt')
+    @patch('api.utils.rollout.get_pillar_data')
+    @patch('api.utils.rollout.rq_helpers.cancel_current_task')
+    def test_step_timeout(self, cancel_mock, get_pillar_mock, get_salt_mock):
+        get_salt_mock.return_value = Mock(**{
+            'get_job_result.side_effect': [{'machine': 'qemuarm'}, None],
+            'start_highstate.return_value': 'jid-2',
+        })
+        get_pillar_mock.return_value = {'xbt': {}}
+        rollout = self._create_rollout(1)
+        # Slow grains fetch doesn't shorten highstate window
+        time_started = timezone.now() - datetime.timedelta(minutes=4)
+        rollout.devices.update(
+            status='fetch_grains',
+            jid='jid-1',
+            time_started=time_started,
+            time_step_started=time_started)
+        run_rollout(rollout.pk)
+        rollout_device = rollout.devices.get()
+        self.assertEqual(rollout_device.status, 'highstate')
+        self.assertGreater(rollout_device.time_step_started, time_started)
+
+        rollout_device.time_step_started -= datetime.timedelta(minutes=20)
+        rollout_device.save()
+        run_rollout(rollout.pk)
+        rollout_device = rollout.devices.get()
+        self.assertEqual(rollout_device.status, 'highstate')
+        self.assertEqual(rollout_device.time_started, time_started)
+
+    @patch('api.utils.rollout.get_salt')
+    @patch('api.utils.rollout.rq_helpers.cancel_current_task')
+    def test_rollout_timeout(self, cancel_mock, get_salt_mock):
+        rollout = self._create_rollout(3, time_limit=1)
+        FirmwareRollout.objects.filter(pk=rollout.pk).update(
+            created_at=timezone.now() - datetime.timedelta(hours=2))
+        rollout.devices.filter(pk=rollout.devices.first().pk).update(
+            status='highstate', jid='jid-2', time_step_started=timezone.now())
+        run_rollout(rollout.pk)
+
+        self.assertIs(get_salt_mock.called, False)
+        rollout = FirmwareRollout.objects.get(pk=rollout.pk)
+        self.assertEqual(rollout.status, 'aborted')
+        self.assertIsNotNone(rollout.time_finished)
+        self.assertEqual(self._get_statuses(rollout),
+                         ['failed', 'skipped', 'skipped'])
+        self.assertEqual(rollout.devices.first().error, 'rollout timeout')
+        self.assertIs(cancel_mock.called, True)
+
+    @patch('api.utils.rollout.get_salt')
+    @patch('api.utils.rollout.rq_helpers.cancel_current_task')
+    def test_error_threshold(self, cancel_mock, get_salt_mock):
+        get_salt_mock.return_value = salt_mock = Mock(**{
+            'get_job_result.return_value': ['error'],
+            'check_highstate_result.side_effect': [None, SaltError('error')],
+        })
+        rollout = self._create_rollout(
+            10, canary_count=3, error_threshold=20)
+        canaries = rollout.devices.filter(is_canary=True)
+        canaries.update(status='highstate', jid='jid-2',
+                        time_step_started=timezone.now())
+        canaries.filter(pk=canaries[2].pk).update(status='succeeded')
+        run_rollout(rollout.pk)
+
+        rollout = FirmwareRollout.objects.get(pk=rollout.pk)
+        self.assertEqual(rollout.status, 'aborted')
+        self.assertIsNotNone(rollout.time_finished)
+        statuses = self._get_statuses(rollout)
+        self.assertEqual(statuses.count('succeeded'), 2)
+        self.assertEqual(statuses.count('failed'), 1)
+        self.assertEqual(statuses.count('skipped'), 7)
+        self.assertIs(salt_mock.start_job.called, False)
+        self.assertIs(cancel_mock.called, True)
+
+    @patch('api.utils.rollout.get_salt')
+    @patch('api.utils.rollout.rq_helpers.cancel_current_task')
+    def test_error_threshold_canaries_in_progress(self, cancel_mock,
+                                                  get_salt_mock):
+        get_salt_mock.return_value = Mock(**{
+            'get_job_result.side_effect': [['error'], None, None],
+            'check_highstate_result.side_effect': SaltError('error'),
+        })
+        rollout = self._create_rollout(
+            10, canary_count=3, error_threshold=20)
+        rollout.devices.filter(is_canary=True).update(
+            status='highstate', jid='jid-2', time_step_started=timezone.now())
+        run_rollout(rollout.pk)
+
+        rollout = FirmwareRollout.objects.get(pk=rollout.pk)
+        self.assertEqual(rollout.status, 'in_progress')
+        statuses = self._get_statuses(rollout)
+        self.assertEqual(statuses.count('failed'), 1)
+        self.assertEqual(statuses.count('highstate'), 2)
+        self.assertEqual(statuses.count('pending'), 7)
+        self.assertIs(cancel_mock.called, False)
+
+    @patch('api.utils.rollout.get_salt')
+    @patch('api.utils.rollout.rq_helpers.cancel_current_task')
+    def test_error_threshold_min_finished(self, cancel_mock, get_salt_mock):
+        get_salt_mock.return_value = salt_mock = Mock(**{
+            'get_job_result.return_value': ['error'],
+            'check_highstate_result.side_effect': SaltError('error'),
+            'start_job.return_value': 'jid-1',
+        })
+        rollout = self._create_rollout(
+            20, error_threshold=20, concurrency=5)
+        rollout.devices.filter(pk=rollout.devices.first().pk).update(
+            status='highstate', jid='jid-2', time_step_started=timezone.now())
+        run_rollout(rollout.pk)
+
+        rollout = FirmwareRollout.objects.get(pk=rollout.pk)
+        self.assertEqual(rollout.status, 'in_progress')
+        statuses = self._get_statuses(rollout)
+        self.assertEqual(statuses.count('failed'), 1)
+        self.assertEqual(statuses.count('fetch_grains'), 5)
+        self.assertEqual(salt_mock.start_job.call_count, 5)
+
+    @patch('api.utils.rollout.get_salt')
+    @patch('api.utils.rollout.rq_helpers.cancel_current_task')
+    def test_salt_api_error(self, cancel_mock, get_salt_mock):
+        get_salt_mock.return_value = Mock(**{
+            'start_job.side_effect': requests.ConnectionError,
+        })
+        rollout = self._create_rollout(2)
+        run_rollout(rollout.pk)
+        self.assertEqual(self._get_statuses(rollout), ['pending'] * 2)
+        self.assertIs(cancel_mock.called, False)
@@ -1,8 +1,15 @@
+import time
+
 from mock import Mock, patch
+from django.core.cache import cache
 from django.test import TestCase
 from django.test.utils import override_settings
 
-from api.utils.salt import Salt, SaltTimeout
+from api.utils.salt import (
+    Salt,
+    SaltError,
+    get_salt,
+    parse_pkg_versions)
 
 
 @override_settings(SALT_SERVERS={
@@ -17,14 +24,70 @@ from api.utils.salt import Salt, SaltTimeout
 })
 class SaltTestCase(TestCase):
 
-    @patch('api.utils.salt.requests.request')
+    def setUp(self):
+        cache.clear()
+
+    @patch('api.utils.salt.requests.Session.request')
     def test_login(self, request_mock):
         request_mock.return_value = Mock(**{
-            'json.return_value': {'return': [{'token': 'abc'}]},
+            'status_code': 200,
+            'json.return_value': {'return': [{
+                'token': 'abc',
+                'expire': time.time() + 3600,
+            }]},
         })
         salt = Salt()
         salt.login()
         self.assertEqual(salt._auth_token, 'abc')
+        self.assertEqual(request_mock.call_count, 1)
+        self.assertEqual(cache.get('salt-token-default'), 'abc')
+        # Token is taken from cache
+        salt = Salt()
+        salt.login()
+        self.assertEqual(salt._auth_token, 'abc')
+        self.assertEqual(request_mock.call_count, 1)
+        # Forced login
+        salt.login(force=True)
+        self.assertEqual(request_mock.call_count, 2)
+
+    @patch('api.utils.salt.requests.Session.request')
+    def test_send_request_token_expired(self, request_mock):
+        cache.set('salt-token-default', 'abc')
+        request_mock.side_effect = [
+            Mock(status_code=401),
+            Mock(**{
+                'status_code': 200,
+                'json.return_value': {'return': [{
+                    'token': 'def',
+                    'expire': time.time() + 3600,
+                }]},
+            }),
+            Mock(**{
+                'status_code': 200,
+                'json.return_value': {'return': [{'m1': True}]},
+            }),
+        ]
+        salt = Salt()
+        result = salt._send_request('post', '/', data={'fun': 'test.ping'})
+        self.assertEqual(result, {'m1': True})
+        self.assertEqual(request_mock.call_count, 3)
+        self.assertEqual(
+            request_mock.call_args_list[0][1]['headers']['X-Auth-Token'],
+            'abc')
+        self.assertEqual(
+            request_mock.call_args_list[2][1]['headers']['X-Auth-Token'],
+            'def')
+        self.assertEqual(
+            request_mock.call_args_list[2][1]['headers']['Content-Type'],
+            'application/json')
+        self.assertEqual(request_mock.call_args_list[2][1]['data'],
+                         '{"fun": "test.ping"}')
+        self.assertEqual(cache.get('salt-token-default'), 'def')
+
+    def test_get_salt(self):
+        salt = get_salt()
+        self.assertIsInstance(salt, Salt)
+        self.assertIs(get_salt(), salt)
 
     @patch('api.utils.salt.Salt._send_request')
     def test_check_fingerprint(self, send_mock):
@@ -49,102 +112,53 @@ class SaltTestCase(TestCase):
         }
         salt = Salt()
         self.assertIsNone(salt.accept('m1'))
-        with self.assertRaises(AssertionError):
+        with self.assertRaises(SaltError):
             salt.accept('m2')
 
     @patch('api.utils.salt.Salt._send_request')
-    @patch('api.utils.salt.Salt._lookup_jid')
-    def test_ping(self, lookup_jid_mock, send_mock):
+    def test_start_job(self, send_mock):
         send_mock.return_value = {'jid': 'test'}
-        lookup_jid_mock.return_value = {'m1': True}
         salt = Salt()
-        self.assertTrue(salt.ping('m1'))
-        self.assertEqual(send_mock.call_args[1]['data']['client'],
-                         'local_async')
-        self.assertTrue(lookup_jid_mock.called)
+        jid = salt.start_job('m1', 'grains.item', arg=['machine'])
+        self.assertEqual(jid, 'test')
+        payload = send_mock.call_args[1]['data']
+        self.assertEqual(payload['client'], 'local_async')
+        self.assertEqual(payload['fun'], 'grains.item')
+        self.assertEqual(payload['tgt'], 'm1')
+        self.assertEqual(payload['arg'], ['machine'])
+        self.assertNotIn('kwarg', payload)
+        self.assertNotIn('expr_form', payload)
 
     @patch('api.utils.salt.Salt._send_request')
-    @patch('api.utils.salt.time.time')
-    @patch('api.utils.salt.Salt._lookup_jid')
-    def test_ping_timeout(self, lookup_jid_mock, time_mock, send_mock):
+    def test_start_job_list_target(self, send_mock):
         send_mock.return_value = {'jid': 'test'}
-        time_mock.side_effect = [1000, 1000000]
-        lookup_jid_mock.return_value = {}
         salt = Salt()
-        self.assertFalse(salt.ping('m1'))
-        self.assertTrue(send_mock.called)
-        self.assertFalse(lookup_jid_mock.called)
+        salt.start_job(['m1', 'm2'], 'pkg.info_installed')
+        payload = send_mock.call_args[1]['data']
+        self.assertEqual(payload['tgt'], 'm1,m2')
+        self.assertEqual(payload['expr_form'], 'list')
 
-    @patch('api.utils.salt.Salt._send_request')
     @patch('api.utils.salt.Salt._lookup_jid')
-    def test_get_grain(self, lookup_jid_mock, send_mock):
-        send_mock.return_value = {'jid': 'test'}
-        lookup_jid_mock.return_value = {'m1': {'machine': 'qemuarm'}}
-        salt = Salt()
-        grain = salt.get_grain('m1', 'machine')
-        self.assertEqual(grain, 'qemuarm')
-        self.assertEqual(send_mock.call_args[1]['data']['client'],
-                         'local_async')
-        self.assertTrue(lookup_jid_mock.called)
-
-    @patch('api.utils.salt.Salt._send_request')
-    @patch('api.utils.salt.time.time')
-    @patch('api.utils.salt.Salt._lookup_jid')
-    def test_get_grain_timeout(self, lookup_jid_mock, time_mock, send_mock):
-        send_mock.return_value = {'jid': 'test'}
-        time_mock.side_effect = [1000, 1000000]
+    def test_get_job_result(self, lookup_jid_mock):
         lookup_jid_mock.return_value = {}
         salt = Salt()
-        with self.assertRaises(SaltTimeout):
-            salt.get_grain('m1', 'machine')
-        self.assertTrue(send_mock.called)
-        self.assertFalse(lookup_jid_mock.called)
-
-    @patch('api.utils.salt.Salt._send_request')
-    @patch('api.utils.salt.Salt._lookup_jid')
-    def test_highstate(self, lookup_jid_mock, send_mock):
-        send_mock.return_value = {'jid': 'test'}
-        lookup_jid_mock.return_value = {
-            'm1': {
-                'pkg_|-xbterminal-firmware_|-xbterminal-firmware_|-installed': {
-                    'result': True,
-                },
-            },
-        }
-        salt = Salt()
-        salt.highstate('m1', {'test': 'test'}, 1200)
-        self.assertTrue(send_mock.called)
-        payload = send_mock.call_args[1]['data']
-        self.assertEqual(payload['kwarg']['pillar']['test'], 'test')
-        self.assertTrue(lookup_jid_mock.called)
+        self.assertIsNone(salt.get_job_result('test', 'm1'))
+        lookup_jid_mock.return_value = {'m1': True}
+        self.assertIs(salt.get_job_result('test', 'm1'), True)
         self.assertEqual(lookup_jid_mock.call_args[0][0], 'test')
 
-    @patch('api.utils.salt.logger')
-    @patch('api.utils.salt.Salt._send_request')
-    @patch('api.utils.salt.time.time')
-    @patch('api.utils.salt.Salt._lookup_jid')
-    def test_highstate_timeout(self, lookup_jid_mock, time_mock,
-                               send_mock, logger_mock):
-        send_mock.return_value = {'jid': 'test'}
-        time_mock.side_effect = [1000, 1000000]
-        lookup_jid_mock.return_value = {}
+    def test_check_highstate_result(self):
         salt = Salt()
-        with self.assertRaises(SaltTimeout):
-            salt.highstate('m1', {'test': 'test'}, 1200)
-        self.assertTrue(send_mock.called)
-        self.assertFalse(lookup_jid_mock.called)
+        salt.check_highstate_result({'state': {'result': True}})
+        with self.assertRaises(SaltError):
+            salt.check_highstate_result(
+                {'state': {'result': False, 'comment': 'error'}})
+        with self.assertRaises(SaltError):
+            salt.check_highstate_result(['Pillar failed to render'])
 
-    @patch('api.utils.salt.Salt._send_request')
-    def test_get_pkg_versions(self, send_mock):
-        send_mock.return_value = {
-            'm1': {
-                'xbterminal-rpc': {'version': '1.0.0'},
-            },
-        }
-        salt = Salt()
-        versions = salt.get_pkg_versions('m1', ['xbterminal-rpc'])
-        self.assertEqual(send_mock.call_args[1]['data']['client'],
-                         'local')
-        self.assertEqual(send_mock.call_args[1]['data']['arg'],
-                         ['xbterminal-rpc'])
-        self.assertEqual(versions, {'xbterminal-rpc': '1.0.0'})
+    def test_parse_pkg_versions(self):
+        self.assertEqual(
+            parse_pkg_versions({'xbterminal-rpc': {'version': '1.0.0'}}),
+            {'xbterminal-rpc': '1.0.0'})
+        with self.assertRaises(SaltError):
+            parse_pkg_versions('Minion did not return')
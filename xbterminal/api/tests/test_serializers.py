@@ -224,9 +224,9 @@ class DeviceSerializerTestCase(TestCase):
 
 class DeviceRegistrationSerializerTestCase(TestCase):
 
-    @patch('api.serializers.Salt')
-    def test_validation(self, salt_cls_mock):
-        salt_cls_mock.return_value = salt_mock = Mock(**{
+    @patch('api.serializers.get_salt')
+    def test_validation(self, get_salt_mock):
+        get_salt_mock.return_value = salt_mock = Mock(**{
             'check_fingerprint.return_value': True})
         batch = DeviceBatchFactory.create()
         device_key = hashlib.sha256('test').hexdigest()
@@ -239,7 +239,6 @@ class DeviceRegistrationSerializerTestCase(TestCase):
         }
         serializer = DeviceRegistrationSerializer(data=data)
         self.assertTrue(serializer.is_valid())
-        self.assertTrue(salt_mock.login.called)
         self.assertTrue(salt_mock.check_fingerprint.called)
         device = serializer.save()
         self.assertFalse(salt_mock.accept.called)
@@ -251,9 +250,9 @@ class DeviceRegistrationSerializerTestCase(TestCase):
         self.assertEqual(device.api_key, api_key)
         self.assertEqual(device.batch.pk, batch.pk)
 
-    @patch('api.serializers.Salt')
-    def test_batch_size(self, salt_cls_mock):
-        salt_cls_mock.return_value = Mock(**{
+    @patch('api.serializers.get_salt')
+    def test_batch_size(self, get_salt_mock):
+        get_salt_mock.return_value = Mock(**{
             'check_fingerprint.return_value': True})
         batch = DeviceBatchFactory.create(size=0)
         data = {
@@ -267,9 +266,9 @@ class DeviceRegistrationSerializerTestCase(TestCase):
         self.assertEqual(serializer.errors['batch'][0],
                          'Registration limit exceeded.')
 
-    @patch('api.serializers.Salt')
-    def test_invalid_device_key(self, salt_cls_mock):
-        salt_cls_mock.return_value = Mock(**{
+    @patch('api.serializers.get_salt')
+    def test_invalid_device_key(self, get_salt_mock):
+        get_salt_mock.return_value = Mock(**{
             'check_fingerprint.return_value': True})
         batch = DeviceBatchFactory.create()
         data = {
@@ -296,9 +295,9 @@ class DeviceRegistrationSerializerTestCase(TestCase):
         self.assertEqual(serializer.errors['key'][0],
                          'Device is already registered.')
 
-    @patch('api.serializers.Salt')
-    def test_invalid_api_key(self, salt_cls_mock):
-        salt_cls_mock.return_value = Mock(**{
+    @patch('api.serializers.get_salt')
+    def test_invalid_api_key(self, get_salt_mock):
+        get_salt_mock.return_value = Mock(**{
             'check_fingerprint.return_value': True})
         batch = DeviceBatchFactory.create()
         data = {
@@ -317,9 +316,9 @@ class DeviceRegistrationSerializerTestCase(TestCase):
         self.assertEqual(serializer.errors['api_key'][0],
                          'Invalid API public key.')
 
-    @patch('api.serializers.Salt')
-    def test_invalid_salt_fingerprint(self, salt_cls_mock):
-        salt_cls_mock.return_value = salt_mock = Mock(**{
+    @patch('api.serializers.get_salt')
+    def test_invalid_salt_fingerprint(self, get_salt_mock):
+        get_salt_mock.return_value = salt_mock = Mock(**{
             'check_fingerprint.return_value': False,
         })
         batch = DeviceBatchFactory.create()
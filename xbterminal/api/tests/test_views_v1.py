@@ -31,7 +31,8 @@ class DevicesViewTestCase(TestCase):
         self.assertEqual(data['token_type'], 'Bearer')
         return data['access_token']
 
-    def test_list(self):
+    @patch('website.utils.heartbeat.get_connection')
+    def test_list(self, connection_mock):
         merchant = MerchantAccountFactory.create()
         device = DeviceFactory.create(merchant=merchant)
         access_token = self._get_access_token(merchant.user)
@@ -45,7 +46,8 @@ class DevicesViewTestCase(TestCase):
         self.assertEqual(len(data), 1)
         self.assertEqual(data[0]['name'], device.name)
 
-    def test_create_device(self):
+    @patch('website.utils.heartbeat.get_connection')
+    def test_create_device(self, connection_mock):
         merchant = MerchantAccountFactory.create()
         access_token = self._get_access_token(merchant.user)
         devices_url = reverse('api:devices')
@@ -68,7 +70,8 @@ class DevicesViewTestCase(TestCase):
 
 class DeviceSettingsViewTestCase(TestCase):
 
-    def test_settings(self):
+    @patch('website.utils.heartbeat.get_connection')
+    def test_settings(self, connection_mock):
         device = DeviceFactory.create()
         url = reverse('api:device', kwargs={'key': device.key})
         response = self.client.get(url)
@@ -1,20 +1,23 @@
-import datetime
 from decimal import Decimal
+import datetime
 import hashlib
+import time
 
 from django.conf import settings
 from django.core.urlresolvers import reverse
+from django.db.models.query import QuerySet
 from django.utils import timezone
 from mock import patch, Mock
 from rest_framework.test import APITestCase, APIRequestFactory
 from rest_framework import status
-from constance.test import override_config
 
 from api.views_v2 import WithdrawalViewSet
 from api.utils.crypto import create_test_signature, create_test_public_key
 from transactions.exceptions import TransactionError
+from transactions.models import Deposit
 from transactions.tests.factories import DepositFactory, WithdrawalFactory
 from website.models import Device
+from website.utils import device_config
 from website.tests.factories import (
     AccountFactory,
     DeviceFactory,
@@ -157,6 +160,90 @@ class DepositViewSetTestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertEqual(response.data['device'][0], 'Transaction error')
 
+    @patch('api.views_v2.prepare_deposits')
+    def test_bulk_create(self, prepare_mock):
+        account = AccountFactory()
+        prepare_mock.return_value = deposits = DepositFactory.create_batch(
+            2, account=account, device=None)
+
+        url = reverse('api:v2:deposit-bulk')
+        response = self.client.post(
+            url,
+            {'account': account.pk, 'amounts': ['10.00', '5.50']},
+            format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['uid'] for item in response.data],
+                         [deposit.uid for deposit in deposits])
+        self.assertIn('payment_uri', response.data[0])
+        self.assertIn(deposits[0].uid, response.data[0]['payment_uri'])
+        self.assertEqual(prepare_mock.call_args[0][0], account)
+        self.assertEqual(prepare_mock.call_args[0][1],
+                         [Decimal('10.00'), Decimal('5.50')])
+
+    def test_bulk_create_invalid(self):
+        account = AccountFactory()
+        url = reverse('api:v2:deposit-bulk')
+        response = self.client.post(
+            url, {'account': account.pk, 'amounts': []}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('amounts', response.data)
+        response = self.client.post(
+            url, {'account': 0, 'amounts': ['aaa']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['account'][0], 'Invalid account ID.')
+        self.assertIn('amounts', response.data)
+
+    @patch('api.views_v2.prepare_deposits')
+    def test_bulk_create_payment_error(self, prepare_mock):
+        prepare_mock.side_effect = TransactionError
+        account = AccountFactory()
+        url = reverse('api:v2:deposit-bulk')
+        response = self.client.post(
+            url, {'account': account.pk, 'amounts': ['10']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['account'][0], 'Transaction error')
+
+    @patch('api.views_v2.prepare_deposit')
+    def test_create_idempotent(self, prepare_mock):
+        account = AccountFactory()
+        prepare_mock.return_value = deposit = DepositFactory(
+            account=account, device=None)
+        url = reverse('api:v2:deposit-list')
+        form_data = {'account': account.pk, 'amount': '10.00'}
+        response_1 = self.client.post(
+            url, form_data, HTTP_IDEMPOTENCY_KEY='deposit-create-1')
+        self.assertEqual(response_1.status_code, status.HTTP_200_OK)
+        self.assertNotIn('Idempotent-Replayed', response_1)
+        response_2 = self.client.post(
+            url, form_data, HTTP_IDEMPOTENCY_KEY='deposit-create-1')
+        self.assertEqual(response_2.status_code, status.HTTP_200_OK)
+        self.assertEqual(response_2['Idempotent-Replayed'], 'true')
+        self.assertEqual(response_2.data, response_1.data)
+        self.assertEqual(response_2.data['uid'], deposit.uid)
+        self.assertEqual(prepare_mock.call_count, 1)
+        # Key is reused for another request
+        response_3 = self.client.post(
+            url, {'account': account.pk, 'amount': '20.00'},
+            HTTP_IDEMPOTENCY_KEY='deposit-create-1')
+        self.assertEqual(response_3.status_code,
+                         status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(prepare_mock.call_count, 1)
+
+    @patch('api.views_v2.prepare_deposit')
+    def test_create_idempotent_error(self, prepare_mock):
+        prepare_mock.side_effect = [TransactionError, DepositFactory()]
+        account = AccountFactory()
+        url = reverse('api:v2:deposit-list')
+        form_data = {'account': account.pk, 'amount': '10.00'}
+        response = self.client.post(
+            url, form_data, HTTP_IDEMPOTENCY_KEY='deposit-create-2')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        # Errors are not saved
+        response = self.client.post(
+            url, form_data, HTTP_IDEMPOTENCY_KEY='deposit-create-2')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(prepare_mock.call_count, 2)
+
     def test_retrieve_not_notified(self):
         deposit = DepositFactory()
         url = reverse('api:v2:deposit-detail',
@@ -180,6 +267,169 @@ class DepositViewSetTestCase(APITestCase):
         deposit.refresh_from_db()
         self.assertIsNotNone(deposit.time_notified)
 
+    @patch('transactions.utils.status_events.get_connection')
+    @patch('transactions.utils.status_cache.transaction.on_commit',
+           side_effect=lambda func: func())
+    def test_retrieve_cached(self, on_commit_mock, connection_mock):
+        deposit = DepositFactory(broadcasted=True)
+        url = reverse('api:v2:deposit-detail',
+                      kwargs={'uid': deposit.uid})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], 'notified')
+        deposit.refresh_from_db()
+        time_notified = deposit.time_notified
+        # Version has changed, representation is cached on next request
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], 'notified')
+        deposit.refresh_from_db()
+        self.assertEqual(deposit.time_notified, time_notified)
+
+        deposit.time_confirmed = timezone.now()
+        deposit.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], 'confirmed')
+        self.assertNotEqual(response['ETag'], etag)
+
+    @patch('transactions.utils.status_events.get_connection')
+    @patch('transactions.utils.status_cache.transaction.on_commit',
+           side_effect=lambda func: func())
+    def test_list(self, on_commit_mock, connection_mock):
+        deposit_1 = DepositFactory(broadcasted=True)
+        deposit_2 = DepositFactory()
+        connection_mock.reset_mock()
+        url = reverse('api:v2:deposit-list')
+        with self.assertNumQueries(3):
+            response = self.client.get(
+                url, {'uid': [deposit_2.uid, 'unknown', deposit_1.uid]})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['uid'] for item in response.data],
+                         [deposit_2.uid, deposit_1.uid])
+        self.assertEqual([item['status'] for item in response.data],
+                         ['new', 'notified'])
+        self.assertIn('btc_amount', response.data[0])
+        deposit_1.refresh_from_db()
+        self.assertIsNotNone(deposit_1.time_notified)
+        self.assertEqual(connection_mock.return_value.publish.call_count, 1)
+
+    @patch('transactions.utils.status_events.get_connection')
+    @patch('transactions.utils.status_cache.transaction.on_commit',
+           side_effect=lambda func: func())
+    def test_list_notified_concurrently(self, on_commit_mock,
+                                        connection_mock):
+        deposit_1 = DepositFactory(broadcasted=True)
+        deposit_2 = DepositFactory(broadcasted=True)
+        connection_mock.reset_mock()
+        time_notified = timezone.now() - datetime.timedelta(seconds=1)
+        update = QuerySet.update
+
+        def concurrent_update(queryset, **kwargs):
+            # Another request notifies the first deposit
+            update(Deposit.objects.filter(pk=deposit_1.pk),
+                   time_notified=time_notified)
+            return update(queryset, **kwargs)
+
+        url = reverse('api:v2:deposit-list')
+        with patch.object(QuerySet, 'update', concurrent_update):
+            response = self.client.get(
+                url, {'uid': [deposit_1.uid, deposit_2.uid]})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['status'] for item in response.data],
+                         ['notified', 'notified'])
+        deposit_1.refresh_from_db()
+        self.assertEqual(deposit_1.time_notified, time_notified)
+        # Only the change made by this request is published
+        self.assertEqual(connection_mock.return_value.publish.call_count, 1)
+        self.assertEqual(connection_mock.return_value.publish.call_args[0][1],
+                         deposit_2.uid)
+
+    def test_list_invalid(self):
+        url = reverse('api:v2:deposit-list')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(url, {'uid': ['test'] * 101})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @patch('transactions.utils.status_events.get_connection')
+    def test_wait_changed(self, connection_mock):
+        deposit = DepositFactory(received=True)
+        url = reverse('api:v2:deposit-wait', kwargs={'uid': deposit.uid})
+        response = self.client.get(url, {'status': 'new'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], 'received')
+        pubsub_mock = connection_mock.return_value.pubsub.return_value
+        self.assertEqual(pubsub_mock.subscribe.call_args[0][0],
+                         'xbt:status:deposit:{0}'.format(deposit.uid))
+        self.assertIs(pubsub_mock.get_message.called, False)
+        self.assertIs(pubsub_mock.close.called, True)
+
+    @patch('transactions.utils.status_events.get_connection')
+    @patch('transactions.utils.status_cache.transaction.on_commit',
+           side_effect=lambda func: func())
+    def test_wait_notification(self, on_commit_mock, connection_mock):
+        deposit = DepositFactory()
+
+        def publish(timeout):
+            deposit.time_received = timezone.now()
+            deposit.save()
+            return {'type': 'message'}
+
+        connection_mock.return_value.pubsub.return_value.\
+            get_message.side_effect = publish
+        url = reverse('api:v2:deposit-wait', kwargs={'uid': deposit.uid})
+        response = self.client.get(url, {'status': 'new'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], 'received')
+
+    @patch('transactions.utils.status_events.get_connection')
+    def test_wait_timeout(self, connection_mock):
+        connection_mock.return_value.pubsub.return_value.\
+            get_message.return_value = None
+        deposit = DepositFactory()
+        url = reverse('api:v2:deposit-wait', kwargs={'uid': deposit.uid})
+        response = self.client.get(url, {'status': 'new', 'timeout': 0.1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], 'new')
+
+    @patch('transactions.utils.status_events.get_connection')
+    @patch('transactions.utils.status_cache.transaction.on_commit',
+           side_effect=lambda func: func())
+    @patch('api.views_v2.connection')
+    def test_wait_invalid_timeout(self, db_connection_mock, on_commit_mock,
+                                  connection_mock):
+        db_connection_mock.in_atomic_block = False
+        get_message_mock = connection_mock.return_value.pubsub.\
+            return_value.get_message
+        url_name = 'api:v2:deposit-wait'
+        for timeout in ['nan', '-1', '0', 'inf']:
+            deposit = DepositFactory()
+
+            def publish(timeout):
+                deposit.time_received = timezone.now()
+                deposit.save()
+                return {'type': 'message'}
+
+            get_message_mock.side_effect = publish
+            url = reverse(url_name, kwargs={'uid': deposit.uid})
+            response = self.client.get(
+                url, {'status': 'new', 'timeout': timeout})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data['status'], 'received')
+            wait_timeout = get_message_mock.call_args[1]['timeout']
+            self.assertGreater(wait_timeout, 29)
+            self.assertLessEqual(wait_timeout, 30)
+        self.assertEqual(db_connection_mock.close.call_count, 4)
+
     def test_cancel_new(self):
         deposit = DepositFactory()
         url = reverse('api:v2:deposit-cancel', kwargs={'uid': deposit.uid})
@@ -340,6 +590,34 @@ class WithdrawalViewSetTestCase(APITestCase):
                          str(withdrawal.effective_exchange_rate))
         self.assertEqual(response.data['status'], 'new')
 
+    @patch('api.views_v2.prepare_withdrawal')
+    def test_create_idempotent(self, prepare_mock):
+        device = DeviceFactory.create()
+        prepare_mock.return_value = withdrawal = WithdrawalFactory(
+            device=device)
+
+        view = WithdrawalViewSet.as_view(actions={'post': 'create'})
+        form_data = {
+            'device': device.key,
+            'amount': '1.00',
+        }
+        url = reverse('api:v2:withdrawal-list')
+        request_1 = self.factory.post(url, form_data, format='multipart',
+                                      HTTP_IDEMPOTENCY_KEY='withdrawal-1')
+        device.api_key, signature = create_test_signature(request_1.body)
+        device.save()
+        request_1.META['HTTP_X_SIGNATURE'] = signature
+        request_2 = self.factory.post(url, form_data, format='multipart',
+                                      HTTP_IDEMPOTENCY_KEY='withdrawal-1')
+        request_2.META['HTTP_X_SIGNATURE'] = signature
+
+        response_1 = view(request_1)
+        self.assertEqual(response_1.status_code, status.HTTP_200_OK)
+        response_2 = view(request_2)
+        self.assertEqual(response_2.status_code, status.HTTP_200_OK)
+        self.assertEqual(response_2.data['uid'], withdrawal.uid)
+        self.assertEqual(prepare_mock.call_count, 1)
+
     def test_create_invalid_device_key(self):
         form_data = {
             'device': 'invalid_key',
@@ -464,7 +742,10 @@ class WithdrawalViewSetTestCase(APITestCase):
         response = view(request, uid=withdrawal.uid)
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
-    def test_retrieve(self):
+    @patch('transactions.utils.status_events.get_connection')
+    @patch('transactions.utils.status_cache.transaction.on_commit',
+           side_effect=lambda func: func())
+    def test_retrieve(self, on_commit_mock, connection_mock):
         withdrawal = WithdrawalFactory(sent=True)
         url = reverse('api:v2:withdrawal-detail',
                       kwargs={'uid': withdrawal.uid})
@@ -480,6 +761,18 @@ class WithdrawalViewSetTestCase(APITestCase):
                          withdrawal.customer_address)
         self.assertEqual(response.data['status'], 'notified')
 
+    def test_list(self):
+        withdrawal_1 = WithdrawalFactory(sent=True)
+        withdrawal_2 = WithdrawalFactory()
+        url = reverse('api:v2:withdrawal-list')
+        response = self.client.get(
+            url, {'uid': [withdrawal_1.uid, withdrawal_2.uid]})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['status'] for item in response.data],
+                         ['sent', 'new'])
+        self.assertEqual(response.data[0]['address'],
+                         withdrawal_1.customer_address)
+
     @patch('api.utils.pdf.get_template')
     def test_receipt(self, get_template_mock):
         get_template_mock.return_value = template_mock = Mock(**{
@@ -527,9 +820,9 @@ class WithdrawalViewSetTestCase(APITestCase):
 
 class DeviceViewSetTestCase(APITestCase):
 
-    @patch('api.serializers.Salt')
-    def test_create(self, salt_cls_mock):
-        salt_cls_mock.return_value = Mock(**{
+    @patch('api.serializers.get_salt')
+    def test_create(self, get_salt_mock):
+        get_salt_mock.return_value = Mock(**{
             'check_fingerprint.return_value': True,
         })
         batch = DeviceBatchFactory.create()
@@ -552,8 +845,8 @@ class DeviceViewSetTestCase(APITestCase):
         self.assertEqual(device.status, 'registered')
         self.assertEqual(device.batch.pk, batch.pk)
 
-    @patch('api.serializers.Salt')
-    def test_create_errors(self, salt_cls_mock):
+    @patch('api.serializers.get_salt')
+    def test_create_errors(self, get_salt_mock):
         url = reverse('api:v2:device-list')
         response = self.client.post(url, {})
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -564,8 +857,8 @@ class DeviceViewSetTestCase(APITestCase):
         self.assertEqual(response.data['api_key'][0],
                          'This field is required.')
 
-    @patch('api.views_v2.rq_helpers.run_task')
-    def test_retrieve_registered(self, run_mock):
+    @patch('website.utils.heartbeat.get_connection')
+    def test_retrieve_registered(self, connection_mock):
         device = DeviceFactory.create(status='registered')
         url = reverse('api:v2:device-detail',
                       kwargs={'key': device.key})
@@ -575,8 +868,8 @@ class DeviceViewSetTestCase(APITestCase):
         self.assertEqual(response.data['language']['code'], 'en')
         self.assertEqual(response.data['currency']['name'], 'GBP')
 
-    @patch('api.views_v2.rq_helpers.run_task')
-    def test_retrieve_activation(self, run_mock):
+    @patch('website.utils.heartbeat.get_connection')
+    def test_retrieve_activation(self, connection_mock):
         device = DeviceFactory.create(status='activation_in_progress')
         url = reverse('api:v2:device-detail',
                       kwargs={'key': device.key})
@@ -584,36 +877,92 @@ class DeviceViewSetTestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['status'], 'activation_in_progress')
 
-    @patch('api.views_v2.rq_helpers.run_task')
-    def test_retrieve_active(self, run_mock):
-        device = DeviceFactory.create(status='active')
+    @patch('website.utils.heartbeat.get_connection')
+    def test_retrieve_active(self, connection_mock):
+        device = DeviceFactory.create(
+            status='active',
+            system_info_updated=timezone.now())
         url = reverse('api:v2:device-detail',
                       kwargs={'key': device.key})
-        self.assertFalse(device.is_online())
+        connection_mock.return_value.pipeline.return_value.\
+            __enter__.return_value.execute.return_value = [None]
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['status'], 'active')
 
+        heartbeat_key, _, device_key = \
+            connection_mock.return_value.zadd.call_args[0]
+        self.assertEqual(heartbeat_key, 'xbt:heartbeats')
+        self.assertEqual(device_key, device.key)
         updated_device = Device.objects.get(pk=device.pk)
-        self.assertTrue(updated_device.is_online())
+        # Heartbeat is not saved immediately
+        self.assertIsNone(updated_device.last_activity)
+        # System info is marked as stale
+        self.assertIsNone(updated_device.system_info_updated)
+
+    @patch('website.utils.heartbeat.get_connection')
+    @patch('website.utils.device_config.transaction.on_commit',
+           side_effect=lambda func: func())
+    def test_retrieve_cached(self, on_commit_mock, connection_mock):
+        connection_mock.return_value.pipeline.return_value.\
+            __enter__.return_value.execute.return_value = [time.time()]
+        device = DeviceFactory.create(status='active')
+        url = reverse('api:v2:device-detail',
+                      kwargs={'key': device.key})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
 
-        self.assertIs(run_mock.called, True)
-        self.assertEqual(run_mock.call_args[0][1][0], device.key)
-        self.assertEqual(run_mock.call_args[1]['time_delta'],
-                         datetime.timedelta(minutes=3))
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], 'active')
+        self.assertEqual(response['ETag'], etag)
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
 
-    @override_config(ENABLE_SALT=False)
-    @patch('api.views_v2.rq_helpers.run_task')
-    def test_retrieve_active_salt_disabled(self, run_mock):
+        device.amount_1 = Decimal('5.00')
+        device.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data['settings']['amount_1'], '5.00')
+
+    @patch('website.utils.heartbeat.get_connection')
+    @patch('website.utils.device_config.transaction.on_commit',
+           side_effect=lambda func: func())
+    def test_retrieve_deleted(self, on_commit_mock, connection_mock):
+        connection_mock.return_value.pipeline.return_value.\
+            __enter__.return_value.execute.return_value = [time.time()]
         device = DeviceFactory.create(status='active')
         url = reverse('api:v2:device-detail',
                       kwargs={'key': device.key})
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertIs(run_mock.called, False)
+        etag = response['ETag']
+        connection_mock.return_value.zadd.reset_mock()
+
+        device.delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertIs(connection_mock.return_value.zadd.called, False)
+
+    @patch('website.utils.heartbeat.get_connection')
+    def test_retrieve_not_found(self, connection_mock):
+        url = reverse('api:v2:device-detail',
+                      kwargs={'key': 'unknown'})
+        etag = device_config.get_etag('unknown')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertIs(connection_mock.return_value.zadd.called, False)
 
-    @patch('api.views_v2.rq_helpers.run_task')
-    def test_retrieve_suspended(self, run_mock):
+    @patch('website.utils.heartbeat.get_connection')
+    def test_retrieve_suspended(self, connection_mock):
         device = DeviceFactory.create(status='suspended')
         url = reverse('api:v2:device-detail',
                       kwargs={'key': device.key})
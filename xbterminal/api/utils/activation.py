@@ -1,17 +1,36 @@
+"""
+Device activation is a step machine driven by periodic task:
+    accept_key - accept minion's key
+    await_ping - wait for device
+    fetch_grains - collect information
+    resolve_versions - find package versions
+    run_highstate - apply state
+    await_highstate - wait for highstate result
+    await_activation - wait for confirmation from device
+Each run of the task executes steps until salt job result is needed,
+salt job ID is stored on the device, so the task never blocks a worker.
+"""
 import datetime
 import logging
-import time
 
 from django.utils import timezone
-from rq.job import Job, NoSuchJobError
+import requests
 
 from website.models import Device
-from api.utils.salt import Salt
-from api.utils.aptly import get_latest_version
+from api.utils.salt import SaltError, get_salt
+from api.utils.aptly import get_latest_versions
 from common import rq_helpers
 
-CACHE_KEY_TEMPLATE = 'activation-{device_key}'
 ACTIVATION_TIMEOUT = datetime.timedelta(minutes=30)
+ACTIVATION_CHECK_INTERVAL = 15  # seconds
+ACTIVATION_QUEUE = 'low'
+
+STEP_TIMEOUTS = {
+    'await_ping': ACTIVATION_TIMEOUT,
+    'fetch_grains': datetime.timedelta(minutes=5),
+    'await_highstate': ACTIVATION_TIMEOUT,
+    'await_activation': datetime.timedelta(minutes=10),
+}
 
 logger = logging.getLogger(__name__)
 
@@ -22,87 +41,171 @@ def start(device, merchant):
         filter(currency__is_fiat=False, currency__is_enabled=True).\
         first()
     device.start_activation()
+    device.activation_step = 'accept_key'
+    device.activation_step_time = device.activation_time_started = \
+        timezone.now()
+    device.activation_jid = None
     device.save()
-    activation_job_timeout = int(ACTIVATION_TIMEOUT.total_seconds()) + 600
-    job = rq_helpers.run_task(
-        prepare_device,
-        [device.key],
-        queue='low',
-        timeout=activation_job_timeout)
     rq_helpers.run_periodic_task(
-        wait_for_activation,
-        [device.key, job.get_id()])
+        run_activation,
+        [device.key],
+        queue=ACTIVATION_QUEUE,
+        interval=ACTIVATION_CHECK_INTERVAL)
     logger.info('activation started (%s)', device.key)
 
 
-def prepare_device(device_key):
+def run_activation(device_key):
     """
     Asynchronous task
     Accepts:
         device_key
     """
     device = Device.objects.get(key=device_key)
-    # Accept minion's key
-    salt = Salt()
-    salt.login()
+    if device.status == 'active':
+        logger.info('activation finished (%s)', device.key)
+        rq_helpers.cancel_current_task(queue=ACTIVATION_QUEUE)
+        return
+    if device.status != 'activation_in_progress':
+        rq_helpers.cancel_current_task(queue=ACTIVATION_QUEUE)
+        return
+    now = timezone.now()
+    # Steps without timeout and retries on Salt API errors
+    # are limited by overall timeout
+    time_started = device.activation_time_started or \
+        device.activation_step_time
+    step_timeout = STEP_TIMEOUTS.get(device.activation_step)
+    if time_started + ACTIVATION_TIMEOUT < now or \
+            step_timeout and device.activation_step_time + step_timeout < now:
+        device.set_activation_error()
+        device.save()
+        logger.error('activation timeout (%s), step %s',
+                     device.key, device.activation_step)
+        rq_helpers.cancel_current_task(queue=ACTIVATION_QUEUE)
+        return
+    context = {}
+    try:
+        salt = get_salt()
+        while True:
+            next_step = ACTIVATION_STEPS[device.activation_step](
+                device, salt, context)
+            if next_step is None:
+                # Waiting
+                break
+            device.activation_step = next_step
+            device.activation_step_time = timezone.now()
+            device.save()
+    except SaltError as error:
+        logger.exception(error)
+        device.set_activation_error()
+        device.save()
+        logger.error('activation failed (%s), step %s',
+                     device.key, device.activation_step)
+        rq_helpers.cancel_current_task(queue=ACTIVATION_QUEUE)
+        return
+    except requests.RequestException as error:
+        # Salt API is not available, retry on next run
+        logger.warning(error)
+    device.save()
+
+
+def accept_key(device, salt, context):
     salt.accept(device.key)
-    # Wait for device
-    ping_interval = 10
-    while not salt.ping(device.key):
-        logger.info('device is offline, waiting {} seconds'.format(
-            ping_interval))
-        time.sleep(ping_interval)
-    logger.info('device is online')
-    # Collect information
-    machine = salt.get_grain(device.key, 'machine')
-    rpc_package_version = get_latest_version(machine, 'xbterminal-rpc')
-    gui_package_version = get_latest_version(machine, 'xbterminal-gui')
+    return 'await_ping'
+
+
+def await_ping(device, salt, context):
+    if device.activation_jid and \
+            salt.get_job_result(device.activation_jid, device.key):
+        logger.info('device is online')
+        device.activation_jid = None
+        return 'fetch_grains'
+    # Device did not respond yet, ping it again
+    logger.info('device is offline, waiting')
+    device.activation_jid = salt.start_job(device.key, 'test.ping')
+
+
+def fetch_grains(device, salt, context):
+    if not device.activation_jid:
+        device.activation_jid = salt.start_job(
+            device.key, 'grains.item', arg=['machine'])
+        return
+    result = salt.get_job_result(device.activation_jid, device.key)
+    if result is None:
+        return
+    device.activation_jid = None
+    context['machine'] = result.get('machine')
+    return 'resolve_versions'
+
+
+def resolve_versions(device, salt, context):
+    if 'machine' not in context:
+        # Activation resumed after failure
+        return 'fetch_grains'
+    context['pillar_data'] = get_pillar_data(device, context['machine'])
+    return 'run_highstate'
+
+
+def run_highstate(device, salt, context):
+    if 'pillar_data' not in context:
+        # Activation resumed after failure
+        return 'fetch_grains'
+    device.activation_jid = salt.start_highstate(
+        device.key, context['pillar_data'])
+    return 'await_highstate'
+
+
+def await_highstate(device, salt, context):
+    results = salt.get_job_result(device.activation_jid, device.key)
+    if results is None:
+        # Minion is not ready yet
+        return
+    salt.check_highstate_result(results)
+    device.activation_jid = None
+    return 'await_activation'
+
+
+def await_activation(device, salt, context):
+    # Device will confirm activation via API
+    return
+
+
+def get_pillar_data(device, machine):
+    """
+    Prepare pillar data for highstate
+    Accepts:
+        device: Device instance
+        machine: machine grain
+    Returns:
+        dict
+    """
+    ui_theme = device.merchant.ui_theme.name
+    ui_theme_package = 'xbterminal-gui-theme-{}'.format(ui_theme)
+    versions = get_latest_versions(machine)
+    for package_name in ['xbterminal-rpc', 'xbterminal-gui',
+                         ui_theme_package]:
+        if package_name not in versions:
+            raise SaltError('package {} not found'.format(package_name))
     pillar_data = {
         'xbt': {
-            'rpc_version': rpc_package_version,
-            'gui_version': gui_package_version,
+            'rpc_version': versions['xbterminal-rpc'],
+            'gui_version': versions['xbterminal-gui'],
             'rpc_config': {},
             'gui_config': {},
         },
     }
-    ui_theme = device.merchant.ui_theme.name
-    ui_theme_package_version = get_latest_version(
-        machine,
-        'xbterminal-gui-theme-{}'.format(ui_theme))
     pillar_data['xbt']['themes'] = {
-        ui_theme: ui_theme_package_version,
+        ui_theme: versions[ui_theme_package],
     }
     pillar_data['xbt']['gui_config']['theme'] = ui_theme
-    # Apply state
-    salt.highstate(device.key,
-                   pillar_data,
-                   int(ACTIVATION_TIMEOUT.total_seconds()))
+    return pillar_data
 
 
-def wait_for_activation(device_key, activation_job_id):
-    """
-    Asynchronous task
-    """
-    device = Device.objects.get(key=device_key)
-    if device.status == 'active':
-        logger.info('activation finished (%s)', device.key)
-        rq_helpers.cancel_current_task()
-        return
-    try:
-        job = Job.fetch(activation_job_id)
-    except NoSuchJobError as error:
-        logger.exception(error)
-        return
-    if timezone.make_aware(job.started_at, timezone.utc) + \
-            datetime.timedelta(seconds=job.timeout) < timezone.now():
-        device.set_activation_error()
-        device.save()
-        logger.error('activation timeout (%s)', device.key)
-        rq_helpers.cancel_current_task()
-        return
-    if job.is_failed:
-        device.set_activation_error()
-        device.save()
-        logger.error('activation failed (%s)', device.key)
-        rq_helpers.cancel_current_task()
-        return
+ACTIVATION_STEPS = {
+    'accept_key': accept_key,
+    'await_ping': await_ping,
+    'fetch_grains': fetch_grains,
+    'resolve_versions': resolve_versions,
+    'run_highstate': run_highstate,
+    'await_highstate': await_highstate,
+    'await_activation': await_activation,
+}
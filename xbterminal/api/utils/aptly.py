@@ -2,30 +2,72 @@ import os.path
 from urlparse import urljoin
 
 from django.conf import settings
+from django.core.cache import cache
 from distutils.version import LooseVersion
 import requests
 
+INDEX_CACHE_KEY_TEMPLATE = 'aptly-index-{machine}'
+INDEX_CACHE_TIMEOUT = 600  # seconds
 
-def get_latest_version(machine, package_name):
+
+def get_repo_name(machine):
+    return 'xbtfw-{machine}-dev'.format(machine=machine)
+
+
+def fetch_index(machine):
     """
+    Download package list and find latest version of each package
     https://www.aptly.info/doc/api/repos/
+    Accepts:
+        machine: device machine name
+    Returns:
+        dict, package name -> latest version
     """
     config = settings.APTLY_SERVERS['default']
-    repo_name = 'xbtfw-{machine}-dev'.format(machine=machine)
-    api_url = '/api/repos/{name}/packages'.format(name=repo_name)
-    params = {
-        'q': package_name,
-        'format': 'details',
-    }
+    api_url = '/api/repos/{name}/packages'.format(
+        name=get_repo_name(machine))
     certs = (
         os.path.join(settings.CERT_PATH, config['CLIENT_CERT']),
         os.path.join(settings.CERT_PATH, config['CLIENT_KEY']),
     )
     ca_cert = os.path.join(settings.CERT_PATH, config['CA_CERT'])
     response = requests.get(urljoin(config['HOST'], api_url),
-                            params=params,
                             cert=certs,
                             verify=ca_cert)
-    result = response.json()
-    latest = max((pkg['Version'] for pkg in result), key=LooseVersion)
-    return latest
+    response.raise_for_status()
+    index = {}
+    # Package keys have format "P<arch> <name> <version> <hash>"
+    for package_key in response.json():
+        _, name, version, _ = package_key.split(' ')
+        if name not in index or \
+                LooseVersion(version) > LooseVersion(index[name]):
+            index[name] = version
+    return index
+
+
+def refresh_index(machine):
+    """
+    Update cached index, should be called after publishing
+    Accepts:
+        machine: device machine name
+    Returns:
+        dict, package name -> latest version
+    """
+    index = fetch_index(machine)
+    cache.set(INDEX_CACHE_KEY_TEMPLATE.format(machine=machine),
+              index,
+              timeout=INDEX_CACHE_TIMEOUT)
+    return index
+
+
+def get_latest_versions(machine):
+    """
+    Accepts:
+        machine: device machine name
+    Returns:
+        dict, package name -> latest version
+    """
+    index = cache.get(INDEX_CACHE_KEY_TEMPLATE.format(machine=machine))
+    if index is None:
+        index = refresh_index(machine)
+    return index
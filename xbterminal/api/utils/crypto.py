@@ -1,4 +1,6 @@
 import base64
+import hashlib
+
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives.asymmetric import rsa
 from cryptography.hazmat.primitives import serialization
@@ -6,6 +8,15 @@ from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.asymmetric import padding
 from cryptography.exceptions import InvalidSignature
 
+from common.cache import LRUCache
+
+# Parsed public keys are cached in process memory,
+# PEM hash is a part of the cache key, so keys are
+# never reused after device's API key changes
+PUBLIC_KEY_CACHE_MAX_SIZE = 1000
+
+_public_key_cache = LRUCache(PUBLIC_KEY_CACHE_MAX_SIZE)
+
 
 def load_public_key(public_key_pem):
     return serialization.load_pem_public_key(
@@ -13,12 +24,30 @@ def load_public_key(public_key_pem):
         backend=default_backend())
 
 
-def verify_signature(public_key_pem, message, signature):
+def get_public_key(public_key_pem, device_key=None):
+    """
+    Accepts:
+        public_key_pem: public key in PEM format
+        device_key: key of device which owns the public key
+    Returns:
+        public key object
+    """
+    cache_key = (device_key,
+                 hashlib.sha256(str(public_key_pem)).hexdigest())
+    public_key = _public_key_cache.get(cache_key)
+    if public_key is None:
+        public_key = load_public_key(public_key_pem)
+        _public_key_cache.set(cache_key, public_key)
+    return public_key
+
+
+def verify_signature(public_key_pem, message, signature, device_key=None):
     """
     Accepts:
         public_key_pem: public key in PEM format
         message
         signature
+        device_key: key of device which owns the public key
     Returns:
         True if signature is valid, false otherwise
     """
@@ -26,7 +55,7 @@ def verify_signature(public_key_pem, message, signature):
         signature = base64.b64decode(signature)
     except TypeError:
         return False
-    public_key = load_public_key(public_key_pem)
+    public_key = get_public_key(public_key_pem, device_key=device_key)
     verifier = public_key.verifier(
         signature,
         padding.PSS(
@@ -58,13 +87,13 @@ def create_test_public_key():
     return public_key_pem.strip()
 
 
-def create_test_signature(message):
+def create_test_signature(message, key_size=512):
     """
     Create secret key and sign message (for testing purposes)
     """
     secret_key = rsa.generate_private_key(  # nosec
         public_exponent=65537,
-        key_size=512,
+        key_size=key_size,
         backend=default_backend())
     public_key = secret_key.public_key()
     public_key_pem = public_key.public_bytes(
@@ -0,0 +1,83 @@
+"""
+Successful responses are saved by the value of Idempotency-Key header,
+retried requests get saved response without repeating the work
+"""
+import functools
+import hashlib
+
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+IDEMPOTENCY_KEY_HEADER = 'HTTP_IDEMPOTENCY_KEY'
+IDEMPOTENCY_KEY_MAX_LENGTH = 100
+IDEMPOTENCY_CACHE_KEY_TEMPLATE = 'idempotency-{view_name}-{key_hash}'
+IDEMPOTENCY_CACHE_TIMEOUT = 24 * 3600  # seconds
+# Request is considered failed if it is not finished within this time
+IDEMPOTENCY_LOCK_TIMEOUT = 60  # seconds
+
+
+def _get_fingerprint(request):
+    """
+    Retry must have the same body and signature
+    """
+    fingerprint = hashlib.sha256(request.body)
+    fingerprint.update(request.META.get('HTTP_X_SIGNATURE', ''))
+    return fingerprint.hexdigest()
+
+
+def _get_error_response(message, status_code):
+    return Response({'idempotency_key': [message]}, status=status_code)
+
+
+def idempotent(view_method):
+    """
+    Decorator for view methods which create objects
+    """
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.META.get(IDEMPOTENCY_KEY_HEADER)
+        if not key:
+            return view_method(self, request, *args, **kwargs)
+        if len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            return _get_error_response(
+                'Ensure this field has no more than {0} characters.'.format(
+                    IDEMPOTENCY_KEY_MAX_LENGTH),
+                status.HTTP_400_BAD_REQUEST)
+        cache_key = IDEMPOTENCY_CACHE_KEY_TEMPLATE.format(
+            view_name='{0}.{1}'.format(type(self).__name__,
+                                       view_method.__name__),
+            key_hash=hashlib.sha256(key).hexdigest())
+        entry = {
+            'fingerprint': _get_fingerprint(request),
+            'status': None,
+            'data': None,
+        }
+        if not cache.add(cache_key, entry, timeout=IDEMPOTENCY_LOCK_TIMEOUT):
+            saved_entry = cache.get(cache_key)
+            if saved_entry is None or saved_entry['status'] is None:
+                return _get_error_response(
+                    'Request with this key is in progress.',
+                    status.HTTP_409_CONFLICT)
+            if saved_entry['fingerprint'] != entry['fingerprint']:
+                return _get_error_response(
+                    'Key has already been used for another request.',
+                    status.HTTP_422_UNPROCESSABLE_ENTITY)
+            response = Response(saved_entry['data'],
+                                status=saved_entry['status'])
+            response['Idempotent-Replayed'] = 'true'
+            return response
+        try:
+            response = view_method(self, request, *args, **kwargs)
+        except Exception:
+            cache.delete(cache_key)
+            raise
+        if status.is_success(response.status_code):
+            entry['status'] = response.status_code
+            entry['data'] = response.data
+            cache.set(cache_key, entry, timeout=IDEMPOTENCY_CACHE_TIMEOUT)
+        else:
+            # Errors are not saved, request can be retried
+            cache.delete(cache_key)
+        return response
+    return wrapper
@@ -0,0 +1,213 @@
+"""
+Firmware rollout runs highstate on all active devices from batch.
+Devices are processed by periodic task, at most `concurrency` devices
+at a time, canary devices first:
+    pending - waiting for free slot
+    fetch_grains - collect information
+    highstate - wait for highstate result
+    succeeded / failed / skipped
+Salt jobs are asynchronous, so one task can drive the whole window.
+"""
+import datetime
+import logging
+import math
+
+from django.db.models import Count
+from django.utils import timezone
+import requests
+
+from website.models import FirmwareRolloutDevice, FirmwareRollout
+from api.utils.activation import get_pillar_data
+from api.utils.salt import SaltError, SaltTimeout, get_salt
+from common import rq_helpers
+
+ROLLOUT_CHECK_INTERVAL = 15  # seconds
+ROLLOUT_QUEUE = 'low'
+# Device fails if salt job is not finished within this time
+ROLLOUT_STEP_TIMEOUTS = {
+    'fetch_grains': datetime.timedelta(minutes=5),
+    'highstate': datetime.timedelta(minutes=30),
+}
+# Minimum sample for error threshold if there are no finished canaries
+ROLLOUT_MIN_FINISHED_DEVICES = 10
+
+IN_PROGRESS_STATUSES = ['fetch_grains', 'highstate']
+
+logger = logging.getLogger(__name__)
+
+
+def start(rollout):
+    """
+    Add devices to rollout and start processing
+    Accepts:
+        rollout: FirmwareRollout instance
+    """
+    device_ids = list(rollout.batch.device_set.
+                      filter(status='active').
+                      order_by('?').
+                      values_list('pk', flat=True))
+    canary_count = int(math.ceil(
+        len(device_ids) * rollout.canary_percent / 100.0))
+    FirmwareRolloutDevice.objects.bulk_create(
+        FirmwareRolloutDevice(rollout=rollout,
+                              device_id=device_id,
+                              is_canary=idx < canary_count)
+        for idx, device_id in enumerate(device_ids))
+    rq_helpers.run_periodic_task(
+        run_rollout,
+        [rollout.pk],
+        queue=ROLLOUT_QUEUE,
+        interval=ROLLOUT_CHECK_INTERVAL)
+    logger.info('rollout started (%s), %s devices, %s canaries',
+                rollout.pk, len(device_ids), canary_count)
+
+
+def abort(rollout):
+    """
+    Stop starting new devices, running jobs are still tracked
+    Accepts:
+        rollout: FirmwareRollout instance
+    """
+    rollout.status = 'aborted'
+    rollout.save()
+    rollout.devices.filter(status='pending').update(status='skipped')
+    logger.warning('rollout aborted (%s)', rollout.pk)
+
+
+def run_rollout(rollout_id):
+    """
+    Periodic task
+    Accepts:
+        rollout_id
+    """
+    rollout = FirmwareRollout.objects.get(pk=rollout_id)
+    if rollout.time_finished:
+        rq_helpers.cancel_current_task(queue=ROLLOUT_QUEUE)
+        return
+    if rollout.created_at + datetime.timedelta(hours=rollout.time_limit) < \
+            timezone.now():
+        # Running jobs are not tracked anymore
+        rollout.devices.\
+            filter(status__in=IN_PROGRESS_STATUSES).\
+            update(status='failed',
+                   error='rollout timeout',
+                   time_finished=timezone.now())
+        if rollout.status == 'in_progress':
+            abort(rollout)
+        logger.error('rollout timeout (%s)', rollout.pk)
+    else:
+        salt = get_salt()
+        try:
+            for rollout_device in rollout.devices.\
+                    filter(status__in=IN_PROGRESS_STATUSES).\
+                    select_related('device__merchant__ui_theme'):
+                check_device(rollout_device, salt)
+            counts = get_status_counts(rollout)
+            if rollout.status == 'in_progress' and \
+                    is_error_threshold_exceeded(rollout, counts):
+                abort(rollout)
+            if rollout.status == 'in_progress':
+                start_devices(rollout, salt, counts)
+        except requests.RequestException as error:
+            # Salt API is not available, retry on next run
+            logger.warning(error)
+            return
+    counts = get_status_counts(rollout)
+    if not any(counts[status] for status
+               in ['pending'] + IN_PROGRESS_STATUSES):
+        if rollout.status == 'in_progress':
+            rollout.status = 'completed'
+        rollout.time_finished = timezone.now()
+        rollout.save()
+        logger.info('rollout finished (%s), %s succeeded, %s failed',
+                    rollout.pk, counts['succeeded'], counts['failed'])
+        rq_helpers.cancel_current_task(queue=ROLLOUT_QUEUE)
+
+
+def get_status_counts(rollout):
+    """
+    Returns:
+        dict, device status -> number of devices
+    """
+    counts = {status: 0 for status, _
+              in FirmwareRolloutDevice.DEVICE_STATUSES}
+    counts.update(rollout.devices.
+                  order_by().
+                  values_list('status').
+                  annotate(Count('id')))
+    return counts
+
+
+def is_error_threshold_exceeded(rollout, counts):
+    """
+    Error rate is checked when all canaries have finished,
+    or when enough devices have finished to make it meaningful
+    Returns:
+        True if rollout should be aborted, False otherwise
+    """
+    finished = counts['succeeded'] + counts['failed']
+    if not finished:
+        return False
+    if finished < ROLLOUT_MIN_FINISHED_DEVICES:
+        canaries = rollout.devices.filter(is_canary=True)
+        if not canaries.exists() or canaries.\
+                filter(status__in=['pending'] + IN_PROGRESS_STATUSES).\
+                exists():
+            return False
+    return counts['failed'] * 100 > rollout.error_threshold * finished
+
+
+def start_devices(rollout, salt, counts):
+    """
+    Fill concurrency window, canary devices go first
+    """
+    slots = rollout.concurrency - sum(counts[status] for status
+                                      in IN_PROGRESS_STATUSES)
+    if slots <= 0:
+        return
+    if rollout.devices.\
+            filter(is_canary=True,
+                   status__in=['pending'] + IN_PROGRESS_STATUSES).\
+            exists():
+        # Wait for canaries
+        queryset = rollout.devices.filter(is_canary=True)
+    else:
+        queryset = rollout.devices.all()
+    for rollout_device in queryset.filter(status='pending')[:slots]:
+        rollout_device.jid = salt.start_job(
+            rollout_device.device.key, 'grains.item', arg=['machine'])
+        rollout_device.status = 'fetch_grains'
+        rollout_device.time_started = rollout_device.time_step_started = \
+            timezone.now()
+        rollout_device.save()
+
+
+def check_device(rollout_device, salt):
+    """
+    Advance device to next step if salt job has finished
+    """
+    device = rollout_device.device
+    try:
+        result = salt.get_job_result(rollout_device.jid, device.key)
+        if result is None:
+            step_timeout = ROLLOUT_STEP_TIMEOUTS[rollout_device.status]
+            if rollout_device.time_step_started + step_timeout <= \
+                    timezone.now():
+                raise SaltTimeout('timeout')
+            return
+        if rollout_device.status == 'fetch_grains':
+            pillar_data = get_pillar_data(device, result.get('machine'))
+            rollout_device.jid = salt.start_highstate(device.key,
+                                                      pillar_data)
+            rollout_device.status = 'highstate'
+            rollout_device.time_step_started = timezone.now()
+        elif rollout_device.status == 'highstate':
+            salt.check_highstate_result(result)
+            rollout_device.status = 'succeeded'
+            rollout_device.time_finished = timezone.now()
+    except (SaltError, SaltTimeout) as error:
+        logger.error('rollout failed on device %s: %s', device.key, error)
+        rollout_device.status = 'failed'
+        rollout_device.error = str(error)
+        rollout_device.time_finished = timezone.now()
+    rollout_device.save()
@@ -1,14 +1,22 @@
 import json
 import os.path
 import logging
+import threading
 import time
 from urlparse import urljoin
 from django.conf import settings
+from django.core.cache import cache
 
 import requests
 
+TOKEN_CACHE_KEY_TEMPLATE = 'salt-token-{server}'
+TOKEN_EXPIRATION_MARGIN = 60  # seconds
+
 logger = logging.getLogger(__name__)
 
+_clients = {}
+_clients_lock = threading.Lock()
+
 
 class SaltError(Exception):
     pass
@@ -20,46 +28,69 @@ class SaltTimeout(Exception):
 
 class Salt(object):
 
-    ASYNC_JOB_CHECK_INTERVAL = 15
-
     def __init__(self, server='default'):
+        self.server = server
         self.config = settings.SALT_SERVERS[server]
         self._auth_token = None
+        # Connections and TLS sessions are reused
+        self._session = requests.Session()
+        self._session.headers['Accept'] = 'application/json'
+        self._session.cert = (
+            os.path.join(settings.CERT_PATH, self.config['CLIENT_CERT']),
+            os.path.join(settings.CERT_PATH, self.config['CLIENT_KEY']),
+        )
+        self._session.verify = os.path.join(
+            settings.CERT_PATH, self.config['CA_CERT'])
 
     def _send_request(self, method, url,
                       params=None, data=None,
-                      jsonify=True):
-        headers = {
-            'Accept': 'application/json',
-        }
-        if self._auth_token:
+                      jsonify=True, auth=True, retry=True):
+        if auth and not self._auth_token:
+            self.login()
+        headers = {}
+        if auth:
             headers['X-Auth-Token'] = self._auth_token
         if jsonify:
             headers['Content-Type'] = 'application/json'
-            data = json.dumps(data)
-        certs = (
-            os.path.join(settings.CERT_PATH, self.config['CLIENT_CERT']),
-            os.path.join(settings.CERT_PATH, self.config['CLIENT_KEY']),
-        )
-        ca_cert = os.path.join(settings.CERT_PATH, self.config['CA_CERT'])
-        response = requests.request(method.upper(),
-                                    urljoin(self.config['HOST'], url),
-                                    params=params,
-                                    data=data,
-                                    headers=headers,
-                                    cert=certs,
-                                    verify=ca_cert)
+        response = self._session.request(method.upper(),
+                                         urljoin(self.config['HOST'], url),
+                                         params=params,
+                                         data=json.dumps(data) if jsonify else data,
+                                         headers=headers)
+        if response.status_code == 401 and auth and retry:
+            # Token expired or revoked
+            self.login(force=True)
+            return self._send_request(method, url,
+                                      params=params, data=data,
+                                      jsonify=jsonify, retry=False)
         response.raise_for_status()
         return response.json()['return'][0]
 
-    def login(self):
+    def login(self, force=False):
+        """
+        Get eauth token, token is shared between processes via cache
+        Accepts:
+            force: ignore cached token
+        """
+        cache_key = TOKEN_CACHE_KEY_TEMPLATE.format(server=self.server)
+        if not force:
+            token = cache.get(cache_key)
+            if token:
+                self._auth_token = token
+                return
         payload = {
             'username': self.config['USER'],
             'password': self.config['PASSWORD'],
             'eauth': 'pam',
         }
-        result = self._send_request('post', '/login', data=payload, jsonify=False)
+        result = self._send_request('post', '/login', data=payload,
+                                    jsonify=False, auth=False)
         self._auth_token = result['token']
+        if 'expire' in result:
+            timeout = int(result['expire'] - time.time()) - \
+                TOKEN_EXPIRATION_MARGIN
+            if timeout > 0:
+                cache.set(cache_key, self._auth_token, timeout=timeout)
         logger.info('login successful')
 
     def _lookup_jid(self, jid):
@@ -100,7 +131,8 @@ class Salt(object):
             'match': minion_id,
         }
         result = self._send_request('post', '/', data=payload)
-        assert minion_id in result['data']['return']['minions']
+        if minion_id not in result['data']['return']['minions']:
+            raise SaltError('minion key {} not found'.format(minion_id))
         logger.info('minion accepted')
 
     def delete(self, minion_id):
@@ -112,95 +144,105 @@ class Salt(object):
         self._send_request('post', '/', data=payload)
         logger.info('minion deleted')
 
-    def ping(self, minion_id, timeout=60):
-        payload = {
-            'client': 'local_async',
-            'fun': 'test.ping',
-            'tgt': minion_id,
-        }
-        result = self._send_request('post', '/', data=payload)
-        jid = result['jid']
-        # Wait for result
-        start_time = time.time()
-        while time.time() < start_time + timeout:
-            job_info = self._lookup_jid(jid)
-            if minion_id in job_info:
-                return job_info[minion_id]
-            time.sleep(self.ASYNC_JOB_CHECK_INTERVAL)
-        return False
-
-    def get_grain(self, minion_id, key, timeout=300):
+    def start_job(self, minion_id, fun, arg=None, kwarg=None):
+        """
+        Run execution module function asynchronously
+        Accepts:
+            minion_id: target minion or list of minions
+            fun: function name, e.g. 'test.ping'
+            arg: list of positional arguments
+            kwarg: dict of keyword arguments
+        Returns:
+            job ID
+        """
         payload = {
             'client': 'local_async',
-            'fun': 'grains.item',
+            'fun': fun,
             'tgt': minion_id,
-            'arg': [key],
         }
+        if isinstance(minion_id, list):
+            payload['tgt'] = ','.join(minion_id)
+            payload['expr_form'] = 'list'
+        if arg is not None:
+            payload['arg'] = arg
+        if kwarg is not None:
+            payload['kwarg'] = kwarg
         result = self._send_request('post', '/', data=payload)
-        jid = result['jid']
-        # Wait for result
-        start_time = time.time()
-        while time.time() < start_time + timeout:
-            job_info = self._lookup_jid(jid)
-            try:
-                value = job_info[minion_id].get(key)
-            except KeyError:
-                pass
-            else:
-                return value
-            time.sleep(self.ASYNC_JOB_CHECK_INTERVAL)
-        raise SaltTimeout()
-
-    def highstate(self, minion_id, pillar_data, timeout):
+        return result['jid']
+
+    def get_job_result(self, jid, minion_id):
+        """
+        Accepts:
+            jid: job ID
+            minion_id: target minion
+        Returns:
+            job result or None if minion has not returned yet
+        """
+        job_info = self._lookup_jid(jid)
+        return job_info.get(minion_id)
+
+    def get_job_results(self, jid):
+        """
+        Accepts:
+            jid: job ID
+        Returns:
+            dict, minion ID -> result, for minions that have returned
+        """
+        return self._lookup_jid(jid)
+
+    def start_highstate(self, minion_id, pillar_data):
         """
         https://docs.saltstack.com/en/2015.5/ref/modules/all
             /salt.modules.state.html#salt.modules.state.highstate
+        Returns:
+            job ID
         """
-        payload = {
-            'client': 'local_async',
-            'fun': 'state.highstate',
-            'tgt': minion_id,
-            'kwarg': {
-                'pillar': pillar_data,
-            },
-        }
-        result = self._send_request('post', '/', data=payload)
-        jid = result['jid']
+        jid = self.start_job(minion_id, 'state.highstate',
+                             kwarg={'pillar': pillar_data})
         logger.info('highstate execution started, job id {}'.format(jid))
-        # Wait for result
-        start_time = time.time()
-        while time.time() < start_time + timeout:
-            job_info = self._lookup_jid(jid)
-            try:
-                results = job_info[minion_id]
-            except KeyError:
-                # Minion is not ready yet
-                pass
-            else:
-                # Parse results
-                errors = []
-                if isinstance(results, list):
-                    errors = results
-                else:
-                    for state, result in results.items():
-                        if not result['result']:
-                            errors.append(result['comment'])
-                if errors:
-                    raise SaltError(errors)
-                else:
-                    logger.info('highstate executed')
-                    return
-            time.sleep(self.ASYNC_JOB_CHECK_INTERVAL)
-        raise SaltTimeout()
-
-    def get_pkg_versions(self, minion_id, packages):
-        payload = {
-            'client': 'local',
-            'fun': 'pkg.info_installed',
-            'tgt': minion_id,
-            'arg': packages,
-        }
-        results = self._send_request('post', '/', data=payload)
-        assert minion_id in results
-        return {name: info['version'] for name, info
-                in results[minion_id].items()}
+        return jid
+
+    def check_highstate_result(self, results):
+        """
+        Accepts:
+            results: highstate job result
+        Raises:
+            SaltError: some states failed
+        """
+        errors = []
+        if isinstance(results, list):
+            errors = results
+        else:
+            for state, result in results.items():
+                if not result['result']:
+                    errors.append(result['comment'])
+        if errors:
+            raise SaltError(errors)
+        logger.info('highstate executed')
+
+
+def parse_pkg_versions(result):
+    """
+    Accepts:
+        result: pkg.info_installed result for one minion
+    Returns:
+        dict, package name -> version
+    """
+    if not isinstance(result, dict):
+        # Error message
+        raise SaltError(result)
+    return {name: info['version'] for name, info in result.items()}
+
+
+def get_salt(server='default'):
+    """
+    Returns shared salt client
+    Accepts:
+        server: server name from SALT_SERVERS setting
+    Returns:
+        Salt instance
+    """
+    with _clients_lock:
+        if server not in _clients:
+            _clients[server] = Salt(server)
+        return _clients[server]
@@ -14,6 +14,7 @@ from oauth2_provider.views.generic import ProtectedResourceView
 
 from website.models import Device
 from website.forms import SimpleMerchantRegistrationForm
+from website.utils import heartbeat
 from website.utils.qr import generate_qr_code
 from website.utils.email import send_registration_info
 
@@ -123,8 +124,7 @@ def device(request, key):
         "BITCOIN_NETWORK": device.bitcoin_network,
         "SERIAL_NUMBER": '0000',
     }
-    device.last_activity = timezone.now()
-    device.save()
+    heartbeat.record_heartbeat(device.key)
     return Response(response)
 
 
@@ -1,7 +1,9 @@
-import datetime
 import logging
+import math
+import time
 
 from django.conf import settings
+from django.db import connection
 from django.db.transaction import atomic
 from django.http import Http404
 from django.utils import timezone
@@ -13,10 +15,11 @@ from rest_framework.views import APIView
 from constance import config
 
 from website.models import Device, DeviceBatch
-from website.utils.devices import get_device_info
+from website.utils import device_config, heartbeat
 
 from api.serializers import (
     DepositInitSerializer,
+    DepositBulkInitSerializer,
     DepositSerializer,
     WithdrawalInitSerializer,
     WithdrawalSerializer,
@@ -28,22 +31,144 @@ from api.renderers import (
     PaymentRequestRenderer,
     PaymentACKRenderer)
 from api.utils.crypto import verify_signature
+from api.utils.idempotency import idempotent
 from api.utils.pdf import generate_pdf
 from api.utils.urls import construct_absolute_url
 
 from transactions.exceptions import TransactionError
 from transactions.models import Deposit, Withdrawal
-from transactions.deposits import prepare_deposit, handle_bip70_payment
+from transactions.deposits import (
+    prepare_deposit,
+    prepare_deposits,
+    handle_bip70_payment)
 from transactions.withdrawals import prepare_withdrawal, send_transaction
 from transactions.utils.payments import construct_payment_uri
 from transactions.utils.bip70 import get_bip70_content_type
-
-from common import rq_helpers
+from transactions.utils import status_cache, status_events
 
 logger = logging.getLogger(__name__)
 
+STATUS_WAIT_TIMEOUT = 30  # seconds
+STATUS_BATCH_MAX_SIZE = 100
+
+
+class TransactionStatusMixin(object):
+    """
+    Status polling with conditional GET,
+    unchanged status is served from cache.
+    Clients can also wait for status change (long polling)
+    or get statuses of several transactions at once
+    """
+
+    def _get_status_entry(self, uid):
+        model_name = self.get_queryset().model._meta.model_name
+        # Version must be obtained before reading from DB
+        version = status_cache.get_version(model_name, uid)
+        entry = status_cache.get_cached_status(model_name, uid, version)
+        if entry is None:
+            obj = self.get_object()
+            is_changed = False
+            if obj.time_broadcasted and not obj.time_notified:
+                # Close order, only one request can do this
+                now = timezone.now()
+                if self.get_queryset().\
+                        filter(pk=obj.pk, time_notified__isnull=True).\
+                        update(time_notified=now):
+                    obj.time_notified = now
+                    status_cache.bump_version(obj)
+                    status_events.publish_change(obj)
+                else:
+                    obj = self.get_object()
+                is_changed = True
+            serializer = self.get_serializer(obj)
+            entry = status_cache.make_entry(
+                obj, version, dict(serializer.data))
+            if not is_changed:
+                # Representation is outdated if object changed
+                # after version had been obtained
+                status_cache.cache_status(obj, version, entry)
+        return entry
+
+    def _get_status_response(self, entry):
+        if self.request.META.get('HTTP_IF_NONE_MATCH') == entry['etag']:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(entry['data'])
+        response['ETag'] = entry['etag']
+        return response
+
+    def retrieve(self, request, uid=None):
+        entry = self._get_status_entry(uid)
+        return self._get_status_response(entry)
 
-class DepositViewSet(viewsets.GenericViewSet):
+    def list(self, request):
+        """
+        Statuses of several transactions: ?uid=<uid1>&uid=<uid2>
+        """
+        uids = request.query_params.getlist('uid')
+        if not uids:
+            return Response({'uid': ['This field is required.']},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(uids) > STATUS_BATCH_MAX_SIZE:
+            return Response(
+                {'uid': ['Ensure this field has no more than {0} '
+                         'elements.'.format(STATUS_BATCH_MAX_SIZE)]},
+                status=status.HTTP_400_BAD_REQUEST)
+        objs = sorted(self.get_queryset().filter(uid__in=uids),
+                      key=lambda obj: uids.index(obj.uid))
+        notified = [obj for obj in objs
+                    if obj.time_broadcasted and not obj.time_notified]
+        if notified:
+            # Close orders with single query,
+            # orders closed by concurrent request are not changed
+            now = timezone.now()
+            queryset = self.get_queryset().\
+                filter(pk__in=[obj.pk for obj in notified])
+            queryset.filter(time_notified__isnull=True).\
+                update(time_notified=now)
+            times_notified = dict(queryset.values_list('pk', 'time_notified'))
+            for obj in notified:
+                obj.time_notified = times_notified[obj.pk]
+                if obj.time_notified == now:
+                    # Changed by this request
+                    status_cache.bump_version(obj)
+                    status_events.publish_change(obj)
+        serializer = self.get_serializer(objs, many=True)
+        return Response(serializer.data)
+
+    @detail_route(methods=['GET'])
+    def wait(self, request, uid=None):
+        """
+        Returns current status when it differs from the status
+        passed by client or when timeout expires
+        """
+        last_status = request.query_params.get('status')
+        try:
+            timeout = float(request.query_params['timeout'])
+        except (KeyError, ValueError):
+            timeout = STATUS_WAIT_TIMEOUT
+        if math.isnan(timeout) or timeout <= 0:
+            timeout = STATUS_WAIT_TIMEOUT
+        timeout = min(timeout, STATUS_WAIT_TIMEOUT)
+        deadline = time.time() + timeout
+        model_name = self.get_queryset().model._meta.model_name
+        with status_events.Subscription(model_name, uid) as subscription:
+            while True:
+                entry = self._get_status_entry(uid)
+                if entry['data']['status'] != last_status or \
+                        time.time() >= deadline:
+                    break
+                if not connection.in_atomic_block:
+                    # Don't hold DB connection while waiting,
+                    # it will be reopened on next query
+                    connection.close()
+                # Status can also change when status timeout expires
+                subscription.wait(
+                    min(deadline, entry['expires_at']) - time.time())
+        return self._get_status_response(entry)
+
+
+class DepositViewSet(TransactionStatusMixin, viewsets.GenericViewSet):
 
     lookup_field = 'uid'
     serializer_class = DepositSerializer
@@ -56,6 +181,7 @@ class DepositViewSet(viewsets.GenericViewSet):
             queryset = queryset.select_for_update()
         return queryset
 
+    @idempotent
     def create(self, *args, **kwargs):
         serializer = DepositInitSerializer(data=self.request.data)
         serializer.is_valid(raise_exception=True)
@@ -98,13 +224,35 @@ class DepositViewSet(viewsets.GenericViewSet):
                 payment_request_url)
         return Response(data)
 
-    def retrieve(self, *args, **kwargs):
-        deposit = self.get_object()
-        if deposit.time_broadcasted and not deposit.time_notified:
-            deposit.time_notified = timezone.now()
-            deposit.save()
-        serializer = self.get_serializer(deposit)
-        return Response(serializer.data)
+    @list_route(methods=['POST'])
+    @idempotent
+    def bulk(self, *args, **kwargs):
+        """
+        Create several payment orders for account
+        """
+        serializer = DepositBulkInitSerializer(data=self.request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            deposits = prepare_deposits(
+                serializer.validated_data['account'],
+                serializer.validated_data['amounts'])
+        except TransactionError as error:
+            return Response({'account': [error.message]},
+                            status=status.HTTP_400_BAD_REQUEST)
+        data = []
+        for deposit in deposits:
+            payment_request_url = construct_absolute_url(
+                'api:v2:deposit-payment-request',
+                kwargs={'uid': deposit.uid})
+            deposit_data = self.get_serializer(deposit).data
+            deposit_data['payment_uri'] = construct_payment_uri(
+                deposit.coin.name,
+                deposit.deposit_address.address,
+                deposit.coin_amount,
+                deposit.merchant.company_name,
+                payment_request_url)
+            data.append(deposit_data)
+        return Response(data)
 
     @detail_route(methods=['POST'])
     @atomic
@@ -181,7 +329,7 @@ class DepositViewSet(viewsets.GenericViewSet):
         return response
 
 
-class WithdrawalViewSet(viewsets.GenericViewSet):
+class WithdrawalViewSet(TransactionStatusMixin, viewsets.GenericViewSet):
 
     lookup_field = 'uid'
     serializer_class = WithdrawalSerializer
@@ -211,8 +359,10 @@ class WithdrawalViewSet(viewsets.GenericViewSet):
             return False
         return verify_signature(device.api_key,
                                 self.request.body,
-                                signature)
+                                signature,
+                                device_key=device.key)
 
+    @idempotent
     def create(self, request):
         serializer = WithdrawalInitSerializer(data=self.request.data)
         serializer.is_valid(raise_exception=True)
@@ -257,15 +407,6 @@ class WithdrawalViewSet(viewsets.GenericViewSet):
         withdrawal.save()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
-    def retrieve(self, request, uid=None):
-        withdrawal = self.get_object()
-        if withdrawal.time_broadcasted and not withdrawal.time_notified:
-            # Close order
-            withdrawal.time_notified = timezone.now()
-            withdrawal.save()
-        serializer = self.get_serializer(withdrawal)
-        return Response(serializer.data)
-
     @detail_route(methods=['GET'], renderer_classes=[PDFRenderer])
     def receipt(self, *args, **kwargs):
         withdrawal = self.get_object()
@@ -288,6 +429,11 @@ class DeviceViewSet(viewsets.GenericViewSet):
         queryset = Device.objects.all()
         if self.action == 'confirm_activation':
             queryset = queryset.filter(status='activation_in_progress')
+        elif self.action == 'retrieve':
+            queryset = queryset.select_related(
+                'merchant__language',
+                'merchant__currency',
+                'account__currency')
         return queryset
 
     def get_serializer_class(self):
@@ -296,19 +442,27 @@ class DeviceViewSet(viewsets.GenericViewSet):
         elif self.action == 'retrieve':
             return DeviceSerializer
 
-    def retrieve(self, *args, **kwargs):
-        device = self.get_object()
-        if not device.is_online() and config.ENABLE_SALT:
-            # Get info when device has been turned on
-            rq_helpers.run_task(
-                get_device_info,
-                [device.key],
-                queue='low',
-                time_delta=datetime.timedelta(minutes=3))
-        device.last_activity = timezone.now()
-        device.save()
-        serializer = self.get_serializer(device)
-        return Response(serializer.data)
+    def retrieve(self, request, key=None):
+        # Version must be obtained before reading from DB
+        etag = device_config.get_etag(key)
+        # Configuration is cached only for existing devices,
+        # version is bumped when device is deleted
+        data = device_config.get_cached_config(key, etag)
+        if data is None:
+            device = self.get_object()
+            data = dict(self.get_serializer(device).data)
+            device_config.cache_config(key, etag, data)
+        if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(data)
+        if not heartbeat.is_online(key):
+            # Device has been turned on, system info will be
+            # updated by next inventory refresh
+            Device.objects.filter(key=key).update(system_info_updated=None)
+        heartbeat.record_heartbeat(key)
+        response['ETag'] = etag
+        return response
 
     def create(self, request):
         serializer = self.get_serializer(data=self.request.data)
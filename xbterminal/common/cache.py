@@ -0,0 +1,59 @@
+from collections import OrderedDict
+import threading
+
+
+class LRUCache(object):
+    """
+    Thread-safe in-process LRU cache with bounded size
+    """
+
+    def __init__(self, max_size, get_size=None):
+        """
+        Accepts:
+            max_size: maximum total size of cached values
+            get_size: function that returns size of value,
+                each value has size 1 by default
+        """
+        self.max_size = max_size
+        self.get_size = get_size or (lambda value: 1)
+        self.size = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, size = self._items.pop(key)
+            except KeyError:
+                return default
+            # Move to the end
+            self._items[key] = (value, size)
+            return value
+
+    def set(self, key, value):
+        size = self.get_size(value)
+        if size > self.max_size:
+            return
+        with self._lock:
+            if key in self._items:
+                self.size -= self._items.pop(key)[1]
+            self._items[key] = (value, size)
+            self.size += size
+            while self.size > self.max_size:
+                self.size -= self._items.popitem(last=False)[1][1]
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._items:
+                self.size -= self._items.pop(key)[1]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.size = 0
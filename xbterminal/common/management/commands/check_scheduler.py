@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from common.scheduler import get_scheduler
+
+
+class Command(BaseCommand):
+
+    help = 'Show scheduler status'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queue', type=str, default='high',
+                            help='Queue which defines Redis connection')
+
+    def handle(self, *args, **options):
+        scheduler = get_scheduler(options['queue'])
+        for shard, owner, n_scheduled, n_due, lag in scheduler.get_stats():
+            self.stdout.write(
+                'shard {0}: owner {1}, {2} jobs, {3} due, lag {4:.3f}s'.format(
+                    shard, owner or '-', n_scheduled, n_due, lag))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from common.rq_helpers import relay_outbox
+
+
+class Command(BaseCommand):
+
+    help = ('Enqueue tasks which were not relayed after commit. '
+            'Should be run every minute')
+
+    def handle(self, *args, **options):
+        count = relay_outbox()
+        self.stdout.write('{0} tasks relayed'.format(count))
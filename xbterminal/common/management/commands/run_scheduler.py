@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from common.scheduler import get_scheduler, import_rq_scheduler_jobs
+
+
+class Command(BaseCommand):
+
+    help = 'Run job scheduler'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queue', type=str, default='high',
+                            help='Queue which defines Redis connection')
+        parser.add_argument('--burst', action='store_true', default=False,
+                            help='Enqueue due jobs and exit')
+        parser.add_argument('--import-rq-scheduler', action='store_true',
+                            default=False, dest='import_rq_scheduler',
+                            help='Import jobs scheduled by rq-scheduler')
+
+    def handle(self, *args, **options):
+        scheduler = get_scheduler(options['queue'])
+        if options['import_rq_scheduler']:
+            count = import_rq_scheduler_jobs(scheduler)
+            self.stdout.write('{0} jobs imported'.format(count))
+        scheduler.run(burst=options['burst'])
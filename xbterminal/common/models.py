@@ -0,0 +1,19 @@
+from __future__ import unicode_literals
+
+from django.contrib.postgres.fields import JSONField
+from django.db import models
+
+
+class OutboxTask(models.Model):
+    """
+    Task enqueued inside of DB transaction, saved together with
+    the transaction data and relayed to rq after commit
+    """
+    method = models.CharField(max_length=20)
+    func_name = models.CharField(max_length=200)
+    args = JSONField(default=list)
+    options = JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return '{0} {1}'.format(self.func_name, self.args)
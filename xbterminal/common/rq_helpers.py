@@ -1,46 +1,332 @@
+import datetime
+import logging
+import time
+import uuid
+
+from django.core.cache import cache
+from django.db import connection, transaction
 from django.utils import timezone
 from raven.contrib.django.raven_compat.models import client
 import rq
 import django_rq
 
-RESULT_TTL = 3600
+from common.models import OutboxTask
+from common.scheduler import get_scheduler, get_func_name, RESULT_TTL
+
+logger = logging.getLogger(__name__)
+
+PERIODIC_TASK_KEY_PREFIX = 'periodic:'
+PERIODIC_TASK_KEY_TEMPLATE = PERIODIC_TASK_KEY_PREFIX + '{func_name}:{args}'
+
+# Adaptive polling
+POLL_EVENT_CACHE_KEY_TEMPLATE = 'poll-event-{event_name}'
+POLL_EVENT_CACHE_TIMEOUT = 24 * 3600  # seconds
+POLL_BACKOFF_FACTOR = 0.2
+
+# Tasks which are not relayed after commit within this time
+# are relayed by relay_outbox command
+OUTBOX_RELAY_DELAY = 60  # seconds
 
 
 def run_task(func, args, queue='high', timeout=None, time_delta=None):
-    if time_delta:
+    """
+    Enqueue task, inside of DB transaction the task is saved
+    to outbox and enqueued after commit
+    Accepts:
+        func, args: task function and arguments
+        queue: queue name
+        timeout: job timeout
+        time_delta: timedelta, delay
+    Returns:
+        job ID
+    """
+    job_id = str(uuid.uuid4())
+    options = {
+        'queue': queue,
+        'timeout': timeout,
+        'delay': time_delta.total_seconds() if time_delta else None,
+        'job_id': job_id,
+    }
+    if connection.in_atomic_block:
+        _save_to_outbox('run_task', func, args, options)
+    else:
+        _run_task(get_func_name(func), args, **options)
+    return job_id
+
+
+def _run_task(func_name, args, queue, timeout, delay, job_id):
+    if delay:
         # Use scheduler
-        scheduler = django_rq.get_scheduler(queue)
-        scheduler.enqueue_in(
-            time_delta,
-            func,
+        get_scheduler(queue).schedule(
+            job_id,
+            func_name,
+            args,
+            queue=queue,
             timeout=timeout,
-            *args)
+            due_time=time.time() + delay)
     else:
         queue_ = django_rq.get_queue(queue)
-        return queue_.enqueue_call(
-            func,
+        queue_.enqueue_call(
+            func_name,
             args,
             timeout=timeout,
-            result_ttl=RESULT_TTL)
+            result_ttl=RESULT_TTL,
+            job_id=job_id)
+
 
+def get_task_key(func, args):
+    """
+    Deterministic key for periodic task
+    Accepts:
+        func: task function or import path
+        args: list of task arguments
+    Returns:
+        key, string
+    """
+    return PERIODIC_TASK_KEY_TEMPLATE.format(
+        func_name=get_func_name(func),
+        args=','.join(str(arg) for arg in args))
 
-def run_periodic_task(func, args, queue='high', interval=2, timeout=None):
-    scheduler = django_rq.get_scheduler(queue)
+
+def run_periodic_task(func, args, queue='high', interval=2, timeout=None,
+                      key=None, replace=False):
+    """
+    Schedule periodic task, task key is used as job ID.
+    Inside of DB transaction the task is saved to outbox
+    and scheduled after commit
+    Accepts:
+        func, args: task function and arguments
+        queue: queue name
+        interval: interval in seconds
+        timeout: job timeout
+        key: task key, default is based on function name and arguments
+        replace: replace already scheduled task with the same key
+    Returns:
+        task key or None if task with the same key
+        is already scheduled
+    """
+    options = {
+        'queue': queue,
+        'interval': interval,
+        'timeout': timeout,
+        'key': key or get_task_key(func, args),
+        'replace': replace,
+    }
+    if connection.in_atomic_block:
+        _save_to_outbox('run_periodic_task', func, args, options)
+        return options['key']
+    return _run_periodic_task(get_func_name(func), args, **options)
+
+
+def _run_periodic_task(func_name, args, queue, interval, timeout,
+                       key, replace):
+    scheduler = get_scheduler(queue)
+    if key in scheduler and not replace:
+        return None
     scheduler.schedule(
-        scheduled_time=timezone.now(),
-        func=func,
-        args=args,
-        interval=interval,
-        repeat=None,
-        result_ttl=RESULT_TTL,
-        timeout=timeout)
+        key,
+        func_name,
+        args,
+        queue=queue,
+        timeout=timeout,
+        interval=interval)
+    return key
+
+
+def run_periodic_tasks(func, args_list, queue='high', interval=2,
+                       timeout=None):
+    """
+    Schedule several periodic tasks with single request to Redis,
+    tasks with the same keys are replaced.
+    Inside of DB transaction tasks are saved to outbox
+    and scheduled after commit
+    Accepts:
+        func: task function
+        args_list: list of task argument lists
+        queue: queue name
+        interval: interval in seconds
+        timeout: job timeout
+    Returns:
+        list of task keys
+    """
+    options = {
+        'queue': queue,
+        'interval': interval,
+        'timeout': timeout,
+    }
+    if connection.in_atomic_block:
+        _save_to_outbox('run_periodic_tasks', func, args_list, options)
+    else:
+        _run_periodic_tasks(get_func_name(func), args_list, **options)
+    return [get_task_key(func, args) for args in args_list]
+
+
+def _run_periodic_tasks(func_name, args_list, queue, interval, timeout):
+    get_scheduler(queue).schedule_many([{
+        'key': get_task_key(func_name, args),
+        'func': func_name,
+        'args': args,
+        'queue': queue,
+        'timeout': timeout,
+        'interval': interval,
+    } for args in args_list])
+
+
+def _save_to_outbox(method, func, args, options):
+    outbox_task = OutboxTask.objects.create(
+        method=method,
+        func_name=get_func_name(func),
+        args=list(args),
+        options=options)
+    transaction.on_commit(lambda: _relay_after_commit(outbox_task.pk))
+
+
+def _relay_after_commit(outbox_task_id):
+    try:
+        relay_outbox_task(outbox_task_id)
+    except Exception as error:
+        # Data is already committed, task will be relayed later
+        logger.exception(error)
+
+
+def relay_outbox_task(outbox_task_id):
+    """
+    Enqueue task saved to outbox
+    Accepts:
+        outbox_task_id: OutboxTask ID
+    """
+    with transaction.atomic():
+        outbox_task = OutboxTask.objects.\
+            select_for_update().\
+            filter(pk=outbox_task_id).\
+            first()
+        if outbox_task is None:
+            # Already relayed
+            return
+        if outbox_task.method == 'run_task':
+            _run_task(outbox_task.func_name,
+                      outbox_task.args,
+                      **outbox_task.options)
+        elif outbox_task.method == 'run_periodic_task':
+            _run_periodic_task(outbox_task.func_name,
+                               outbox_task.args,
+                               **outbox_task.options)
+        elif outbox_task.method == 'run_periodic_tasks':
+            _run_periodic_tasks(outbox_task.func_name,
+                                outbox_task.args,
+                                **outbox_task.options)
+        outbox_task.delete()
+
+
+def relay_outbox(min_age=OUTBOX_RELAY_DELAY):
+    """
+    Enqueue tasks which were not relayed after commit,
+    for example because of process crash
+    Accepts:
+        min_age: relay only tasks older than min_age seconds
+    Returns:
+        number of relayed tasks
+    """
+    time_limit = timezone.now() - datetime.timedelta(seconds=min_age)
+    outbox_task_ids = list(OutboxTask.objects.
+                           filter(created_at__lt=time_limit).
+                           order_by('pk').
+                           values_list('pk', flat=True))
+    count = 0
+    for outbox_task_id in outbox_task_ids:
+        relay_outbox_task(outbox_task_id)
+        count += 1
+    return count
+
+
+def get_periodic_tasks(queue='high', prefix=''):
+    """
+    List scheduled periodic tasks
+    Accepts:
+        queue: queue name
+        prefix: key prefix, for example 'transactions.deposits.'
+    Returns:
+        list of keys
+    """
+    return get_scheduler(queue).get_keys(
+        prefix=PERIODIC_TASK_KEY_PREFIX + prefix)
+
+
+def cancel_periodic_task(key, queue='high'):
+    """
+    Cancel periodic task by key
+    Accepts:
+        key: task key
+        queue: queue name
+    """
+    get_scheduler(queue).cancel(key)
+
+
+def get_poll_interval(started_at, min_interval, max_interval,
+                      event_name=None):
+    """
+    Calculate interval for adaptive polling. Interval grows
+    in proportion to the time passed since start or since the last event,
+    so the polling backs off exponentially
+    Accepts:
+        started_at: datetime, e.g. time of transaction broadcasting,
+            None if not known
+        min_interval, max_interval: bounds in seconds
+        event_name: name of event which resets the backoff
+    Returns:
+        interval in seconds, integer
+    """
+    if started_at is None:
+        return min_interval
+    if event_name:
+        event_time = cache.get(POLL_EVENT_CACHE_KEY_TEMPLATE.format(
+            event_name=event_name))
+        if event_time is not None and event_time > started_at:
+            started_at = event_time
+    elapsed = (timezone.now() - started_at).total_seconds()
+    interval = max(elapsed * POLL_BACKOFF_FACTOR, min_interval)
+    return int(min(interval, max_interval))
+
+
+def reschedule_current_task(interval, queue='high'):
+    """
+    Change time of the next run of the current periodic task
+    Accepts:
+        interval: seconds from now
+        queue: queue name
+    """
+    job = rq.get_current_job()
+    if job is None:
+        # Not running as a job
+        return
+    get_scheduler(queue).reschedule(job.id, time.time() + interval)
+
+
+def notify_poll_event(keys, event_name=None, queue='high'):
+    """
+    Run scheduled tasks immediately,
+    reset backoff of adaptive polling if event name is given
+    Accepts:
+        keys: list of task keys
+        event_name: event name, e.g. currency name
+        queue: queue name
+    """
+    if event_name:
+        cache.set(
+            POLL_EVENT_CACHE_KEY_TEMPLATE.format(event_name=event_name),
+            timezone.now(),
+            timeout=POLL_EVENT_CACHE_TIMEOUT)
+    scheduler = get_scheduler(queue)
+    now = time.time()
+    for key in keys:
+        scheduler.reschedule(key, now)
 
 
 def cancel_current_task(queue='high'):
     job = rq.get_current_job()
-    django_rq.get_scheduler(queue).cancel(job)
+    get_scheduler(queue).cancel(job.id)
 
 
 def sentry_exc_handler(job, *exc_info):
     client.captureException(exc_info=exc_info)
-    django_rq.get_scheduler(job.origin).cancel(job)
+    get_scheduler(job.origin).cancel(job.id)
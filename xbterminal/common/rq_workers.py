@@ -0,0 +1,86 @@
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+from rq import Worker
+from rq.timeouts import BaseDeathPenalty
+
+logger = logging.getLogger(__name__)
+
+
+class NoDeathPenalty(BaseDeathPenalty):
+    """
+    SIGALRM can't be used outside of the main thread,
+    job timeouts are not enforced
+    """
+
+    def setup_death_penalty(self):
+        pass
+
+    def cancel_death_penalty(self):
+        pass
+
+
+class ThreadPoolWorker(Worker):
+    """
+    Executes jobs concurrently in threads, suitable for I/O-bound jobs
+    Usage:
+        rqworker high --worker-class common.rq_workers.ThreadPoolWorker
+    Number of threads is controlled by RQ_WORKER_CONCURRENCY setting
+    """
+
+    death_penalty_class = NoDeathPenalty
+
+    def __init__(self, *args, **kwargs):
+        super(ThreadPoolWorker, self).__init__(*args, **kwargs)
+        self.concurrency = getattr(settings, 'RQ_WORKER_CONCURRENCY', 10)
+        self._semaphore = threading.BoundedSemaphore(self.concurrency)
+        self._threads = {}
+        self._threads_lock = threading.Lock()
+
+    def work(self, *args, **kwargs):
+        try:
+            return super(ThreadPoolWorker, self).work(*args, **kwargs)
+        finally:
+            self.wait_for_jobs()
+
+    def execute_job(self, job, queue):
+        """
+        Run job in a separate thread, block while all threads are busy
+        """
+        with self._threads_lock:
+            if job.id in self._threads:
+                # Periodic job is enqueued by scheduler again
+                # while previous run is not finished, skip it
+                logger.warning('job %s is already running, skipped', job.id)
+                return
+        self._semaphore.acquire()
+        thread = threading.Thread(
+            target=self._run_job,
+            args=(job, queue),
+            name='rq-job-{0}'.format(job.id))
+        with self._threads_lock:
+            self._threads[job.id] = thread
+        thread.start()
+
+    def _run_job(self, job, queue):
+        # Each thread uses its own DB connection,
+        # close it after the job to avoid connection leaks
+        close_old_connections()
+        try:
+            self.perform_job(job, queue)
+        finally:
+            connections.close_all()
+            with self._threads_lock:
+                self._threads.pop(job.id, None)
+            self._semaphore.release()
+
+    def wait_for_jobs(self):
+        """
+        Wait for running jobs to finish
+        """
+        with self._threads_lock:
+            threads = list(self._threads.values())
+        for thread in threads:
+            thread.join()
@@ -0,0 +1,392 @@
+"""
+Job scheduler based on Redis sorted sets
+
+Scheduled jobs are distributed between shards. Each shard consists of
+    - sorted set of job keys, scored by due time
+    - hash of job definitions (function, arguments, queue, timeout)
+    - hash of intervals (for periodic jobs)
+Due jobs are popped in batches by Lua script, periodic jobs are
+put back with the new due time in the same script.
+Several scheduler instances can run at the same time, each shard
+is processed only by the instance holding the shard lease.
+"""
+import calendar
+import json
+import logging
+import math
+import os
+import signal
+import socket
+import time
+import uuid
+import zlib
+
+from django.conf import settings
+import django_rq
+from rq.job import Job, JobStatus
+from rq.queue import Queue
+from rq.utils import utcparse
+from rq_scheduler import Scheduler as RQScheduler
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'xbt:scheduler:'
+DUE_KEY_TEMPLATE = KEY_PREFIX + 'due:{shard}'
+JOBS_KEY_TEMPLATE = KEY_PREFIX + 'jobs:{shard}'
+INTERVALS_KEY_TEMPLATE = KEY_PREFIX + 'intervals:{shard}'
+LEASE_KEY_TEMPLATE = KEY_PREFIX + 'lease:{shard}'
+INSTANCES_KEY = KEY_PREFIX + 'instances'
+STATS_KEY = KEY_PREFIX + 'stats'
+
+LEASE_TIMEOUT = 10  # seconds
+BATCH_SIZE = 100
+TICK_INTERVAL = 0.5  # seconds
+LAG_WARNING_THRESHOLD = 5  # seconds
+QUEUED_JOB_TIMEOUT = 300  # seconds
+
+# Results of periodic jobs are not needed
+PERIODIC_RESULT_TTL = 0
+RESULT_TTL = 3600
+
+POP_SCRIPT = """
+local items = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1],
+                         'WITHSCORES', 'LIMIT', 0, ARGV[2])
+local result = {}
+for i = 1, #items, 2 do
+    local key = items[i]
+    local definition = redis.call('HGET', KEYS[2], key)
+    local interval = redis.call('HGET', KEYS[3], key)
+    if interval then
+        redis.call('ZADD', KEYS[1], tonumber(ARGV[1]) + tonumber(interval), key)
+    else
+        redis.call('ZREM', KEYS[1], key)
+        redis.call('HDEL', KEYS[2], key)
+    end
+    if definition then
+        table.insert(result, key)
+        table.insert(result, items[i + 1])
+        table.insert(result, definition)
+        table.insert(result, interval or '')
+    end
+end
+return result
+"""
+
+RESCHEDULE_SCRIPT = """
+if redis.call('ZSCORE', KEYS[1], ARGV[2]) then
+    redis.call('ZADD', KEYS[1], ARGV[1], ARGV[2])
+    return 1
+end
+return 0
+"""
+
+LEASE_SCRIPT = """
+local owner = redis.call('GET', KEYS[1])
+if not owner then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return 1
+end
+if owner == ARGV[1] then
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+return 0
+"""
+
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def get_shard_count():
+    return getattr(settings, 'SCHEDULER_SHARDS', 8)
+
+
+def get_shard(key):
+    """
+    Accepts:
+        key: job key
+    Returns:
+        shard number
+    """
+    return (zlib.crc32(key) & 0xffffffff) % get_shard_count()
+
+
+def get_func_name(func):
+    if isinstance(func, basestring):
+        return func
+    return '{0}.{1}'.format(func.__module__, func.__name__)
+
+
+class Scheduler(object):
+
+    def __init__(self, connection):
+        self.connection = connection
+        self._pop = connection.register_script(POP_SCRIPT)
+        self._reschedule = connection.register_script(RESCHEDULE_SCRIPT)
+        self._lease = connection.register_script(LEASE_SCRIPT)
+        self._release = connection.register_script(RELEASE_SCRIPT)
+        self.shards = range(get_shard_count())
+        self.instance_id = '{0}:{1}:{2}'.format(
+            socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+        self.owned_shards = set()
+
+    def schedule(self, key, func, args, queue='high', timeout=None,
+                 interval=None, due_time=None):
+        """
+        Add job to schedule, existing job with the same key is replaced
+        Accepts:
+            key: job key, also used as rq job ID
+            func: function or import path
+            args: list of JSON-serializable arguments
+            queue: queue name
+            timeout: job timeout
+            interval: interval in seconds for periodic jobs
+            due_time: unix time of the first run, default is now
+        """
+        with self.connection.pipeline() as pipe:
+            self._add_job(pipe, key, func, args, queue=queue,
+                          timeout=timeout, interval=interval,
+                          due_time=due_time)
+            pipe.execute()
+
+    def schedule_many(self, jobs):
+        """
+        Add several jobs to schedule with single request to Redis
+        Accepts:
+            jobs: list of dicts with schedule() arguments
+        """
+        with self.connection.pipeline() as pipe:
+            for job in jobs:
+                self._add_job(pipe, **job)
+            pipe.execute()
+
+    def _add_job(self, pipe, key, func, args, queue='high', timeout=None,
+                 interval=None, due_time=None):
+        shard = get_shard(key)
+        definition = json.dumps({
+            'func': get_func_name(func),
+            'args': list(args),
+            'queue': queue,
+            'timeout': timeout,
+        })
+        pipe.hset(JOBS_KEY_TEMPLATE.format(shard=shard), key, definition)
+        if interval:
+            pipe.hset(INTERVALS_KEY_TEMPLATE.format(shard=shard),
+                      key, interval)
+        else:
+            pipe.hdel(INTERVALS_KEY_TEMPLATE.format(shard=shard), key)
+        pipe.zadd(DUE_KEY_TEMPLATE.format(shard=shard),
+                  due_time or time.time(), key)
+
+    def reschedule(self, key, due_time):
+        """
+        Change due time of scheduled job
+        Accepts:
+            key: job key
+            due_time: unix time
+        Returns:
+            True if job is scheduled, False otherwise
+        """
+        shard = get_shard(key)
+        result = self._reschedule(
+            keys=[DUE_KEY_TEMPLATE.format(shard=shard)],
+            args=[due_time, key])
+        return bool(result)
+
+    def cancel(self, key):
+        shard = get_shard(key)
+        with self.connection.pipeline() as pipe:
+            pipe.zrem(DUE_KEY_TEMPLATE.format(shard=shard), key)
+            pipe.hdel(JOBS_KEY_TEMPLATE.format(shard=shard), key)
+            pipe.hdel(INTERVALS_KEY_TEMPLATE.format(shard=shard), key)
+            pipe.execute()
+
+    def __contains__(self, key):
+        shard = get_shard(key)
+        return self.connection.zscore(
+            DUE_KEY_TEMPLATE.format(shard=shard), key) is not None
+
+    def get_keys(self, prefix=''):
+        """
+        List scheduled jobs
+        Accepts:
+            prefix: key prefix
+        Returns:
+            list of keys
+        """
+        keys = []
+        for shard in self.shards:
+            keys += [key for key in self.connection.hkeys(
+                JOBS_KEY_TEMPLATE.format(shard=shard))
+                if key.startswith(prefix)]
+        return keys
+
+    def acquire_shards(self):
+        """
+        Acquire or renew shard leases.
+        Shards are distributed evenly between live instances
+        """
+        now = time.time()
+        with self.connection.pipeline() as pipe:
+            pipe.zadd(INSTANCES_KEY, now, self.instance_id)
+            pipe.zremrangebyscore(INSTANCES_KEY, '-inf', now - LEASE_TIMEOUT)
+            pipe.zcard(INSTANCES_KEY)
+            n_instances = pipe.execute()[2]
+        max_shards = int(math.ceil(len(self.shards) / float(n_instances)))
+        lease_timeout_ms = LEASE_TIMEOUT * 1000
+        for shard in self.shards:
+            lease_key = LEASE_KEY_TEMPLATE.format(shard=shard)
+            if shard not in self.owned_shards and \
+                    len(self.owned_shards) >= max_shards:
+                continue
+            if self._lease(keys=[lease_key],
+                           args=[self.instance_id, lease_timeout_ms]):
+                self.owned_shards.add(shard)
+            else:
+                self.owned_shards.discard(shard)
+        # Release extra shards, other instances will take them
+        while len(self.owned_shards) > max_shards:
+            shard = self.owned_shards.pop()
+            self._release(keys=[LEASE_KEY_TEMPLATE.format(shard=shard)],
+                          args=[self.instance_id])
+
+    def release_shards(self):
+        for shard in self.owned_shards:
+            self._release(keys=[LEASE_KEY_TEMPLATE.format(shard=shard)],
+                          args=[self.instance_id])
+        self.owned_shards = set()
+        self.connection.zrem(INSTANCES_KEY, self.instance_id)
+
+    def enqueue_due_jobs(self, shard):
+        """
+        Move due jobs from shard to queues
+        Accepts:
+            shard: shard number
+        Returns:
+            number of due jobs
+        """
+        now = time.time()
+        items = self._pop(
+            keys=[DUE_KEY_TEMPLATE.format(shard=shard),
+                  JOBS_KEY_TEMPLATE.format(shard=shard),
+                  INTERVALS_KEY_TEMPLATE.format(shard=shard)],
+            args=[now, BATCH_SIZE])
+        if not items:
+            return 0
+        entries = [items[idx:idx + 4] for idx in range(0, len(items), 4)]
+        # Periodic job is not enqueued again while
+        # previous run is waiting in the queue
+        with self.connection.pipeline() as pipe:
+            for key, _, _, _ in entries:
+                pipe.hmget(Job.key_for(key), 'status', 'enqueued_at')
+            job_states = pipe.execute()
+        max_lag = 0
+        n_enqueued = 0
+        with self.connection.pipeline() as pipe:
+            for (key, due_time, definition, interval), (status, enqueued_at) \
+                    in zip(entries, job_states):
+                max_lag = max(max_lag, now - float(due_time))
+                is_periodic = bool(interval)
+                if is_periodic and status == JobStatus.QUEUED and \
+                        now - calendar.timegm(utcparse(enqueued_at).utctimetuple()) < QUEUED_JOB_TIMEOUT:
+                    continue
+                definition = json.loads(definition)
+                job = Job.create(
+                    definition['func'],
+                    args=definition['args'],
+                    connection=self.connection,
+                    result_ttl=PERIODIC_RESULT_TTL if is_periodic else RESULT_TTL,
+                    timeout=definition['timeout'],
+                    id=key)
+                queue = Queue(definition['queue'], connection=self.connection)
+                queue.enqueue_job(job, pipeline=pipe)
+                n_enqueued += 1
+            pipe.hset(STATS_KEY, 'lag:{0}'.format(shard), max_lag)
+            pipe.hset(STATS_KEY, 'tick:{0}'.format(shard), now)
+            pipe.hincrby(STATS_KEY, 'enqueued:{0}'.format(shard), n_enqueued)
+            pipe.execute()
+        if max_lag > LAG_WARNING_THRESHOLD:
+            logger.warning('scheduler lag %.1fs (shard %s)', max_lag, shard)
+        return len(entries)
+
+    def request_stop(self, signum, frame):
+        self._stop_requested = True
+
+    def run(self, burst=False):
+        logger.info('scheduler %s started', self.instance_id)
+        self._stop_requested = False
+        signal.signal(signal.SIGINT, self.request_stop)
+        signal.signal(signal.SIGTERM, self.request_stop)
+        last_lease_time = 0
+        try:
+            while not self._stop_requested:
+                if time.time() - last_lease_time > LEASE_TIMEOUT / 3.0:
+                    self.acquire_shards()
+                    last_lease_time = time.time()
+                for shard in self.owned_shards:
+                    # Pop until there are no due jobs
+                    while self.enqueue_due_jobs(shard) == BATCH_SIZE:
+                        pass
+                if burst:
+                    break
+                time.sleep(TICK_INTERVAL)
+        finally:
+            self.release_shards()
+            logger.info('scheduler %s stopped', self.instance_id)
+
+    def get_stats(self):
+        """
+        Returns:
+            list of (shard, owner, scheduled jobs, due jobs, lag)
+        """
+        now = time.time()
+        stats = self.connection.hgetall(STATS_KEY)
+        result = []
+        for shard in self.shards:
+            due_key = DUE_KEY_TEMPLATE.format(shard=shard)
+            result.append((
+                shard,
+                self.connection.get(LEASE_KEY_TEMPLATE.format(shard=shard)),
+                self.connection.zcard(due_key),
+                self.connection.zcount(due_key, '-inf', now),
+                float(stats.get('lag:{0}'.format(shard), 0)),
+            ))
+        return result
+
+
+def get_scheduler(queue='high'):
+    """
+    Accepts:
+        queue: name of the queue, determines Redis connection
+    Returns:
+        Scheduler instance
+    """
+    return Scheduler(django_rq.get_connection(queue, use_strict_redis=True))
+
+
+def import_rq_scheduler_jobs(scheduler):
+    """
+    Move jobs scheduled by rq-scheduler to the scheduler
+    Accepts:
+        scheduler: Scheduler instance
+    Returns:
+        number of imported jobs
+    """
+    rq_scheduler = RQScheduler(connection=scheduler.connection)
+    count = 0
+    for job, scheduled_time in rq_scheduler.get_jobs(with_times=True):
+        scheduler.schedule(
+            job.id,
+            job.func_name,
+            job.args,
+            queue=job.origin,
+            timeout=job.timeout,
+            interval=job.meta.get('interval'),
+            due_time=calendar.timegm(scheduled_time.utctimetuple()))
+        rq_scheduler.cancel(job)
+        count += 1
+    return count
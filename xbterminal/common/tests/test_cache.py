@@ -0,0 +1,44 @@
+from django.test import SimpleTestCase
+
+from common.cache import LRUCache
+
+
+class LRUCacheTestCase(SimpleTestCase):
+
+    def test_get_set(self):
+        lru = LRUCache(2)
+        lru.set('a', 1)
+        self.assertEqual(lru.get('a'), 1)
+        self.assertIsNone(lru.get('b'))
+        self.assertEqual(lru.get('b', 0), 0)
+        lru.set('a', 2)
+        self.assertEqual(lru.get('a'), 2)
+        self.assertEqual(len(lru), 1)
+        self.assertEqual(lru.size, 1)
+
+    def test_eviction(self):
+        lru = LRUCache(2)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+        self.assertIn('a', lru)
+        self.assertNotIn('b', lru)
+        self.assertIn('c', lru)
+
+    def test_max_size(self):
+        lru = LRUCache(10, get_size=len)
+        lru.set('a', 'x' * 6)
+        lru.set('b', 'x' * 4)
+        self.assertEqual(lru.size, 10)
+        lru.set('c', 'x' * 3)
+        self.assertNotIn('a', lru)
+        self.assertEqual(lru.size, 7)
+        # Too large
+        lru.set('d', 'x' * 11)
+        self.assertNotIn('d', lru)
+        lru.delete('b')
+        self.assertEqual(lru.size, 3)
+        lru.clear()
+        self.assertEqual(len(lru), 0)
+        self.assertEqual(lru.size, 0)
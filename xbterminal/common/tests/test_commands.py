@@ -0,0 +1,55 @@
+from StringIO import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from mock import patch, Mock
+
+
+class RelayOutboxTestCase(TestCase):
+
+    @patch('common.management.commands.relay_outbox.relay_outbox')
+    def test_relay(self, relay_mock):
+        relay_mock.return_value = 2
+        buffer = StringIO()
+        call_command('relay_outbox', stdout=buffer)
+        self.assertIs(relay_mock.called, True)
+        self.assertEqual(buffer.getvalue().strip(), '2 tasks relayed')
+
+
+class CheckSchedulerTestCase(TestCase):
+
+    @patch('common.management.commands.check_scheduler.get_scheduler')
+    def test_check_scheduler(self, get_scheduler_mock):
+        get_scheduler_mock.return_value = Mock(**{
+            'get_stats.return_value': [
+                (0, 'host:100:abcd', 10, 1, 0.25),
+                (1, None, 0, 0, 0),
+            ],
+        })
+        buffer = StringIO()
+        call_command('check_scheduler', stdout=buffer)
+
+        output = buffer.getvalue().splitlines()
+        self.assertEqual(
+            output[0],
+            'shard 0: owner host:100:abcd, 10 jobs, 1 due, lag 0.250s')
+        self.assertEqual(
+            output[1],
+            'shard 1: owner -, 0 jobs, 0 due, lag 0.000s')
+
+
+class RunSchedulerTestCase(TestCase):
+
+    @patch('common.management.commands.run_scheduler.get_scheduler')
+    @patch('common.management.commands.run_scheduler.'
+           'import_rq_scheduler_jobs')
+    def test_run_scheduler(self, import_mock, get_scheduler_mock):
+        get_scheduler_mock.return_value = scheduler_mock = Mock()
+        import_mock.return_value = 2
+        buffer = StringIO()
+        call_command('run_scheduler', '--burst', '--import-rq-scheduler',
+                     stdout=buffer)
+
+        self.assertEqual(import_mock.call_args[0][0], scheduler_mock)
+        self.assertEqual(scheduler_mock.run.call_args[1]['burst'], True)
+        self.assertEqual(buffer.getvalue().strip(), '2 jobs imported')
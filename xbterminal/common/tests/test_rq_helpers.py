@@ -0,0 +1,330 @@
+import datetime
+import time
+
+from django.core.cache import cache
+from django.db.transaction import atomic
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.utils import timezone
+from mock import patch, Mock, MagicMock
+
+from common.models import OutboxTask
+from common.rq_helpers import (
+    run_task,
+    relay_outbox_task,
+    relay_outbox,
+    get_task_key,
+    run_periodic_task,
+    run_periodic_tasks,
+    get_periodic_tasks,
+    cancel_periodic_task,
+    get_poll_interval,
+    reschedule_current_task,
+    notify_poll_event,
+    cancel_current_task,
+    sentry_exc_handler)
+
+
+def periodic_task(obj_id):
+    pass
+
+
+class RunTaskTestCase(SimpleTestCase):
+
+    @patch('common.rq_helpers.get_scheduler')
+    def test_run_task_delayed(self, get_scheduler_mock):
+        get_scheduler_mock.return_value = scheduler_mock = Mock()
+        run_task(periodic_task, [10], queue='low',
+                 time_delta=datetime.timedelta(minutes=3))
+
+        self.assertEqual(get_scheduler_mock.call_args[0][0], 'low')
+        self.assertEqual(scheduler_mock.schedule.call_args[0][1],
+                         'common.tests.test_rq_helpers.periodic_task')
+        self.assertEqual(scheduler_mock.schedule.call_args[0][2], [10])
+        schedule_kwargs = scheduler_mock.schedule.call_args[1]
+        self.assertEqual(schedule_kwargs['queue'], 'low')
+        self.assertNotIn('interval', schedule_kwargs)
+        self.assertAlmostEqual(schedule_kwargs['due_time'],
+                               time.time() + 180, delta=1)
+
+    @patch('common.rq_helpers.django_rq.get_queue')
+    def test_run_task(self, get_queue_mock):
+        get_queue_mock.return_value = queue_mock = Mock()
+        job_id = run_task(periodic_task, [10], queue='low', timeout=60)
+
+        self.assertEqual(get_queue_mock.call_args[0][0], 'low')
+        self.assertEqual(queue_mock.enqueue_call.call_args[0],
+                         ('common.tests.test_rq_helpers.periodic_task', [10]))
+        self.assertEqual(queue_mock.enqueue_call.call_args[1]['timeout'], 60)
+        self.assertEqual(queue_mock.enqueue_call.call_args[1]['job_id'],
+                         job_id)
+
+
+class OutboxTestCase(TestCase):
+
+    @patch('common.rq_helpers.django_rq.get_queue')
+    @patch('common.rq_helpers.get_scheduler')
+    def test_run_task_in_transaction(self, get_scheduler_mock, get_queue_mock):
+        get_scheduler_mock.return_value = scheduler_mock = MagicMock()
+        scheduler_mock.__contains__.return_value = False
+        with atomic():
+            job_id = run_task(periodic_task, [10], queue='low')
+            key = run_periodic_task(periodic_task, [10], interval=5)
+        self.assertEqual(key, get_task_key(periodic_task, [10]))
+        # Test case transaction is not committed
+        self.assertIs(get_queue_mock.called, False)
+        self.assertIs(scheduler_mock.schedule.called, False)
+        outbox_task_1, outbox_task_2 = OutboxTask.objects.order_by('pk')
+        self.assertEqual(outbox_task_1.method, 'run_task')
+        self.assertEqual(outbox_task_1.func_name,
+                         'common.tests.test_rq_helpers.periodic_task')
+        self.assertEqual(outbox_task_1.args, [10])
+        self.assertEqual(outbox_task_1.options['job_id'], job_id)
+        self.assertEqual(outbox_task_2.method, 'run_periodic_task')
+        self.assertEqual(outbox_task_2.options['key'], key)
+
+        relay_outbox_task(outbox_task_1.pk)
+        self.assertEqual(
+            get_queue_mock.return_value.enqueue_call.call_args[1]['job_id'],
+            job_id)
+        relay_outbox_task(outbox_task_2.pk)
+        self.assertEqual(scheduler_mock.schedule.call_args[0][0], key)
+        self.assertEqual(scheduler_mock.schedule.call_args[1]['interval'], 5)
+        self.assertIs(OutboxTask.objects.exists(), False)
+        # Already relayed
+        relay_outbox_task(outbox_task_1.pk)
+        self.assertEqual(
+            get_queue_mock.return_value.enqueue_call.call_count, 1)
+
+    @patch('common.rq_helpers.get_scheduler')
+    def test_run_periodic_tasks_in_transaction(self, get_scheduler_mock):
+        with atomic():
+            keys = run_periodic_tasks(periodic_task, [[10], [11]],
+                                      interval=5)
+        self.assertEqual(keys, [get_task_key(periodic_task, [10]),
+                                get_task_key(periodic_task, [11])])
+        self.assertIs(get_scheduler_mock.called, False)
+        outbox_task = OutboxTask.objects.get()
+        self.assertEqual(outbox_task.method, 'run_periodic_tasks')
+        self.assertEqual(outbox_task.args, [[10], [11]])
+
+        relay_outbox_task(outbox_task.pk)
+        jobs = get_scheduler_mock.return_value.schedule_many.call_args[0][0]
+        self.assertEqual([job['key'] for job in jobs], keys)
+        self.assertEqual(jobs[1]['args'], [11])
+        self.assertEqual(jobs[1]['interval'], 5)
+        self.assertIs(OutboxTask.objects.exists(), False)
+
+    @patch('common.rq_helpers.relay_outbox_task')
+    def test_relay_outbox(self, relay_mock):
+        with atomic():
+            run_task(periodic_task, [10])
+            run_task(periodic_task, [11])
+        self.assertEqual(relay_outbox(), 0)
+        outbox_task_1 = OutboxTask.objects.order_by('pk').first()
+        outbox_task_1.created_at -= datetime.timedelta(minutes=5)
+        outbox_task_1.save()
+        self.assertEqual(relay_outbox(), 1)
+        self.assertEqual(relay_mock.call_args[0][0], outbox_task_1.pk)
+
+
+class OutboxCommitTestCase(TransactionTestCase):
+
+    @patch('common.rq_helpers.django_rq.get_queue')
+    def test_commit(self, get_queue_mock):
+        with atomic():
+            job_id = run_task(periodic_task, [10])
+            self.assertIs(get_queue_mock.called, False)
+        enqueue_mock = get_queue_mock.return_value.enqueue_call
+        self.assertEqual(enqueue_mock.call_count, 1)
+        self.assertEqual(enqueue_mock.call_args[1]['job_id'], job_id)
+        self.assertIs(OutboxTask.objects.exists(), False)
+
+    @patch('common.rq_helpers.django_rq.get_queue')
+    def test_rollback(self, get_queue_mock):
+        with self.assertRaises(ValueError):
+            with atomic():
+                run_task(periodic_task, [10])
+                raise ValueError
+        self.assertIs(get_queue_mock.called, False)
+        self.assertIs(OutboxTask.objects.exists(), False)
+
+    @patch('common.rq_helpers.django_rq.get_queue')
+    @patch('common.rq_helpers.logger')
+    def test_relay_error(self, logger_mock, get_queue_mock):
+        get_queue_mock.side_effect = ValueError
+        with atomic():
+            run_task(periodic_task, [10])
+        self.assertIs(logger_mock.exception.called, True)
+        # Will be relayed by relay_outbox
+        self.assertEqual(OutboxTask.objects.count(), 1)
+
+
+class PeriodicTaskTestCase(SimpleTestCase):
+
+    def test_get_task_key(self):
+        self.assertEqual(
+            get_task_key(periodic_task, [10]),
+            'periodic:common.tests.test_rq_helpers.periodic_task:10')
+        self.assertEqual(
+            get_task_key(periodic_task, ['abc', 2]),
+            'periodic:common.tests.test_rq_helpers.periodic_task:abc,2')
+        self.assertEqual(
+            get_task_key('common.tests.test_rq_helpers.periodic_task', [10]),
+            'periodic:common.tests.test_rq_helpers.periodic_task:10')
+
+    @patch('common.rq_helpers.get_scheduler')
+    def test_run_periodic_task(self, get_scheduler_mock):
+        get_scheduler_mock.return_value = scheduler_mock = MagicMock()
+        scheduler_mock.__contains__.return_value = False
+        key = run_periodic_task(periodic_task, [10], interval=5)
+
+        self.assertEqual(key, get_task_key(periodic_task, [10]))
+        self.assertEqual(get_scheduler_mock.call_args[0][0], 'high')
+        self.assertEqual(scheduler_mock.__contains__.call_args[0][0], key)
+        self.assertEqual(scheduler_mock.schedule.call_args[0], (
+            key, 'common.tests.test_rq_helpers.periodic_task', [10]))
+        schedule_kwargs = scheduler_mock.schedule.call_args[1]
+        self.assertEqual(schedule_kwargs['queue'], 'high')
+        self.assertEqual(schedule_kwargs['interval'], 5)
+
+    @patch('common.rq_helpers.get_scheduler')
+    def test_run_periodic_tasks(self, get_scheduler_mock):
+        keys = run_periodic_tasks(periodic_task, [[10], [11]], queue='low')
+
+        self.assertEqual(get_scheduler_mock.call_args[0][0], 'low')
+        scheduler_mock = get_scheduler_mock.return_value
+        self.assertEqual(scheduler_mock.schedule_many.call_count, 1)
+        jobs = scheduler_mock.schedule_many.call_args[0][0]
+        self.assertEqual([job['key'] for job in jobs], keys)
+        self.assertEqual(jobs[0]['func'],
+                         'common.tests.test_rq_helpers.periodic_task')
+        self.assertEqual(jobs[0]['args'], [10])
+        self.assertEqual(jobs[0]['queue'], 'low')
+
+    @patch('common.rq_helpers.get_scheduler')
+    def test_run_periodic_task_already_scheduled(self, get_scheduler_mock):
+        get_scheduler_mock.return_value = scheduler_mock = MagicMock()
+        scheduler_mock.__contains__.return_value = True
+        key = run_periodic_task(periodic_task, [10])
+
+        self.assertIsNone(key)
+        self.assertIs(scheduler_mock.schedule.called, False)
+
+    @patch('common.rq_helpers.get_scheduler')
+    def test_run_periodic_task_replace(self, get_scheduler_mock):
+        get_scheduler_mock.return_value = scheduler_mock = MagicMock()
+        scheduler_mock.__contains__.return_value = True
+        key = run_periodic_task(periodic_task, [10], key='test-key',
+                                replace=True)
+
+        self.assertEqual(key, 'test-key')
+        self.assertEqual(scheduler_mock.schedule.call_args[0][0], 'test-key')
+
+    @patch('common.rq_helpers.get_scheduler')
+    def test_get_periodic_tasks(self, get_scheduler_mock):
+        get_scheduler_mock.return_value = scheduler_mock = Mock(**{
+            'get_keys.return_value': [
+                'periodic:transactions.deposits.wait_for_payment:1',
+            ],
+        })
+        self.assertEqual(
+            get_periodic_tasks(prefix='transactions.deposits.'),
+            ['periodic:transactions.deposits.wait_for_payment:1'])
+        self.assertEqual(scheduler_mock.get_keys.call_args[1]['prefix'],
+                         'periodic:transactions.deposits.')
+
+    @patch('common.rq_helpers.get_scheduler')
+    def test_cancel_periodic_task(self, get_scheduler_mock):
+        get_scheduler_mock.return_value = scheduler_mock = Mock()
+        cancel_periodic_task('test-key', queue='low')
+        self.assertEqual(get_scheduler_mock.call_args[0][0], 'low')
+        self.assertEqual(scheduler_mock.cancel.call_args[0][0], 'test-key')
+
+    @patch('common.rq_helpers.rq.get_current_job')
+    @patch('common.rq_helpers.get_scheduler')
+    def test_cancel_current_task(self, get_scheduler_mock, get_job_mock):
+        get_job_mock.return_value = Mock(id='test-key')
+        get_scheduler_mock.return_value = scheduler_mock = Mock()
+        cancel_current_task()
+        self.assertEqual(scheduler_mock.cancel.call_args[0][0], 'test-key')
+
+    @patch('common.rq_helpers.client')
+    @patch('common.rq_helpers.get_scheduler')
+    def test_sentry_exc_handler(self, get_scheduler_mock, client_mock):
+        get_scheduler_mock.return_value = scheduler_mock = Mock()
+        sentry_exc_handler(Mock(id='test-key', origin='low'),
+                           ValueError, ValueError(), None)
+        self.assertIs(client_mock.captureException.called, True)
+        self.assertEqual(get_scheduler_mock.call_args[0][0], 'low')
+        self.assertEqual(scheduler_mock.cancel.call_args[0][0], 'test-key')
+
+
+class AdaptivePollingTestCase(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_get_poll_interval(self):
+        now = timezone.now()
+        self.assertEqual(get_poll_interval(None, 2, 30), 2)
+        self.assertEqual(get_poll_interval(now, 2, 30), 2)
+        self.assertEqual(
+            get_poll_interval(now - datetime.timedelta(seconds=50), 2, 30),
+            10)
+        self.assertEqual(
+            get_poll_interval(now - datetime.timedelta(hours=1), 2, 30),
+            30)
+
+    @patch('common.rq_helpers.get_scheduler')
+    def test_notify_poll_event(self, get_scheduler_mock):
+        get_scheduler_mock.return_value = scheduler_mock = Mock()
+        started_at = timezone.now() - datetime.timedelta(hours=1)
+        self.assertEqual(
+            get_poll_interval(started_at, 2, 30, event_name='BTC'), 30)
+        notify_poll_event([
+            'periodic:transactions.deposits.wait_for_payment:1',
+            'periodic:transactions.deposits.wait_for_payment:2',
+        ], event_name='BTC')
+
+        self.assertEqual(
+            get_poll_interval(started_at, 2, 30, event_name='BTC'), 2)
+        self.assertEqual(
+            get_poll_interval(started_at, 2, 30, event_name='TBTC'), 30)
+        self.assertIs(scheduler_mock.get_keys.called, False)
+        self.assertEqual(scheduler_mock.reschedule.call_count, 2)
+        self.assertEqual(
+            scheduler_mock.reschedule.call_args_list[0][0][0],
+            'periodic:transactions.deposits.wait_for_payment:1')
+        self.assertAlmostEqual(
+            scheduler_mock.reschedule.call_args_list[0][0][1],
+            time.time(), delta=1)
+
+    @patch('common.rq_helpers.get_scheduler')
+    def test_notify_poll_event_no_backoff_reset(self, get_scheduler_mock):
+        get_scheduler_mock.return_value = scheduler_mock = Mock()
+        started_at = timezone.now() - datetime.timedelta(hours=1)
+        notify_poll_event(
+            ['periodic:transactions.deposits.wait_for_payment:1'])
+
+        self.assertEqual(
+            get_poll_interval(started_at, 2, 30, event_name='BTC'), 30)
+        self.assertEqual(scheduler_mock.reschedule.call_count, 1)
+
+    @patch('common.rq_helpers.rq.get_current_job')
+    @patch('common.rq_helpers.get_scheduler')
+    def test_reschedule_current_task(self, get_scheduler_mock, get_job_mock):
+        get_job_mock.return_value = Mock(id='test-key')
+        get_scheduler_mock.return_value = scheduler_mock = Mock()
+        reschedule_current_task(20)
+
+        self.assertEqual(scheduler_mock.reschedule.call_args[0][0],
+                         'test-key')
+        self.assertAlmostEqual(scheduler_mock.reschedule.call_args[0][1],
+                               time.time() + 20, delta=1)
+
+    @patch('common.rq_helpers.rq.get_current_job')
+    @patch('common.rq_helpers.get_scheduler')
+    def test_reschedule_no_job(self, get_scheduler_mock, get_job_mock):
+        get_job_mock.return_value = None
+        reschedule_current_task(20)
+        self.assertIs(get_scheduler_mock.called, False)
@@ -0,0 +1,60 @@
+import threading
+
+from django.test import SimpleTestCase, override_settings
+from mock import patch, Mock
+from rq import Queue
+
+from common.rq_workers import ThreadPoolWorker
+
+
+class ThreadPoolWorkerTestCase(SimpleTestCase):
+
+    def _create_worker(self):
+        connection = Mock()
+        return ThreadPoolWorker([Queue('high', connection=connection)],
+                                connection=connection)
+
+    @override_settings(RQ_WORKER_CONCURRENCY=2)
+    @patch('common.rq_workers.connections')
+    def test_execute_job(self, connections_mock):
+        worker = self._create_worker()
+        self.assertEqual(worker.concurrency, 2)
+        release = threading.Event()
+        started = []
+        closed = []
+        connections_mock.close_all.side_effect = lambda: closed.append(True)
+
+        def perform_job(job, queue):
+            started.append(job.id)
+            release.wait(5)
+        worker.perform_job = Mock(side_effect=perform_job)
+
+        jobs = [Mock(id='job-{0}'.format(idx)) for idx in range(3)]
+        worker.execute_job(jobs[0], Mock())
+        worker.execute_job(jobs[1], Mock())
+        # Already running
+        worker.execute_job(jobs[0], Mock())
+        self.assertEqual(len(worker._threads), 2)
+        # Concurrency limit reached
+        self.assertIs(worker._semaphore.acquire(False), False)
+
+        release.set()
+        worker.execute_job(jobs[2], Mock())
+        worker.wait_for_jobs()
+        self.assertEqual(sorted(started), ['job-0', 'job-1', 'job-2'])
+        self.assertEqual(worker._threads, {})
+        # Mock call counters are not thread-safe
+        self.assertEqual(len(closed), 3)
+
+    @patch('common.rq_workers.connections')
+    def test_execute_job_error(self, connections_mock):
+        worker = self._create_worker()
+        worker.perform_job = Mock(side_effect=ValueError)
+        with patch('sys.stderr'):
+            worker.execute_job(Mock(id='job'), Mock())
+            worker.wait_for_jobs()
+        self.assertEqual(worker._threads, {})
+        self.assertIs(connections_mock.close_all.called, True)
+        # Semaphore is released
+        for _ in range(worker.concurrency):
+            self.assertIs(worker._semaphore.acquire(False), True)
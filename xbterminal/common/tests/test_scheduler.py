@@ -0,0 +1,234 @@
+import json
+import time
+
+from django.conf import settings
+from django.test import SimpleTestCase, override_settings
+from mock import patch, Mock, MagicMock
+import redis
+from rq.utils import utcformat, utcnow
+
+from common.scheduler import (
+    Scheduler,
+    get_shard,
+    DUE_KEY_TEMPLATE,
+    JOBS_KEY_TEMPLATE,
+    INTERVALS_KEY_TEMPLATE,
+    LEASE_KEY_TEMPLATE)
+
+
+class SchedulerTestCase(SimpleTestCase):
+
+    def _create_scheduler(self, pipe_results=None):
+        self.pipe_mock = Mock()
+        if pipe_results:
+            self.pipe_mock.execute.side_effect = pipe_results
+        connection = MagicMock(**{
+            'register_script.side_effect': lambda script: Mock(),
+        })
+        connection.pipeline.return_value.__enter__.return_value = \
+            self.pipe_mock
+        return Scheduler(connection)
+
+    @override_settings(SCHEDULER_SHARDS=4)
+    def test_get_shard(self):
+        shard = get_shard('periodic:test:1')
+        self.assertIn(shard, range(4))
+        self.assertEqual(get_shard('periodic:test:1'), shard)
+
+    def test_schedule(self):
+        scheduler = self._create_scheduler()
+        scheduler.schedule('periodic:test:1',
+                           'common.tests.test_rq_helpers.periodic_task',
+                           [1], interval=5)
+
+        shard = get_shard('periodic:test:1')
+        jobs_key, key, definition = self.pipe_mock.hset.call_args_list[0][0]
+        self.assertEqual(jobs_key, 'xbt:scheduler:jobs:{0}'.format(shard))
+        self.assertEqual(key, 'periodic:test:1')
+        self.assertEqual(json.loads(definition), {
+            'func': 'common.tests.test_rq_helpers.periodic_task',
+            'args': [1],
+            'queue': 'high',
+            'timeout': None,
+        })
+        self.assertEqual(self.pipe_mock.hset.call_args_list[1][0], (
+            'xbt:scheduler:intervals:{0}'.format(shard),
+            'periodic:test:1',
+            5))
+        due_key, due_time, key = self.pipe_mock.zadd.call_args[0]
+        self.assertEqual(due_key, 'xbt:scheduler:due:{0}'.format(shard))
+        self.assertAlmostEqual(due_time, time.time(), delta=1)
+
+    def test_schedule_many(self):
+        scheduler = self._create_scheduler()
+        scheduler.schedule_many([
+            {'key': 'periodic:test:{0}'.format(idx),
+             'func': 'common.tests.test_rq_helpers.periodic_task',
+             'args': [idx],
+             'interval': 5}
+            for idx in range(3)])
+
+        self.assertEqual(self.pipe_mock.zadd.call_count, 3)
+        self.assertEqual(self.pipe_mock.zadd.call_args[0][2],
+                         'periodic:test:2')
+        self.assertEqual(self.pipe_mock.execute.call_count, 1)
+
+    def test_reschedule(self):
+        scheduler = self._create_scheduler()
+        scheduler._reschedule.return_value = 0
+        self.assertIs(scheduler.reschedule('periodic:test:1', 100), False)
+        self.assertEqual(scheduler._reschedule.call_args[1]['args'],
+                         [100, 'periodic:test:1'])
+
+    @patch('common.scheduler.Queue')
+    def test_enqueue_due_jobs(self, queue_cls_mock):
+        now = time.time()
+        scheduler = self._create_scheduler(pipe_results=[
+            [
+                (None, None),
+                ('queued', utcformat(utcnow())),
+                ('finished', None),
+            ],
+            None,
+        ])
+        definition = json.dumps({
+            'func': 'common.tests.test_rq_helpers.periodic_task',
+            'args': [1],
+            'queue': 'high',
+            'timeout': None,
+        })
+        scheduler._pop.return_value = [
+            'periodic:test:1', str(now - 10), definition, '5',
+            'periodic:test:2', str(now), definition, '5',
+            'test-job', str(now), definition, '',
+        ]
+        result = scheduler.enqueue_due_jobs(0)
+
+        self.assertEqual(result, 3)
+        self.assertEqual(scheduler._pop.call_args[1]['keys'], [
+            'xbt:scheduler:due:0',
+            'xbt:scheduler:jobs:0',
+            'xbt:scheduler:intervals:0',
+        ])
+        # Second job is already in queue
+        queue_mock = queue_cls_mock.return_value
+        self.assertEqual(queue_mock.enqueue_job.call_count, 2)
+        job_1 = queue_mock.enqueue_job.call_args_list[0][0][0]
+        self.assertEqual(job_1.id, 'periodic:test:1')
+        self.assertEqual(job_1.func_name,
+                         'common.tests.test_rq_helpers.periodic_task')
+        self.assertEqual(job_1.args, [1])
+        self.assertEqual(job_1.result_ttl, 0)
+        job_2 = queue_mock.enqueue_job.call_args_list[1][0][0]
+        self.assertEqual(job_2.id, 'test-job')
+        self.assertEqual(job_2.result_ttl, 3600)
+        # Stats
+        stats_key, lag_field, lag = self.pipe_mock.hset.call_args_list[0][0]
+        self.assertEqual(lag_field, 'lag:0')
+        self.assertAlmostEqual(lag, 10, delta=1)
+        self.assertEqual(self.pipe_mock.hincrby.call_args[0][2], 2)
+
+    def test_enqueue_due_jobs_empty(self):
+        scheduler = self._create_scheduler()
+        scheduler._pop.return_value = []
+        self.assertEqual(scheduler.enqueue_due_jobs(0), 0)
+        self.assertIs(self.pipe_mock.execute.called, False)
+
+    @override_settings(SCHEDULER_SHARDS=4)
+    def test_acquire_shards(self):
+        scheduler = self._create_scheduler(pipe_results=[
+            [1, 0, 2],
+            [1, 0, 2],
+        ])
+        scheduler._lease.side_effect = [True, False, True, True]
+        scheduler.acquire_shards()
+        # Two instances, max 2 shards
+        self.assertEqual(scheduler.owned_shards, {0, 2})
+        self.assertEqual(scheduler._lease.call_count, 3)
+
+        scheduler._lease.side_effect = [True, True]
+        scheduler.acquire_shards()
+        self.assertEqual(scheduler.owned_shards, {0, 2})
+
+        scheduler.release_shards()
+        self.assertEqual(scheduler.owned_shards, set())
+        self.assertEqual(scheduler._release.call_count, 2)
+
+
+class SchedulerScriptsTestCase(SimpleTestCase):
+    """
+    Lua scripts are executed by test Redis database
+    """
+
+    def setUp(self):
+        self.connection = redis.StrictRedis.from_url(settings.TEST_REDIS_URL)
+        try:
+            self.connection.flushdb()
+        except redis.ConnectionError:
+            self.skipTest('Redis is not available')
+
+    def tearDown(self):
+        self.connection.flushdb()
+
+    def _get_keys(self, shard):
+        return [DUE_KEY_TEMPLATE.format(shard=shard),
+                JOBS_KEY_TEMPLATE.format(shard=shard),
+                INTERVALS_KEY_TEMPLATE.format(shard=shard)]
+
+    @override_settings(SCHEDULER_SHARDS=1)
+    def test_pop(self):
+        scheduler = Scheduler(self.connection)
+        now = time.time()
+        scheduler.schedule('periodic:test:1', 'test.func', [1],
+                           interval=5, due_time=now - 10)
+        scheduler.schedule('test-job', 'test.func', [2],
+                           due_time=now - 5)
+        scheduler.schedule('periodic:test:3', 'test.func', [3],
+                           interval=5, due_time=now + 60)
+        items = scheduler._pop(keys=self._get_keys(0), args=[now, 10])
+
+        self.assertEqual(items[0::4], ['periodic:test:1', 'test-job'])
+        self.assertEqual(json.loads(items[2])['args'], [1])
+        self.assertEqual(items[3], '5')
+        self.assertEqual(items[7], '')
+        due_key, jobs_key, _ = self._get_keys(0)
+        # Periodic job is put back with new due time
+        self.assertAlmostEqual(
+            self.connection.zscore(due_key, 'periodic:test:1'),
+            now + 5, delta=0.01)
+        # One-off job is removed
+        self.assertIsNone(self.connection.zscore(due_key, 'test-job'))
+        self.assertIs(self.connection.hexists(jobs_key, 'test-job'), False)
+        self.assertEqual(scheduler._pop(keys=self._get_keys(0),
+                                        args=[now, 10]), [])
+
+    def test_reschedule(self):
+        scheduler = Scheduler(self.connection)
+        scheduler.schedule('periodic:test:1', 'test.func', [1], interval=5)
+        self.assertIs(scheduler.reschedule('periodic:test:1', 100), True)
+        self.assertEqual(self.connection.zscore(
+            DUE_KEY_TEMPLATE.format(shard=get_shard('periodic:test:1')),
+            'periodic:test:1'), 100)
+        # Cancelled job is not scheduled again
+        self.assertIs(scheduler.reschedule('periodic:test:2', 100), False)
+        self.assertNotIn('periodic:test:2', scheduler)
+
+    def test_lease(self):
+        scheduler_1 = Scheduler(self.connection)
+        scheduler_2 = Scheduler(self.connection)
+        lease_key = LEASE_KEY_TEMPLATE.format(shard=0)
+        self.assertEqual(scheduler_1._lease(
+            keys=[lease_key], args=[scheduler_1.instance_id, 10000]), 1)
+        self.assertEqual(scheduler_2._lease(
+            keys=[lease_key], args=[scheduler_2.instance_id, 10000]), 0)
+        # Renew
+        self.assertEqual(scheduler_1._lease(
+            keys=[lease_key], args=[scheduler_1.instance_id, 10000]), 1)
+        self.assertGreater(self.connection.pttl(lease_key), 9000)
+        # Only owner can release
+        self.assertEqual(scheduler_2._release(
+            keys=[lease_key], args=[scheduler_2.instance_id]), 0)
+        self.assertEqual(scheduler_1._release(
+            keys=[lease_key], args=[scheduler_1.instance_id]), 1)
+        self.assertEqual(scheduler_2._lease(
+            keys=[lease_key], args=[scheduler_2.instance_id, 10000]), 1)
@@ -1,4 +1,5 @@
 from django.contrib import admin, messages
+from django.utils import timezone
 from django.utils.html import format_html
 from django.utils.safestring import mark_safe
 
@@ -27,6 +28,20 @@ def get_tx_link(tx_id, coin_name):
         tx_id)
 
 
+class StatusListFilter(admin.SimpleListFilter):
+
+    title = 'status'
+    parameter_name = 'status'
+
+    def lookups(self, request, model_admin):
+        statuses = model_admin.model.objects.status_filters(timezone.now())
+        return [(status, status) for status, _ in statuses]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset & queryset.model.objects.filter_status(self.value())
+
+
 @admin.register(models.Deposit)
 class DepositAdmin(admin.ModelAdmin):
 
@@ -40,6 +55,8 @@ class DepositAdmin(admin.ModelAdmin):
         'status',
     ]
 
+    list_filter = [StatusListFilter]
+
     actions = [
         'check_confirmation',
     ]
@@ -146,6 +163,8 @@ class WithdrawalAdmin(admin.ModelAdmin):
         'status',
     ]
 
+    list_filter = [StatusListFilter]
+
     actions = [
         'check_confirmation',
     ]
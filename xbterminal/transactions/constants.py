@@ -17,6 +17,8 @@ WITHDRAWAL_TIMEOUT = datetime.timedelta(minutes=5)
 WITHDRAWAL_CONFIDENCE_TIMEOUT = datetime.timedelta(minutes=45)
 WITHDRAWAL_CONFIRMATION_TIMEOUT = datetime.timedelta(minutes=180)
 
+STATUS_CHECK_BATCH_SIZE = 100
+
 PAYMENT_TYPES = Choices(
     ('BIP21', 1, _('BIP 0021 (Payment URI)')),
     ('BIP70', 2, _('BIP 0070 (Payment Protocol)')),
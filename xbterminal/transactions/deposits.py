@@ -1,22 +1,32 @@
 from decimal import Decimal
 import logging
 
+from django.db.models import Q
 from django.db.transaction import atomic
 from django.utils import timezone
 
-from bitcoin.rpc import VerifyAlreadyInChainError
+from bitcoin.rpc import JSONRPCError, VerifyAlreadyInChainError
 from constance import config
 
 from api.utils.urls import get_admin_url
-from common.rq_helpers import run_periodic_task, cancel_current_task
+from common.rq_helpers import (
+    get_task_key,
+    run_task,
+    run_periodic_task,
+    run_periodic_tasks,
+    cancel_current_task,
+    get_poll_interval,
+    reschedule_current_task)
 from common.db import refresh_for_update
+from common.uids import generate_b58_uid
 from transactions.constants import (
     COIN_DEC_PLACES,
     COIN_MIN_OUTPUT,
     DEPOSIT_TIMEOUT,
     DEPOSIT_CONFIDENCE_TIMEOUT,
     DEPOSIT_CONFIRMATION_TIMEOUT,
-    PAYMENT_TYPES)
+    PAYMENT_TYPES,
+    STATUS_CHECK_BATCH_SIZE)
 from transactions.exceptions import (
     TransactionError,
     DustOutput,
@@ -65,11 +75,72 @@ def prepare_deposit(device_or_account, amount):
         coin=account.currency,
         deposit_address=deposit_address)
     # Register address
-    bc = BlockChain(deposit.coin.name)
+    bc = BlockChain(deposit.coin.name,
+                    wallet=deposit.deposit_address.wallet_shard)
     bc.import_address(deposit_address.address, rescan=False)
     # Get exchange rate
     exchange_rate = get_exchange_rate(deposit.currency.name,
                                       deposit.coin.name)
+    _set_coin_amounts(deposit, exchange_rate)
+    deposit.save()
+    # Wait for payment
+    run_periodic_task(wait_for_payment, [deposit.pk],
+                      interval=config.POLL_PAYMENT_INTERVAL_MIN)
+    return deposit
+
+
+def prepare_deposits(account, amounts):
+    """
+    Create several deposits at once: exchange rate is fetched once,
+    addresses are imported with single RPC call,
+    deposits are saved with single INSERT
+    Accepts:
+        account: Account instance
+        amounts: list of Decimal
+    Returns:
+        list of Deposit instances
+    """
+    if not account.currency.is_enabled:
+        raise TransactionError('Account is disabled')
+    coin = account.currency
+    currency = account.merchant.currency
+    # Create new addresses
+    deposit_addresses = Address.create_many(coin.name, len(amounts),
+                                            is_change=False)
+    # Register addresses, all of them are in the same shard
+    bc = BlockChain(coin.name, wallet=deposit_addresses[0].wallet_shard)
+    bc.import_addresses([deposit_address.address for deposit_address
+                         in deposit_addresses], rescan=False)
+    # Get exchange rate
+    exchange_rate = get_exchange_rate(currency.name, coin.name)
+    uids = _generate_uids(len(amounts))
+    deposits = []
+    for uid, amount, deposit_address in zip(uids, amounts, deposit_addresses):
+        deposit = Deposit(
+            uid=uid,
+            account=account,
+            currency=currency,
+            amount=amount,
+            coin=coin,
+            deposit_address=deposit_address)
+        _set_coin_amounts(deposit, exchange_rate)
+        deposits.append(deposit)
+    Deposit.objects.bulk_create(deposits)
+    # Primary keys are not set by bulk_create
+    deposits = sorted(Deposit.objects.
+                      filter(uid__in=uids).
+                      select_related('account__merchant',
+                                     'coin',
+                                     'deposit_address'),
+                      key=lambda deposit: uids.index(deposit.uid))
+    # Wait for payments
+    run_periodic_tasks(wait_for_payment,
+                       [[item.pk] for item in deposits],
+                       interval=config.POLL_PAYMENT_INTERVAL_MIN)
+    return deposits
+
+
+def _set_coin_amounts(deposit, exchange_rate):
     # Merchant amount
     deposit.merchant_coin_amount = (deposit.amount /
                                     exchange_rate).quantize(COIN_DEC_PLACES)
@@ -79,11 +150,20 @@ def prepare_deposit(device_or_account, amount):
     deposit.fee_coin_amount = (deposit.amount *
                                Decimal(config.OUR_FEE_SHARE) /
                                exchange_rate).quantize(COIN_DEC_PLACES)
-    deposit.save()
-    # Wait for payment
-    run_periodic_task(wait_for_payment, [deposit.pk], interval=2)
-    run_periodic_task(check_deposit_status, [deposit.pk], interval=60)
-    return deposit
+
+
+def _generate_uids(count):
+    """
+    Unique deposit UIDs, see Deposit.save()
+    """
+    uids = set()
+    while len(uids) < count:
+        candidates = set(generate_b58_uid(6)
+                         for _ in range(count - len(uids))) - uids
+        uids |= candidates - set(Deposit.objects.
+                                 filter(uid__in=candidates).
+                                 values_list('uid', flat=True))
+    return list(uids)
 
 
 def validate_payment(deposit, transactions, refund_addresses,
@@ -99,13 +179,17 @@ def validate_payment(deposit, transactions, refund_addresses,
         True if deposit status changed to 'received'
         False otherwise
     """
-    bc = BlockChain(deposit.coin.name)
+    bc = BlockChain(deposit.coin.name,
+                    wallet=deposit.deposit_address.wallet_shard)
     incoming_tx_ids = set()
     received_amount = COIN_DEC_PLACES
     for incoming_tx in transactions:
-        # Validate and broadcast TX
         incoming_tx_id = incoming_tx.id()
-        if bc.is_tx_valid(incoming_tx):
+        if incoming_tx_id in deposit.incoming_tx_ids:
+            # Already validated and broadcasted, only count amount
+            pass
+        elif bc.is_tx_valid(incoming_tx):
+            # Broadcast TX
             try:
                 bc.send_raw_transaction(incoming_tx)
             except VerifyAlreadyInChainError:
@@ -171,7 +255,8 @@ def handle_bip70_payment(deposit, payment_message):
     is_received = validate_payment(deposit, transactions, refund_addresses,
                                    PAYMENT_TYPES.BIP70)
     if is_received:
-        run_periodic_task(wait_for_confidence, [deposit.pk], interval=5)
+        run_periodic_task(wait_for_confidence, [deposit.pk],
+                          interval=config.POLL_CONFIDENCE_INTERVAL_MIN)
         logger.info('payment received (%s)', deposit.pk)
     return payment_ack
 
@@ -193,8 +278,14 @@ def wait_for_payment(deposit_id):
     if deposit.time_cancelled is not None:
         # Cancel job, but check deposit address for the last time
         cancel_current_task()
+    reschedule_current_task(get_poll_interval(
+        deposit.time_created,
+        config.POLL_PAYMENT_INTERVAL_MIN,
+        config.POLL_PAYMENT_INTERVAL_MAX,
+        event_name=deposit.coin.name))
     # Connect to bitcoind
-    bc = BlockChain(deposit.coin.name)
+    bc = BlockChain(deposit.coin.name,
+                    wallet=deposit.deposit_address.wallet_shard)
     transactions = bc.get_unspent_transactions(deposit.deposit_address.address)
     if transactions:
         if len(transactions) > 1:
@@ -216,7 +307,8 @@ def wait_for_payment(deposit_id):
         else:
             if is_received:
                 cancel_current_task()
-                run_periodic_task(wait_for_confidence, [deposit.pk], interval=5)
+                run_periodic_task(wait_for_confidence, [deposit.pk],
+                                  interval=config.POLL_CONFIDENCE_INTERVAL_MIN)
                 logger.info('payment received (%s)', deposit.pk)
 
 
@@ -237,7 +329,13 @@ def wait_for_confidence(deposit_id):
     if deposit.time_cancelled is not None:
         # This task could not be started for cancelled deposits
         raise AssertionError
-    bc = BlockChain(deposit.coin.name)
+    reschedule_current_task(get_poll_interval(
+        deposit.time_received,
+        config.POLL_CONFIDENCE_INTERVAL_MIN,
+        config.POLL_CONFIDENCE_INTERVAL_MAX,
+        event_name=deposit.coin.name))
+    bc = BlockChain(deposit.coin.name,
+                    wallet=deposit.deposit_address.wallet_shard)
     for incoming_tx_id in deposit.incoming_tx_ids:
         try:
             tx_confirmed = bc.is_tx_confirmed(incoming_tx_id, minconf=1)
@@ -281,7 +379,8 @@ def wait_for_confidence(deposit_id):
                 refund_deposit(deposit, only_extra=True)
             except RefundError as error:
                 logger.exception(error)
-        run_periodic_task(wait_for_confirmation, [deposit.pk], interval=30)
+        run_periodic_task(wait_for_confirmation, [deposit.pk],
+                          interval=config.POLL_CONFIRMATION_INTERVAL_MIN)
         logger.info('payment confidence reached (%s)', deposit.pk)
 
 
@@ -295,7 +394,13 @@ def wait_for_confirmation(deposit_id):
     if deposit.time_created + DEPOSIT_CONFIRMATION_TIMEOUT < timezone.now():
         # Timeout, cancel job
         cancel_current_task()
-    bc = BlockChain(deposit.coin.name)
+    reschedule_current_task(get_poll_interval(
+        deposit.time_broadcasted,
+        config.POLL_CONFIRMATION_INTERVAL_MIN,
+        config.POLL_CONFIRMATION_INTERVAL_MAX,
+        event_name=deposit.coin.name))
+    bc = BlockChain(deposit.coin.name,
+                    wallet=deposit.deposit_address.wallet_shard)
     for incoming_tx_id in deposit.incoming_tx_ids:
         try:
             tx_confirmed = bc.is_tx_confirmed(incoming_tx_id)
@@ -321,6 +426,44 @@ def wait_for_confirmation(deposit_id):
         logger.info('payment confirmed (%s)', deposit.pk)
 
 
+def get_monitoring_tasks(coin_name, tx_id=None):
+    """
+    Find periodic tasks which should react to blockchain event
+    Accepts:
+        coin_name: currency name
+        tx_id: wallet transaction ID (walletnotify),
+            None if new block has been found (blocknotify)
+    Returns:
+        list of task keys
+    """
+    tasks = {
+        'new': wait_for_payment,
+        'underpaid': wait_for_payment,
+        'received': wait_for_confidence,
+        'broadcasted': wait_for_confirmation,
+        'notified': wait_for_confirmation,
+    }
+    queryset = Deposit.objects.with_status().\
+        filter(coin__name=coin_name, db_status__in=list(tasks))
+    if tx_id is not None:
+        bc = BlockChain(coin_name)
+        try:
+            tx = bc.get_raw_transaction(tx_id)
+        except JSONRPCError as error:
+            # Not in mempool, incoming payments will be found by polling
+            logger.warning(error)
+            addresses = []
+        else:
+            addresses = [output['address'] for output
+                         in bc.get_tx_outputs(tx)]
+        queryset = queryset.filter(
+            Q(deposit_address__address__in=addresses) |
+            Q(incoming_tx_ids__contains=[tx_id]))
+    return [get_task_key(tasks[status], [deposit_id])
+            for deposit_id, status
+            in queryset.values_list('pk', 'db_status')]
+
+
 @atomic
 def refund_deposit(deposit, only_extra=False):
     """
@@ -338,7 +481,8 @@ def refund_deposit(deposit, only_extra=False):
         raise RefundError('Partial refund is not possible for cancelled deposits')
     if deposit.refund_tx_id is not None:
         raise RefundError('Deposit already refunded')
-    bc = BlockChain(deposit.coin.name)
+    bc = BlockChain(deposit.coin.name,
+                    wallet=deposit.deposit_address.wallet_shard)
     private_key = deposit.deposit_address.get_private_key()
     tx_inputs = []
     tx_amount = COIN_DEC_PLACES
@@ -379,25 +523,63 @@ def refund_deposit(deposit, only_extra=False):
         }})
 
 
-def check_deposit_status(deposit_id):
+def check_deposits():
+    """
+    Periodic task for monitoring status of all deposits,
+    finds deposits in final state and closes them in batches,
+    refunds are sent by workers
+    """
+    now = timezone.now()
+    final_states = [
+        ('timeout', Deposit.objects.filter_status('timeout')),
+        # Stop monitoring of cancelled deposits only after timeout
+        ('cancelled', Deposit.objects.filter_status('cancelled').
+            filter(time_created__lt=now - DEPOSIT_TIMEOUT)),
+        ('failed', Deposit.objects.filter_status('failed')),
+        ('unconfirmed', Deposit.objects.filter_status('unconfirmed')),
+        ('confirmed', Deposit.objects.filter_status('confirmed')),
+    ]
+    for status, queryset in final_states:
+        while True:
+            with atomic():
+                batch = list(queryset.
+                             filter(time_closed__isnull=True).
+                             select_for_update()[:STATUS_CHECK_BATCH_SIZE])
+                if not batch:
+                    break
+                Deposit.objects.\
+                    filter(pk__in=[deposit.pk for deposit in batch]).\
+                    update(time_closed=now)
+                if status in ['cancelled', 'failed']:
+                    # Refund tasks are saved to outbox in the same
+                    # transaction, closed deposits are not checked again
+                    for deposit in batch:
+                        run_task(refund_closed_deposit, [deposit.pk])
+            for deposit in batch:
+                if status == 'timeout':
+                    logger.info('deposit timeout (%s)', deposit.pk)
+                elif status == 'unconfirmed':
+                    logger.error(
+                        'payment not confirmed (%s)',
+                        deposit.pk,
+                        extra={'data': {
+                            'deposit_admin_url': get_admin_url(deposit),
+                        }})
+
+
+def refund_closed_deposit(deposit_id):
     """
-    Periodic task for monitoring deposit status
+    Send money back to customer after deposit failure or cancellation
     Accepts:
         deposit_id: deposit ID, integer
     """
     deposit = Deposit.objects.get(pk=deposit_id)
-    if deposit.status == 'timeout':
-        logger.info('deposit timeout (%s)', deposit.pk)
-        cancel_current_task()
-    elif deposit.status == 'cancelled' and \
-            deposit.time_created + DEPOSIT_TIMEOUT < timezone.now():
-        # Stop monitoring of cancelled deposits only after timeout
+    if deposit.status == 'cancelled':
         try:
             refund_deposit(deposit)
         except RefundError as error:
             if error.message != 'Nothing to refund':
                 logger.exception(error)
-        cancel_current_task()
     elif deposit.status == 'failed':
         try:
             refund_deposit(deposit)
@@ -409,17 +591,6 @@ def check_deposit_status(deposit_id):
             extra={'data': {
                 'deposit_admin_url': get_admin_url(deposit),
             }})
-        cancel_current_task()
-    elif deposit.status == 'unconfirmed':
-        logger.error(
-            'payment not confirmed (%s)',
-            deposit.pk,
-            extra={'data': {
-                'deposit_admin_url': get_admin_url(deposit),
-            }})
-        cancel_current_task()
-    elif deposit.status == 'confirmed':
-        cancel_current_task()
 
 
 def check_deposit_confirmation(deposit):
@@ -431,7 +602,8 @@ def check_deposit_confirmation(deposit):
     """
     if deposit.time_confirmed is not None:
         return True
-    bc = BlockChain(deposit.coin.name)
+    bc = BlockChain(deposit.coin.name,
+                    wallet=deposit.deposit_address.wallet_shard)
     for incoming_tx_id in deposit.incoming_tx_ids:
         if not bc.is_tx_confirmed(incoming_tx_id):
             # Do not check other txs
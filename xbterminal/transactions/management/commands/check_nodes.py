@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from transactions.services.bitcoind import BlockChain, get_latency_histogram
+from website.models import Currency
+
+
+class Command(BaseCommand):
+
+    help = 'Check bitcoind nodes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('currency', type=str, nargs='?', default=None)
+
+    def handle(self, *args, **options):
+        currencies = Currency.objects.filter(is_fiat=False, is_enabled=True)
+        if options['currency']:
+            currencies = currencies.filter(name=options['currency'])
+            if not currencies.exists():
+                self.stdout.write(self.style.ERROR('invalid currency name'))
+        for currency in currencies:
+            for line in check_nodes(currency):
+                self.stdout.write(line)
+
+
+def check_nodes(currency):
+    bc = BlockChain(currency.name)
+    for node_id, block_count, response_time in bc.check_nodes():
+        if block_count is None:
+            yield '{0}: node {1} is not available'.format(
+                currency.name, node_id)
+        else:
+            yield '{0}: node {1}, {2} blocks, response time {3:.3f}s'.format(
+                currency.name, node_id, block_count, response_time)
+        histogram = get_latency_histogram(node_id)
+        yield '{0}: node {1} latency {2}'.format(
+            currency.name,
+            node_id,
+            ', '.join('<={0}s: {1}'.format(bucket, count)
+                      for bucket, count in histogram))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from transactions.deposits import check_deposits
+from transactions.withdrawals import check_withdrawals
+
+
+class Command(BaseCommand):
+
+    help = ('Close finished deposits and withdrawals. '
+            'Should be run every minute')
+
+    def handle(self, *args, **options):
+        check_deposits()
+        check_withdrawals()
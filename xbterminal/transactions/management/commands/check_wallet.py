@@ -32,7 +32,6 @@ class Command(BaseCommand):
 
 
 def check_wallet(currency):
-    bc = BlockChain(currency.name)
     wallet_value = Decimal(0)
     db_value = Decimal(0)
     pool_size = 0
@@ -40,8 +39,13 @@ def check_wallet(currency):
         db_value += get_account_balance(account, include_offchain=False)
     coin_type = get_coin_type(currency.name)
     db_value += get_fee_account_balance(coin_type, include_offchain=False)
+    blockchains = {}
     for address in Address.objects.filter(
             wallet_account__parent_key__coin_type=coin_type):
+        if address.wallet_shard not in blockchains:
+            blockchains[address.wallet_shard] = BlockChain(
+                currency.name, wallet=address.wallet_shard)
+        bc = blockchains[address.wallet_shard]
         address_balance = bc.get_address_balance(address.address)
         if address_balance > 0:
             wallet_value += address_balance
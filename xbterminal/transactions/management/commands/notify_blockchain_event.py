@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from common.rq_helpers import notify_poll_event
+from transactions import deposits, withdrawals
+
+
+class Command(BaseCommand):
+
+    help = ('Run payment monitoring tasks immediately. '
+            'Should be called by bitcoind: '
+            'blocknotify with currency name, '
+            'walletnotify with currency name and transaction ID')
+
+    def add_arguments(self, parser):
+        parser.add_argument('currency', type=str)
+        parser.add_argument('tx_id', type=str, nargs='?')
+
+    def handle(self, *args, **options):
+        coin_name = options['currency']
+        tx_id = options['tx_id']
+        keys = deposits.get_monitoring_tasks(coin_name, tx_id) + \
+            withdrawals.get_monitoring_tasks(coin_name, tx_id)
+        # New block resets backoff of all tasks for this currency
+        notify_poll_event(keys, event_name=None if tx_id else coin_name)
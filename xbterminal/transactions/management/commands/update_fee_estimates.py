@@ -0,0 +1,26 @@
+from constance import config
+from django.core.management.base import BaseCommand
+
+from transactions.services.bitcoind import BlockChain
+from website.models import Currency
+
+
+class Command(BaseCommand):
+
+    help = ('Update cached fee estimates. '
+            'Should be run periodically and on new blocks (blocknotify)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('currency', type=str, nargs='?', default=None)
+
+    def handle(self, *args, **options):
+        currencies = Currency.objects.filter(is_fiat=False, is_enabled=True)
+        if options['currency']:
+            currencies = currencies.filter(name=options['currency'])
+            if not currencies.exists():
+                self.stdout.write(self.style.ERROR('invalid currency name'))
+        for currency in currencies:
+            bc = BlockChain(currency.name)
+            fee_per_kb = bc.update_fee_estimate(config.TX_EXPECTED_CONFIRM)
+            self.stdout.write('{0}: fee estimate {1}'.format(
+                currency.name, fee_per_kb))
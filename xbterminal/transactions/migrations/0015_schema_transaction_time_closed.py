@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-19 13:14
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0014_schema_deposit_payment_type_upd'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deposit',
+            name='time_closed',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='withdrawal',
+            name='time_closed',
+            field=models.DateTimeField(null=True),
+        ),
+    ]
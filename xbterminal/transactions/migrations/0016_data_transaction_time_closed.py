@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-19 13:20
+from __future__ import unicode_literals
+
+import datetime
+
+from django.db import migrations
+from django.db.models import Q
+from django.utils import timezone
+
+
+def set_time_closed(apps, schema_editor):
+    # Transactions older than the longest timeout
+    # have been processed by per-object status checks
+    now = timezone.now()
+    time_limit = now - datetime.timedelta(minutes=180)
+    for model_name in ['Deposit', 'Withdrawal']:
+        model = apps.get_model('transactions', model_name)
+        model.objects.\
+            filter(Q(time_confirmed__isnull=False) |
+                   Q(time_created__lt=time_limit)).\
+            update(time_closed=now)
+
+
+def reset_time_closed(apps, schema_editor):
+    for model_name in ['Deposit', 'Withdrawal']:
+        model = apps.get_model('transactions', model_name)
+        model.objects.all().update(time_closed=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0015_schema_transaction_time_closed'),
+    ]
+
+    operations = [
+        migrations.RunPython(set_time_closed, reset_time_closed),
+    ]
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-19 14:05
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# Partial indexes for status queries
+INDEXES = [
+    # Open transactions (monitored by check_transactions)
+    ('transactions_deposit_open',
+     'transactions_deposit',
+     'time_closed IS NULL'),
+    ('transactions_withdrawal_open',
+     'transactions_withdrawal',
+     'time_closed IS NULL'),
+    # Waiting for incoming transaction
+    ('transactions_deposit_waiting',
+     'transactions_deposit',
+     'time_received IS NULL AND time_notified IS NULL '
+     'AND time_cancelled IS NULL'),
+    # Waiting for confirmation
+    ('transactions_deposit_notified',
+     'transactions_deposit',
+     'time_notified IS NOT NULL AND time_confirmed IS NULL'),
+    ('transactions_withdrawal_notified',
+     'transactions_withdrawal',
+     'time_notified IS NOT NULL AND time_confirmed IS NULL'),
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0016_data_transaction_time_closed'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX {0} ON {1} (time_created) WHERE {2}'.format(
+                index_name, table_name, condition),
+            'DROP INDEX {0}'.format(index_name))
+        for index_name, table_name, condition in INDEXES
+    ]
@@ -1,8 +1,12 @@
 from __future__ import unicode_literals
+import operator
 
 from django.contrib.postgres.fields import ArrayField
 from django.db import models, IntegrityError
+from django.db.models import Case, When, Value, F, Q
+from django.db.models.signals import post_save
 from django.db.transaction import atomic
+from django.dispatch import receiver
 from django.utils import timezone
 
 from api.utils.urls import construct_absolute_url
@@ -18,9 +22,119 @@ from transactions.constants import (
     WITHDRAWAL_CONFIRMATION_TIMEOUT,
     PAYMENT_TYPES)
 from transactions.utils.bip70 import create_payment_request
+from transactions.utils import status_cache, status_events
 from transactions.utils.compat import get_coin_type
 
 
+def _get_deposit_status_filters(now):
+    """
+    Accepts:
+        now: datetime
+    Returns:
+        list of (status, Q object) pairs, conditions are mutually exclusive
+    """
+    active = Q(time_cancelled__isnull=True)
+    notified = active & Q(time_notified__isnull=False)
+    received = active & Q(time_notified__isnull=True,
+                          time_received__isnull=False)
+    waiting = active & Q(time_notified__isnull=True,
+                         time_received__isnull=True)
+    received_ok = received & Q(
+        time_created__gte=now - DEPOSIT_CONFIDENCE_TIMEOUT)
+    waiting_ok = waiting & Q(time_created__gte=now - DEPOSIT_TIMEOUT)
+    underpaid = Q(
+        paid_coin_amount__gt=0,
+        paid_coin_amount__lt=F('merchant_coin_amount') + F('fee_coin_amount'))
+    return [
+        ('cancelled', Q(time_cancelled__isnull=False)),
+        ('confirmed', notified & Q(time_confirmed__isnull=False)),
+        ('unconfirmed', notified & Q(
+            time_confirmed__isnull=True,
+            time_created__lt=now - DEPOSIT_CONFIRMATION_TIMEOUT)),
+        ('notified', notified & Q(
+            time_confirmed__isnull=True,
+            time_created__gte=now - DEPOSIT_CONFIRMATION_TIMEOUT)),
+        ('failed', received & Q(
+            time_created__lt=now - DEPOSIT_CONFIDENCE_TIMEOUT)),
+        ('broadcasted', received_ok & Q(time_broadcasted__isnull=False)),
+        ('received', received_ok & Q(time_broadcasted__isnull=True)),
+        ('timeout', waiting & Q(time_created__lt=now - DEPOSIT_TIMEOUT)),
+        ('underpaid', waiting_ok & underpaid),
+        ('new', waiting_ok & ~underpaid),
+    ]
+
+
+def _get_withdrawal_status_filters(now):
+    """
+    Accepts:
+        now: datetime
+    Returns:
+        list of (status, Q object) pairs, conditions are mutually exclusive
+    """
+    notified = Q(time_notified__isnull=False)
+    active = Q(time_notified__isnull=True, time_cancelled__isnull=True)
+    sent = active & Q(time_sent__isnull=False)
+    sent_ok = sent & Q(
+        time_created__gte=now - WITHDRAWAL_CONFIDENCE_TIMEOUT)
+    waiting = active & Q(time_sent__isnull=True)
+    return [
+        ('confirmed', notified & Q(time_confirmed__isnull=False)),
+        ('unconfirmed', notified & Q(
+            time_confirmed__isnull=True,
+            time_created__lt=now - WITHDRAWAL_CONFIRMATION_TIMEOUT)),
+        ('notified', notified & Q(
+            time_confirmed__isnull=True,
+            time_created__gte=now - WITHDRAWAL_CONFIRMATION_TIMEOUT)),
+        ('cancelled', Q(time_notified__isnull=True,
+                        time_cancelled__isnull=False)),
+        ('failed', sent & Q(
+            time_created__lt=now - WITHDRAWAL_CONFIDENCE_TIMEOUT)),
+        ('broadcasted', sent_ok & Q(time_broadcasted__isnull=False)),
+        ('sent', sent_ok & Q(time_broadcasted__isnull=True)),
+        ('timeout', waiting & Q(time_created__lt=now - WITHDRAWAL_TIMEOUT)),
+        ('new', waiting & Q(time_created__gte=now - WITHDRAWAL_TIMEOUT)),
+    ]
+
+
+class TransactionManager(models.Manager):
+    """
+    Status of the transaction computed by the database,
+    must match the status property of the model.
+    Subclasses define status_filters function
+    """
+
+    def with_status(self):
+        """
+        Annotate transactions with db_status
+        """
+        queryset = self.get_queryset()
+        return queryset.annotate(db_status=Case(
+            *[When(condition, then=Value(status)) for status, condition
+              in self.status_filters(timezone.now())],
+            output_field=models.CharField()))
+
+    def filter_status(self, *statuses):
+        """
+        Accepts:
+            statuses: one or more status names
+        """
+        queryset = self.get_queryset()
+        status_filters = dict(self.status_filters(timezone.now()))
+        return queryset.filter(reduce(
+            operator.or_,
+            [status_filters[status] for status in statuses]))
+
+
+class DepositManager(TransactionManager):
+
+    status_filters = staticmethod(_get_deposit_status_filters)
+
+
+class WithdrawalManager(TransactionManager):
+
+    status_filters = staticmethod(_get_withdrawal_status_filters)
+
+
 class Transaction(models.Model):
     """
     Base model for Deposit and Withdrawal
@@ -72,6 +186,13 @@ class Transaction(models.Model):
 
 class Deposit(Transaction):
 
+    # Timeouts which change status, see status property
+    STATUS_TIMEOUTS = [
+        DEPOSIT_TIMEOUT,
+        DEPOSIT_CONFIDENCE_TIMEOUT,
+        DEPOSIT_CONFIRMATION_TIMEOUT,
+    ]
+
     merchant_coin_amount = models.DecimalField(
         max_digits=18,
         decimal_places=8)
@@ -110,6 +231,10 @@ class Deposit(Transaction):
     time_notified = models.DateTimeField(null=True)
     time_confirmed = models.DateTimeField(null=True)
     time_cancelled = models.DateTimeField(null=True)
+    # Status monitoring finished
+    time_closed = models.DateTimeField(null=True)
+
+    objects = DepositManager()
 
     @property
     def coin_amount(self):
@@ -237,6 +362,13 @@ class Deposit(Transaction):
 
 class Withdrawal(Transaction):
 
+    # Timeouts which change status, see status property
+    STATUS_TIMEOUTS = [
+        WITHDRAWAL_TIMEOUT,
+        WITHDRAWAL_CONFIDENCE_TIMEOUT,
+        WITHDRAWAL_CONFIRMATION_TIMEOUT,
+    ]
+
     customer_coin_amount = models.DecimalField(
         max_digits=18,
         decimal_places=8)
@@ -257,6 +389,10 @@ class Withdrawal(Transaction):
     time_notified = models.DateTimeField(null=True)
     time_confirmed = models.DateTimeField(null=True)
     time_cancelled = models.DateTimeField(null=True)
+    # Status monitoring finished
+    time_closed = models.DateTimeField(null=True)
+
+    objects = WithdrawalManager()
 
     @property
     def coin_amount(self):
@@ -277,6 +413,19 @@ class Withdrawal(Transaction):
         """
         return (self.amount / self.coin_amount).quantize(COIN_DEC_PLACES)
 
+    @property
+    def wallet_shard(self):
+        """
+        Name of bitcoind wallet which tracks outgoing transaction
+        """
+        balance_change = self.balancechange_set.\
+            filter(amount__lt=0).\
+            select_related('address').\
+            order_by('pk').\
+            first()
+        if balance_change is not None:
+            return balance_change.address.wallet_shard
+
     @property
     def status(self):
         """
@@ -327,6 +476,13 @@ class Withdrawal(Transaction):
         super(Withdrawal, self).save(*args, **kwargs)
 
 
+@receiver(post_save, sender=Deposit)
+@receiver(post_save, sender=Withdrawal)
+def transaction_status_changed(sender, instance, **kwargs):
+    status_cache.bump_version(instance)
+    status_events.publish_change(instance)
+
+
 class BalanceChangeManager(models.Manager):
 
     def exclude_unconfirmed(self):
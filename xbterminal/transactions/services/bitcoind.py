@@ -1,12 +1,24 @@
-from decimal import Decimal
+import functools
+import httplib
+import logging
+import random
+import socket
+import threading
+import time
 
-from bitcoin.rpc import RawProxy, InvalidAddressOrKeyError
+from bitcoin.rpc import (
+    RawProxy,
+    JSONRPCError,
+    InvalidAddressOrKeyError,
+    InWarmupError)
 
 from django.conf import settings
+from django.core.cache import cache
 from constance import config
 from pycoin.serialize import b2h_rev
 from pycoin.tx.Tx import Tx
 
+from common.cache import LRUCache
 from transactions.constants import COIN_DEC_PLACES, COIN_MIN_FEE
 from transactions.exceptions import (
     DoubleSpend,
@@ -15,24 +27,282 @@ from transactions.utils.compat import get_bitcoin_network
 from transactions.utils.tx import from_units
 from wallet.constants import COINS
 
+logger = logging.getLogger(__name__)
+
+RPC_WALLET_NOT_FOUND = -18
+
+# Calls which don't depend on wallet state and can be served by any node
+READ_ONLY_METHODS = frozenset([
+    'getrawtransaction',
+    'estimatefee',
+    'getblockcount',
+    'getbestblockhash',
+])
+# Wallet changes are replicated to all nodes,
+# so any replica can be promoted to primary
+MIRRORED_METHODS = frozenset([
+    'importaddress',
+    'importmulti',
+    'loadwallet',
+    'createwallet',
+])
+NODE_ERRORS = (socket.error, httplib.HTTPException, InWarmupError)
+NODE_RETRY_INTERVAL = 30  # seconds
+
+LATENCY_BUCKETS = [0.01, 0.05, 0.1, 0.5, 1, 5, float('inf')]  # seconds
+LATENCY_FLUSH_INTERVAL = 60  # seconds
+LATENCY_CACHE_KEY_TEMPLATE = 'bitcoind-latency-{node_id}-{bucket}'
+
+# Fee estimates are refreshed by update_fee_estimates command,
+# last known value is kept until the next update
+FEE_CACHE_KEY_TEMPLATE = 'bitcoind-fee-{coin_name}-{n_blocks}'
+
+# Transactions are immutable, raw transactions are cached
+# in process memory and in shared cache
+RAW_TX_CACHE_KEY_TEMPLATE = 'bitcoind-rawtx-{coin_name}-{tx_id}'
+RAW_TX_CACHE_TIMEOUT = 7 * 24 * 3600  # seconds
+RAW_TX_CACHE_MAX_SIZE = 8 * 1024 * 1024  # length of hex strings
+
+_raw_tx_cache = LRUCache(RAW_TX_CACHE_MAX_SIZE,
+                         get_size=lambda item: len(item[0]))
+
+
+def get_blockchain_config(coin_name):
+    """
+    Returns bitcoind connection settings for given coin
+    """
+    if hasattr(settings, 'BITCOIND_SERVERS'):
+        network = get_bitcoin_network(coin_name)
+        return settings.BITCOIND_SERVERS[network]
+    else:
+        return settings.BLOCKCHAINS[coin_name]
+
+
+def get_service_url(node_config, wallet=None):
+    service_url = "http://{user}:{password}@{host}:{port}".format(
+        user=node_config['USER'],
+        password=node_config['PASSWORD'],
+        host=node_config['HOST'],
+        port=node_config['PORT'])
+    if wallet:
+        service_url += '/wallet/{0}'.format(wallet)
+    return service_url
+
+
+def save_latency_histogram(node_id, counts):
+    """
+    Add latency counts to the histogram stored in cache
+    Accepts:
+        node_id: 'host:port' string
+        counts: list of counts for each of LATENCY_BUCKETS
+    """
+    for bucket, count in zip(LATENCY_BUCKETS, counts):
+        if not count:
+            continue
+        cache_key = LATENCY_CACHE_KEY_TEMPLATE.format(
+            node_id=node_id, bucket=bucket)
+        cache.add(cache_key, 0, timeout=None)
+        cache.incr(cache_key, count)
+
+
+def get_latency_histogram(node_id):
+    """
+    Accepts:
+        node_id: 'host:port' string
+    Returns:
+        list of (bucket upper bound, count) pairs
+    """
+    cache_keys = [
+        LATENCY_CACHE_KEY_TEMPLATE.format(node_id=node_id, bucket=bucket)
+        for bucket in LATENCY_BUCKETS]
+    values = cache.get_many(cache_keys)
+    return [(bucket, values.get(cache_key, 0))
+            for bucket, cache_key in zip(LATENCY_BUCKETS, cache_keys)]
+
+
+class NodeStats(object):
+    """
+    Health status and latency histogram of bitcoind node,
+    shared by all connections to the node within the process
+    """
+
+    def __init__(self, node_id):
+        self.node_id = node_id
+        self.failed_at = None
+        self.latency_counts = [0] * len(LATENCY_BUCKETS)
+        self.flushed_at = time.time()
+        self._lock = threading.Lock()
+
+    def is_healthy(self):
+        return (self.failed_at is None or
+                self.failed_at + NODE_RETRY_INTERVAL < time.time())
+
+    def mark_failed(self):
+        self.failed_at = time.time()
+
+    def record(self, latency):
+        with self._lock:
+            self.failed_at = None
+            for index, bucket in enumerate(LATENCY_BUCKETS):
+                if latency <= bucket:
+                    self.latency_counts[index] += 1
+                    break
+            if self.flushed_at + LATENCY_FLUSH_INTERVAL > time.time():
+                return
+            counts = self.latency_counts
+            self.latency_counts = [0] * len(LATENCY_BUCKETS)
+            self.flushed_at = time.time()
+        save_latency_histogram(self.node_id, counts)
+
+
+_node_stats = {}
+_node_stats_lock = threading.Lock()
+
+
+def get_node_stats(node_id):
+    with _node_stats_lock:
+        if node_id not in _node_stats:
+            _node_stats[node_id] = NodeStats(node_id)
+        return _node_stats[node_id]
+
+
+class Node(object):
+
+    def __init__(self, node_config, wallet=None):
+        self.node_id = '{0}:{1}'.format(node_config['HOST'],
+                                        node_config['PORT'])
+        self.service_url = get_service_url(node_config, wallet=wallet)
+        self.stats = get_node_stats(self.node_id)
+        self._proxy = RawProxy(self.service_url)
+
+    def call(self, method, *args):
+        start_time = time.time()
+        try:
+            result = getattr(self._proxy, method)(*args)
+        except NODE_ERRORS:
+            self.stats.mark_failed()
+            # Connection may be left in inconsistent state
+            self._proxy = RawProxy(self.service_url)
+            raise
+        except JSONRPCError:
+            self.stats.record(time.time() - start_time)
+            raise
+        self.stats.record(time.time() - start_time)
+        return result
+
+
+class NodePool(object):
+    """
+    Sends RPC calls to the group of bitcoind nodes:
+    read-only calls are distributed between healthy nodes
+    (failover to other nodes), wallet and write calls are sent
+    only to the primary node, wallet changes are replicated to all nodes
+    """
+
+    def __init__(self, nodes, wallet=None):
+        """
+        Accepts:
+            nodes: list of node settings, primary node first
+            wallet: name of bitcoind wallet
+        """
+        self._nodes = [Node(node_config, wallet=wallet)
+                       for node_config in nodes]
+
+    def __getattr__(self, name):
+        if name.startswith('__') and name.endswith('__'):
+            raise AttributeError
+        return functools.partial(self.call, name)
+
+    def call(self, method, *args):
+        if method not in READ_ONLY_METHODS:
+            # Replicas may have different wallet state,
+            # errors of primary node are not hidden by failover
+            primary_node = self._nodes[0]
+            result = primary_node.call(method, *args)
+            if method in MIRRORED_METHODS:
+                self._replicate(method, args)
+            return result
+        nodes = list(self._nodes)
+        random.shuffle(nodes)
+        # Unavailable nodes are tried last
+        nodes.sort(key=lambda node: not node.stats.is_healthy())
+        for node in nodes:
+            try:
+                return node.call(method, *args)
+            except NODE_ERRORS as error:
+                logger.warning('bitcoind node %s is not available: %s',
+                               node.node_id, error)
+                last_error = error
+        raise last_error
+
+    def _replicate(self, method, args):
+        for replica in self._nodes[1:]:
+            try:
+                replica.call(method, *args)
+            except (JSONRPCError, ) + NODE_ERRORS as error:
+                logger.error('%s call not replicated to node %s: %s',
+                             method, replica.node_id, error)
+
+    def check_nodes(self):
+        """
+        Returns:
+            list of (node ID, block count, response time) tuples,
+            block count is None if node is not available
+        """
+        results = []
+        for node in self._nodes:
+            start_time = time.time()
+            try:
+                block_count = node.call('getblockcount')
+            except NODE_ERRORS:
+                block_count = None
+            results.append((node.node_id,
+                            block_count,
+                            time.time() - start_time))
+        return results
+
 
 class BlockChain(object):
 
     MAXCONF = 9999999
 
-    def __init__(self, coin_name):
+    def __init__(self, coin_name, wallet=None):
+        """
+        Accepts:
+            coin_name: coin name (currency name)
+            wallet: name of bitcoind wallet (multiwallet shard),
+                default wallet is used if not specified
+        """
+        self.coin_name = coin_name
         self.pycoin_code = getattr(COINS, coin_name).pycoin_code
-        if hasattr(settings, 'BITCOIND_SERVERS'):
-            network = get_bitcoin_network(coin_name)
-            config = settings.BITCOIND_SERVERS[network]
+        self.wallet = wallet
+        config = get_blockchain_config(coin_name)
+        nodes = [config] + config.get('REPLICAS', [])
+        self._proxy = NodePool(nodes, wallet=wallet)
+        if wallet:
+            # Wallet management calls must not be bound to wallet endpoint
+            self._node_proxy = NodePool(nodes)
         else:
-            config = settings.BLOCKCHAINS[coin_name]
-        service_url = "http://{user}:{password}@{host}:{port}".format(
-            user=config['USER'],
-            password=config['PASSWORD'],
-            host=config['HOST'],
-            port=config['PORT'])
-        self._proxy = RawProxy(service_url)
+            self._node_proxy = self._proxy
+
+    def check_nodes(self):
+        """
+        Returns:
+            list of (node ID, block count, response time) tuples
+        """
+        return self._node_proxy.check_nodes()
+
+    def load_wallet(self):
+        """
+        Load wallet shard, create new watch-only wallet if it doesn't exist
+        """
+        try:
+            self._node_proxy.loadwallet(self.wallet)
+        except JSONRPCError as error:
+            if error.error['code'] != RPC_WALLET_NOT_FOUND:
+                raise
+            disable_private_keys = True
+            self._node_proxy.createwallet(self.wallet, disable_private_keys)
 
     def import_address(self, address, rescan=False):
         """
@@ -41,10 +311,44 @@ class BlockChain(object):
             rescan: do blockchain rescan after import or not
         """
         label = ''
-        result = self._proxy.importaddress(address, label, rescan)
+        try:
+            result = self._proxy.importaddress(address, label, rescan)
+        except JSONRPCError as error:
+            if not self.wallet or \
+                    error.error['code'] != RPC_WALLET_NOT_FOUND:
+                raise
+            # New shard
+            self.load_wallet()
+            result = self._proxy.importaddress(address, label, rescan)
         if result is not None:
             raise ValueError
 
+    def import_addresses(self, addresses, rescan=False):
+        """
+        Import several addresses with single RPC call
+        Accepts:
+            addresses: list of bitcoin addresses
+            rescan: do blockchain rescan after import or not
+        """
+        requests = [{
+            'scriptPubKey': {'address': address},
+            'timestamp': 'now',
+            'watchonly': True,
+            'label': '',
+        } for address in addresses]
+        options = {'rescan': rescan}
+        try:
+            results = self._proxy.importmulti(requests, options)
+        except JSONRPCError as error:
+            if not self.wallet or \
+                    error.error['code'] != RPC_WALLET_NOT_FOUND:
+                raise
+            # New shard
+            self.load_wallet()
+            results = self._proxy.importmulti(requests, options)
+        if not all(result['success'] for result in results):
+            raise ValueError
+
     def get_address_balance(self, address):
         """
         Accepts:
@@ -91,8 +395,19 @@ class BlockChain(object):
         Returns:
             transaction: pycoin Tx object
         """
-        tx_hex = self._proxy.getrawtransaction(transaction_id)
-        return Tx.from_hex(tx_hex)
+        cache_key = RAW_TX_CACHE_KEY_TEMPLATE.format(
+            coin_name=self.coin_name,
+            tx_id=transaction_id)
+        cached = _raw_tx_cache.get(cache_key)
+        if cached is not None:
+            return cached[1]
+        tx_hex = cache.get(cache_key)
+        if tx_hex is None:
+            tx_hex = self._proxy.getrawtransaction(transaction_id)
+            cache.set(cache_key, tx_hex, timeout=RAW_TX_CACHE_TIMEOUT)
+        transaction = Tx.from_hex(tx_hex)
+        _raw_tx_cache.set(cache_key, (tx_hex, transaction))
+        return transaction
 
     def get_tx_inputs(self, transaction):
         """
@@ -105,10 +420,10 @@ class BlockChain(object):
         inputs = []
         for txin in transaction.txs_in:
             input_tx_id = b2h_rev(txin.previous_hash)
-            input_tx_info = self._proxy.getrawtransaction(input_tx_id, 1)
-            input_tx_out = input_tx_info['vout'][txin.previous_index]
-            amount = Decimal(input_tx_out['value'])
-            address = input_tx_out['scriptPubKey']['addresses'][0]
+            input_tx = self.get_raw_transaction(input_tx_id)
+            input_tx_out = input_tx.txs_out[txin.previous_index]
+            amount = from_units(input_tx_out.coin_value)
+            address = input_tx_out.address(netcode=self.pycoin_code)
             inputs.append({'amount': amount, 'address': address})
         return inputs
 
@@ -183,6 +498,35 @@ class BlockChain(object):
                 raise TransactionModified(conflicting_tx_id)
         return False
 
+    def update_fee_estimate(self, n_blocks):
+        """
+        Get fee estimate from bitcoind and save it to cache
+        Accepts:
+            n_blocks: confirmation target
+        Returns:
+            fee per kilobyte, -1 if there is not enough data
+        """
+        fee_per_kb = self._proxy.estimatefee(n_blocks)
+        cache_key = FEE_CACHE_KEY_TEMPLATE.format(
+            coin_name=self.coin_name,
+            n_blocks=n_blocks)
+        cache.set(cache_key, fee_per_kb, timeout=None)
+        return fee_per_kb
+
+    def get_fee_estimate(self, n_blocks):
+        """
+        Get last known fee estimate from cache, never calls bitcoind
+        Accepts:
+            n_blocks: confirmation target
+        Returns:
+            fee per kilobyte, -1 if there is not enough data
+                or estimate has not been fetched yet
+        """
+        cache_key = FEE_CACHE_KEY_TEMPLATE.format(
+            coin_name=self.coin_name,
+            n_blocks=n_blocks)
+        return cache.get(cache_key, -1)
+
     def get_tx_fee(self, n_inputs, n_outputs,
                    n_blocks=None):
         """
@@ -195,7 +539,7 @@ class BlockChain(object):
         Returns:
             fee
         """
-        fee_per_kb = self._proxy.estimatefee(
+        fee_per_kb = self.get_fee_estimate(
             n_blocks or config.TX_EXPECTED_CONFIRM)
         if fee_per_kb == -1:
             fee_per_kb = config.TX_DEFAULT_FEE
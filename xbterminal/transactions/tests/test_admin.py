@@ -4,7 +4,7 @@ from django.test import TestCase
 from mock import patch, Mock
 
 from transactions.models import Deposit, Withdrawal
-from transactions.admin import DepositAdmin, WithdrawalAdmin
+from transactions.admin import DepositAdmin, WithdrawalAdmin, StatusListFilter
 from transactions.tests.factories import DepositFactory, WithdrawalFactory
 
 
@@ -40,6 +40,16 @@ class DepositAdminTestCase(TestCase):
             self.ma.message_user.call_args[0][1],
             'Deposit "{0}" is confirmed.'.format(deposit_2.pk))
 
+    def test_status_filter(self):
+        deposit_1 = DepositFactory()
+        DepositFactory(timeout=True)
+        list_filter = StatusListFilter(
+            Mock(), {'status': 'new'}, Deposit, self.ma)
+        self.assertIn(('underpaid', 'underpaid'),
+                      list_filter.lookups(Mock(), self.ma))
+        queryset = list_filter.queryset(Mock(), Deposit.objects.all())
+        self.assertEqual(list(queryset), [deposit_1])
+
 
 class WithdrawalAdminTestCase(TestCase):
 
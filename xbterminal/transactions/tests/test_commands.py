@@ -90,3 +90,89 @@ class CheckWalletTestCase(TestCase):
 
         self.assertIn('invalid currency name', buffer.getvalue())
         self.assertIs(check_wallet_mock.called, False)
+
+
+class CheckNodesTestCase(TestCase):
+
+    @patch('transactions.management.commands.check_nodes.BlockChain')
+    def test_check_nodes(self, bc_cls_mock):
+        bc_cls_mock.return_value = Mock(**{
+            'check_nodes.return_value': [
+                ('localhost:8332', 500000, 0.01),
+                ('node2:8332', None, 0.001),
+            ],
+        })
+        buffer = StringIO()
+        call_command('check_nodes', 'BTC', stdout=buffer)
+
+        output = buffer.getvalue().splitlines()
+        self.assertEqual(len(output), 4)
+        self.assertEqual(
+            output[0],
+            'BTC: node localhost:8332, 500000 blocks, response time 0.010s')
+        self.assertIn('BTC: node localhost:8332 latency <=0.01s: 0', output[1])
+        self.assertEqual(output[2], 'BTC: node node2:8332 is not available')
+
+
+class UpdateFeeEstimatesTestCase(TestCase):
+
+    @patch('transactions.management.commands.update_fee_estimates.BlockChain')
+    def test_update(self, bc_cls_mock):
+        bc_cls_mock.return_value = bc_mock = Mock(**{
+            'update_fee_estimate.return_value': Decimal('0.0002'),
+        })
+        buffer = StringIO()
+        call_command('update_fee_estimates', 'BTC', stdout=buffer)
+
+        self.assertEqual(bc_cls_mock.call_args[0][0], 'BTC')
+        self.assertEqual(bc_mock.update_fee_estimate.call_args[0][0], 10)
+        self.assertEqual(buffer.getvalue().strip(),
+                         'BTC: fee estimate 0.0002')
+
+
+class NotifyBlockchainEventTestCase(TestCase):
+
+    @patch('transactions.management.commands.'
+           'notify_blockchain_event.notify_poll_event')
+    @patch('transactions.management.commands.'
+           'notify_blockchain_event.deposits.get_monitoring_tasks')
+    @patch('transactions.management.commands.'
+           'notify_blockchain_event.withdrawals.get_monitoring_tasks')
+    def test_new_block(self, withdrawal_tasks_mock, deposit_tasks_mock,
+                       notify_mock):
+        deposit_tasks_mock.return_value = ['deposit-task']
+        withdrawal_tasks_mock.return_value = ['withdrawal-task']
+        call_command('notify_blockchain_event', 'BTC')
+        self.assertEqual(deposit_tasks_mock.call_args[0], ('BTC', None))
+        self.assertEqual(withdrawal_tasks_mock.call_args[0], ('BTC', None))
+        self.assertEqual(notify_mock.call_args[0][0],
+                         ['deposit-task', 'withdrawal-task'])
+        self.assertEqual(notify_mock.call_args[1]['event_name'], 'BTC')
+
+    @patch('transactions.management.commands.'
+           'notify_blockchain_event.notify_poll_event')
+    @patch('transactions.management.commands.'
+           'notify_blockchain_event.deposits.get_monitoring_tasks')
+    @patch('transactions.management.commands.'
+           'notify_blockchain_event.withdrawals.get_monitoring_tasks')
+    def test_wallet_transaction(self, withdrawal_tasks_mock,
+                                deposit_tasks_mock, notify_mock):
+        deposit_tasks_mock.return_value = ['deposit-task']
+        withdrawal_tasks_mock.return_value = []
+        call_command('notify_blockchain_event', 'BTC', 'txid')
+        self.assertEqual(deposit_tasks_mock.call_args[0], ('BTC', 'txid'))
+        self.assertEqual(withdrawal_tasks_mock.call_args[0], ('BTC', 'txid'))
+        self.assertEqual(notify_mock.call_args[0][0], ['deposit-task'])
+        self.assertIsNone(notify_mock.call_args[1]['event_name'])
+
+
+class CheckTransactionsTestCase(TestCase):
+
+    @patch('transactions.management.commands.'
+           'check_transactions.check_withdrawals')
+    @patch('transactions.management.commands.'
+           'check_transactions.check_deposits')
+    def test_check(self, check_deposits_mock, check_withdrawals_mock):
+        call_command('check_transactions')
+        self.assertIs(check_deposits_mock.called, True)
+        self.assertIs(check_withdrawals_mock.called, True)
@@ -1,8 +1,11 @@
 from decimal import Decimal
+import datetime
 
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
 
 from mock import patch, Mock
+from bitcoin.rpc import JSONRPCError
+from constance.test import override_config
 
 from transactions.constants import PAYMENT_TYPES
 from transactions.exceptions import (
@@ -16,14 +19,18 @@ from transactions.exceptions import (
     RefundError)
 from transactions.deposits import (
     prepare_deposit,
+    prepare_deposits,
     validate_payment,
     handle_bip70_payment,
     wait_for_payment,
     wait_for_confidence,
     wait_for_confirmation,
     refund_deposit,
-    check_deposit_status,
-    check_deposit_confirmation)
+    check_deposits,
+    refund_closed_deposit,
+    check_deposit_confirmation,
+    get_monitoring_tasks)
+from transactions.models import Deposit
 from transactions.tests.factories import DepositFactory
 from transactions.utils.compat import get_account_balance, get_address_balance
 from wallet.constants import BIP44_COIN_TYPES
@@ -66,13 +73,10 @@ class PrepareDepositTestCase(TestCase):
                          deposit.currency.name)
         self.assertEqual(get_rate_mock.call_args[0][1],
                          deposit.coin.name)
-        self.assertEqual(run_task_mock.call_count, 2)
-        self.assertEqual(run_task_mock.call_args_list[0][0][0].__name__,
+        self.assertEqual(run_task_mock.call_count, 1)
+        self.assertEqual(run_task_mock.call_args[0][0].__name__,
                          'wait_for_payment')
-        self.assertEqual(run_task_mock.call_args_list[0][0][1], [deposit.pk])
-        self.assertEqual(run_task_mock.call_args_list[1][0][0].__name__,
-                         'check_deposit_status')
-        self.assertEqual(run_task_mock.call_args_list[1][0][1], [deposit.pk])
+        self.assertEqual(run_task_mock.call_args[0][1], [deposit.pk])
 
     @patch('transactions.deposits.BlockChain')
     @patch('transactions.deposits.get_exchange_rate')
@@ -90,7 +94,7 @@ class PrepareDepositTestCase(TestCase):
         self.assertEqual(
             deposit.deposit_address.wallet_account.parent_key.coin_type,
             BIP44_COIN_TYPES.BTC)
-        self.assertEqual(run_task_mock.call_count, 2)
+        self.assertEqual(run_task_mock.call_count, 1)
 
     def test_currency_disabled(self):
         account = AccountFactory(currency__name='TBTC')
@@ -102,6 +106,52 @@ class PrepareDepositTestCase(TestCase):
             'Account is disabled')
 
 
+class PrepareDepositsTestCase(TestCase):
+
+    def setUp(self):
+        WalletKeyFactory()
+
+    @patch('transactions.deposits.BlockChain')
+    @patch('transactions.deposits.get_exchange_rate')
+    @patch('transactions.deposits.run_periodic_tasks')
+    def test_prepare(self, run_tasks_mock, get_rate_mock, bc_cls_mock):
+        account = AccountFactory()
+        bc_cls_mock.return_value = bc_mock = Mock()
+        get_rate_mock.return_value = Decimal('2000.0')
+        amounts = [Decimal('10.00'), Decimal('1.00'), Decimal('20.00')]
+        deposits = prepare_deposits(account, amounts)
+
+        self.assertEqual(len(deposits), 3)
+        self.assertEqual(len(set(deposit.uid for deposit in deposits)), 3)
+        self.assertEqual([deposit.amount for deposit in deposits], amounts)
+        self.assertEqual(deposits[0].account, account)
+        self.assertIsNone(deposits[0].device)
+        self.assertEqual(deposits[0].currency, account.merchant.currency)
+        self.assertEqual(deposits[0].merchant_coin_amount, Decimal('0.005'))
+        self.assertEqual(deposits[0].fee_coin_amount, Decimal('0.000025'))
+        self.assertEqual(deposits[0].status, 'new')
+        self.assertIsNotNone(deposits[0].time_created)
+        self.assertEqual(len(set(deposit.deposit_address_id
+                                 for deposit in deposits)), 3)
+
+        self.assertEqual(get_rate_mock.call_count, 1)
+        self.assertEqual(bc_mock.import_addresses.call_count, 1)
+        self.assertEqual(bc_mock.import_addresses.call_args[0][0],
+                         [deposit.deposit_address.address
+                          for deposit in deposits])
+        self.assertEqual(run_tasks_mock.call_count, 1)
+        self.assertEqual(run_tasks_mock.call_args[0][0].__name__,
+                         'wait_for_payment')
+        self.assertEqual(run_tasks_mock.call_args[0][1],
+                         [[deposit.pk] for deposit in deposits])
+
+    def test_currency_disabled(self):
+        account = AccountFactory(currency__name='TBTC')
+        account.currency.is_enabled = False
+        with self.assertRaises(TransactionError):
+            prepare_deposits(account, [Decimal('10.00')])
+
+
 class ValidatePaymentTestCase(TestCase):
 
     @patch('transactions.deposits.BlockChain')
@@ -189,8 +239,13 @@ class ValidatePaymentTestCase(TestCase):
             deposit, [incoming_tx_1, incoming_tx_2], [refund_address],
             PAYMENT_TYPES.BIP21)
         self.assertIs(result_2, True)
-        self.assertEqual(bc_mock.is_tx_valid.call_count, 2)
-        self.assertEqual(bc_mock.send_raw_transaction.call_count, 2)
+        # Known transaction is not validated again
+        self.assertEqual(bc_mock.is_tx_valid.call_count, 1)
+        self.assertEqual(bc_mock.is_tx_valid.call_args[0][0], incoming_tx_2)
+        self.assertEqual(bc_mock.send_raw_transaction.call_count, 1)
+        self.assertEqual(bc_mock.send_raw_transaction.call_args[0][0],
+                         incoming_tx_2)
+        self.assertEqual(bc_mock.get_tx_outputs.call_count, 2)
         deposit.refresh_from_db()
         self.assertEqual(deposit.paid_coin_amount, Decimal('0.15'))
         self.assertEqual(deposit.incoming_tx_ids,
@@ -375,6 +430,25 @@ class WaitForPaymentTestCase(TestCase):
         self.assertIs(validate_mock.called, False)
         self.assertIs(cancel_mock.called, False)
 
+    @patch('transactions.deposits.cancel_current_task')
+    @patch('transactions.deposits.reschedule_current_task')
+    @patch('transactions.deposits.BlockChain')
+    @override_config(POLL_PAYMENT_INTERVAL_MIN=2,
+                     POLL_PAYMENT_INTERVAL_MAX=30)
+    def test_backoff(self, bc_cls_mock, reschedule_mock, cancel_mock):
+        bc_cls_mock.return_value = Mock(**{
+            'get_unspent_transactions.return_value': [],
+        })
+        deposit = DepositFactory()
+        wait_for_payment(deposit.pk)
+        self.assertEqual(reschedule_mock.call_args[0][0], 2)
+
+        deposit.time_created -= datetime.timedelta(minutes=10)
+        deposit.save()
+        wait_for_payment(deposit.pk)
+        self.assertEqual(reschedule_mock.call_args[0][0], 30)
+        self.assertIs(cancel_mock.called, False)
+
     @patch('transactions.deposits.cancel_current_task')
     @patch('transactions.deposits.BlockChain')
     @patch('transactions.deposits.validate_payment')
@@ -873,73 +947,107 @@ class RefundDepositTestCase(TestCase):
                          'Output is below dust threshold')
 
 
-class CheckDepositStatusTestCase(TestCase):
+class RefundDepositCommitTestCase(TransactionTestCase):
 
-    @patch('transactions.deposits.cancel_current_task')
-    def test_new(self, cancel_mock):
-        deposit = DepositFactory()
-        check_deposit_status(deposit.pk)
-        self.assertIs(cancel_mock.called, False)
+    # Currencies are created by data migration
+    serialized_rollback = True
 
-    @patch('transactions.deposits.cancel_current_task')
-    def test_notified(self, cancel_mock):
-        deposit = DepositFactory(notified=True)
-        check_deposit_status(deposit.pk)
-        self.assertIs(cancel_mock.called, False)
+    @patch('transactions.deposits.BlockChain')
+    @patch('transactions.deposits.create_tx')
+    @patch('transactions.utils.status_events.get_connection')
+    def test_refund_outside_of_transaction(self, connection_mock,
+                                           create_tx_mock, bc_cls_mock):
+        deposit = DepositFactory(failed=True)
+        refund_tx_id = '5' * 64
+        bc_cls_mock.return_value = Mock(**{
+            'get_raw_unspent_outputs.return_value': [{
+                'txid': '1' * 64,
+                'amount': deposit.paid_coin_amount,
+            }],
+            'get_tx_fee.return_value': Decimal('0.0005'),
+            'send_raw_transaction.return_value': refund_tx_id,
+        })
+        refund_deposit(deposit)
+        deposit.refresh_from_db()
+        self.assertEqual(deposit.refund_tx_id, refund_tx_id)
 
-    @patch('transactions.deposits.cancel_current_task')
-    def test_confirmed(self, cancel_mock):
-        deposit = DepositFactory(confirmed=True)
-        check_deposit_status(deposit.pk)
-        self.assertIs(cancel_mock.called, True)
 
-    @patch('transactions.deposits.cancel_current_task')
-    @patch('transactions.deposits.refund_deposit')
-    def test_timeout(self, refund_mock, cancel_mock):
-        deposit = DepositFactory(timeout=True)
-        check_deposit_status(deposit.pk)
-        self.assertIs(cancel_mock.called, True)
-        self.assertIs(refund_mock.called, False)
+class CheckDepositsTestCase(TestCase):
 
-    @patch('transactions.deposits.cancel_current_task')
-    @patch('transactions.deposits.refund_deposit')
+    @patch('transactions.deposits.run_task')
     @patch('transactions.deposits.logger')
-    def test_failed(self, logger_mock, refund_mock, cancel_mock):
+    def test_check(self, logger_mock, run_task_mock):
+        deposit_new = DepositFactory()
+        deposit_notified = DepositFactory(notified=True)
+        deposit_cancelled = DepositFactory(cancelled=True)
+        deposit_timeout = DepositFactory(timeout=True)
+        deposit_cancelled_timeout = DepositFactory(cancelled=True,
+                                                   timeout=True)
+        deposit_failed = DepositFactory(failed=True)
+        deposit_unconfirmed = DepositFactory(unconfirmed=True)
+        deposit_confirmed = DepositFactory(confirmed=True)
+        check_deposits()
+
+        for deposit in [deposit_new, deposit_notified, deposit_cancelled]:
+            deposit.refresh_from_db()
+            self.assertIsNone(deposit.time_closed)
+        for deposit in [deposit_timeout, deposit_cancelled_timeout,
+                        deposit_failed, deposit_unconfirmed,
+                        deposit_confirmed]:
+            deposit.refresh_from_db()
+            self.assertIsNotNone(deposit.time_closed)
+        self.assertEqual(run_task_mock.call_count, 2)
+        self.assertEqual(run_task_mock.call_args_list[0][0],
+                         (refund_closed_deposit, [deposit_cancelled_timeout.pk]))
+        self.assertEqual(run_task_mock.call_args_list[1][0],
+                         (refund_closed_deposit, [deposit_failed.pk]))
+        self.assertEqual(logger_mock.error.call_count, 1)
+        self.assertEqual(logger_mock.error.call_args[0][1],
+                         deposit_unconfirmed.pk)
+
+        # Closed deposits are not processed again
+        check_deposits()
+        self.assertEqual(run_task_mock.call_count, 2)
+        self.assertEqual(logger_mock.error.call_count, 1)
+
+    @patch('transactions.deposits.run_task')
+    @patch('transactions.deposits.STATUS_CHECK_BATCH_SIZE', 2)
+    def test_check_batches(self, run_task_mock):
+        DepositFactory.create_batch(5, failed=True)
+        check_deposits()
+        self.assertEqual(run_task_mock.call_count, 5)
+        self.assertFalse(Deposit.objects.filter(time_closed__isnull=True).exists())
+
+    @patch('transactions.deposits.run_task')
+    def test_check_refund_not_saved(self, run_task_mock):
+        run_task_mock.side_effect = ValueError
         deposit = DepositFactory(failed=True)
-        check_deposit_status(deposit.pk)
-        self.assertIs(cancel_mock.called, True)
-        self.assertIs(refund_mock.called, True)
-        self.assertIs(logger_mock.error.called, True)
+        with self.assertRaises(ValueError):
+            check_deposits()
+        # Deposit is not closed without refund task
+        deposit.refresh_from_db()
+        self.assertIsNone(deposit.time_closed)
+
+
+class RefundClosedDepositTestCase(TestCase):
 
-    @patch('transactions.deposits.cancel_current_task')
     @patch('transactions.deposits.refund_deposit')
     @patch('transactions.deposits.logger')
-    def test_unconfirmed(self, logger_mock, refund_mock, cancel_mock):
-        deposit = DepositFactory(unconfirmed=True)
-        self.assertEqual(deposit.status, 'unconfirmed')
-        check_deposit_status(deposit.pk)
-        self.assertIs(cancel_mock.called, True)
-        self.assertIs(refund_mock.called, False)
+    def test_failed(self, logger_mock, refund_mock):
+        deposit = DepositFactory(failed=True)
+        refund_closed_deposit(deposit.pk)
+        self.assertIs(refund_mock.called, True)
         self.assertIs(logger_mock.error.called, True)
 
-    @patch('transactions.deposits.cancel_current_task')
-    @patch('transactions.deposits.refund_deposit')
-    def test_cancelled(self, refund_mock, cancel_mock):
-        deposit = DepositFactory(cancelled=True)
-        check_deposit_status(deposit.pk)
-        self.assertIs(cancel_mock.called, False)
-        self.assertIs(refund_mock.called, False)
-
-    @patch('transactions.deposits.cancel_current_task')
     @patch('transactions.deposits.refund_deposit')
     @patch('transactions.deposits.logger')
-    def test_cancelled_timeout(self, logger_mock, refund_mock, cancel_mock):
+    def test_cancelled(self, logger_mock, refund_mock):
         deposit = DepositFactory(cancelled=True, timeout=True)
         refund_mock.side_effect = RefundError('Nothing to refund')
-        check_deposit_status(deposit.pk)
-        self.assertIs(cancel_mock.called, True)
+        refund_closed_deposit(deposit.pk)
         self.assertIs(refund_mock.called, True)
         self.assertIs(logger_mock.exception.called, False)
+        self.assertIs(logger_mock.error.called, False)
 
 
 class CheckDepositConfirmationTestCase(TestCase):
@@ -978,3 +1086,58 @@ class CheckDepositConfirmationTestCase(TestCase):
         self.assertEqual(bc_mock.is_tx_confirmed.call_count, 1)
         deposit.refresh_from_db()
         self.assertIsNone(deposit.time_confirmed)
+
+
+class GetMonitoringTasksTestCase(TestCase):
+
+    def _get_key(self, func_name, deposit):
+        return 'periodic:transactions.deposits.{0}:{1}'.format(
+            func_name, deposit.pk)
+
+    def test_new_block(self):
+        deposit_1 = DepositFactory()
+        deposit_2 = DepositFactory(received=True)
+        deposit_3 = DepositFactory(notified=True)
+        DepositFactory(confirmed=True)
+        DepositFactory(cancelled=True)
+        DepositFactory(account__currency__name='TBTC')
+        keys = get_monitoring_tasks('BTC')
+        self.assertEqual(sorted(keys), sorted([
+            self._get_key('wait_for_payment', deposit_1),
+            self._get_key('wait_for_confidence', deposit_2),
+            self._get_key('wait_for_confirmation', deposit_3),
+        ]))
+
+    @patch('transactions.deposits.BlockChain')
+    def test_wallet_transaction(self, bc_cls_mock):
+        deposit_1 = DepositFactory()
+        deposit_2 = DepositFactory(broadcasted=True)
+        DepositFactory()
+        DepositFactory(received=True)
+        bc_cls_mock.return_value = bc_mock = Mock(**{
+            'get_tx_outputs.return_value': [
+                {'amount': Decimal('0.1'),
+                 'address': deposit_1.deposit_address.address},
+            ],
+        })
+        keys = get_monitoring_tasks('BTC', deposit_2.incoming_tx_ids[0])
+        self.assertEqual(bc_cls_mock.call_args[0][0], 'BTC')
+        self.assertEqual(bc_mock.get_raw_transaction.call_args[0][0],
+                         deposit_2.incoming_tx_ids[0])
+        self.assertEqual(sorted(keys), sorted([
+            self._get_key('wait_for_payment', deposit_1),
+            self._get_key('wait_for_confirmation', deposit_2),
+        ]))
+
+    @patch('transactions.deposits.BlockChain')
+    def test_wallet_transaction_not_found(self, bc_cls_mock):
+        DepositFactory()
+        deposit = DepositFactory(received=True)
+        bc_cls_mock.return_value = Mock(**{
+            'get_raw_transaction.side_effect': JSONRPCError(
+                {'code': -5, 'message': 'No such mempool transaction'}),
+        })
+        keys = get_monitoring_tasks('BTC', deposit.incoming_tx_ids[0])
+        self.assertEqual(keys, [
+            self._get_key('wait_for_confidence', deposit),
+        ])
@@ -178,6 +178,41 @@ class DepositTestCase(TestCase):
             time_cancelled=timezone.now())
         self.assertEqual(deposit.status, 'cancelled')
 
+    def test_status_sql(self):
+        deposits = [
+            DepositFactory(),
+            DepositFactory(amount=Decimal('10.00'),
+                           exchange_rate=Decimal('2000.00'),
+                           paid_coin_amount=Decimal('0.001')),
+            DepositFactory(amount=Decimal('10.00'),
+                           exchange_rate=Decimal('2000.00'),
+                           paid_coin_amount=Decimal('0.01')),
+            DepositFactory(received=True),
+            DepositFactory(broadcasted=True),
+            DepositFactory(notified=True),
+            DepositFactory(confirmed=True),
+            DepositFactory(timeout=True),
+            DepositFactory(failed=True),
+            DepositFactory(refunded=True),
+            DepositFactory(unconfirmed=True),
+            DepositFactory(cancelled=True),
+            DepositFactory(cancelled=True, notified=True),
+        ]
+        annotated = {deposit.pk: deposit.db_status for deposit
+                     in Deposit.objects.with_status()}
+        statuses = set()
+        for deposit in deposits:
+            self.assertEqual(annotated[deposit.pk], deposit.status)
+            self.assertEqual(
+                list(Deposit.objects.
+                     filter_status(deposit.status).
+                     filter(pk=deposit.pk)),
+                [deposit])
+            statuses.add(deposit.status)
+        self.assertEqual(len(statuses), 10)
+        self.assertEqual(
+            Deposit.objects.filter_status('new', 'underpaid').count(), 3)
+
     def test_receipt_url(self):
         deposit = DepositFactory(notified=True)
         self.assertIn('/prc/{0}'.format(deposit.uid), deposit.receipt_url)
@@ -349,6 +384,32 @@ class WithdrawalTestCase(TestCase):
         withdrawal.time_confirmed = timezone.now()
         self.assertEqual(withdrawal.status, 'confirmed')
 
+    def test_status_sql(self):
+        withdrawals = [
+            WithdrawalFactory(),
+            WithdrawalFactory(sent=True),
+            WithdrawalFactory(broadcasted=True),
+            WithdrawalFactory(notified=True),
+            WithdrawalFactory(confirmed=True),
+            WithdrawalFactory(timeout=True),
+            WithdrawalFactory(failed=True),
+            WithdrawalFactory(unconfirmed=True),
+            WithdrawalFactory(cancelled=True),
+            WithdrawalFactory(cancelled=True, notified=True),
+        ]
+        annotated = {withdrawal.pk: withdrawal.db_status for withdrawal
+                     in Withdrawal.objects.with_status()}
+        statuses = set()
+        for withdrawal in withdrawals:
+            self.assertEqual(annotated[withdrawal.pk], withdrawal.status)
+            self.assertEqual(
+                list(Withdrawal.objects.
+                     filter_status(withdrawal.status).
+                     filter(pk=withdrawal.pk)),
+                [withdrawal])
+            statuses.add(withdrawal.status)
+        self.assertEqual(len(statuses), 9)
+
     def test_status_timeout(self):
         withdrawal = WithdrawalFactory(
             time_created=timezone.now() - datetime.timedelta(minutes=60))
@@ -373,6 +434,14 @@ class WithdrawalTestCase(TestCase):
             time_cancelled=timezone.now())
         self.assertEqual(withdrawal.status, 'cancelled')
 
+    def test_wallet_shard(self):
+        withdrawal = WithdrawalFactory(sent=True)
+        self.assertIsNone(withdrawal.wallet_shard)
+        NegativeBalanceChangeFactory(
+            withdrawal=withdrawal,
+            address__wallet_shard='xbt-btc-20171020000000')
+        self.assertEqual(withdrawal.wallet_shard, 'xbt-btc-20171020000000')
+
 
 class BalanceChangeTestCase(TestCase):
 
@@ -0,0 +1,59 @@
+import datetime
+import time
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.utils import timezone
+from mock import patch
+
+from transactions.tests.factories import DepositFactory, WithdrawalFactory
+from transactions.utils import status_cache
+
+
+class StatusCacheTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_make_entry(self):
+        deposit = DepositFactory(
+            time_created=timezone.now() - datetime.timedelta(minutes=20))
+        version = status_cache.get_version('deposit', deposit.uid)
+        entry = status_cache.make_entry(deposit, version, {'status': 'new'})
+        # DEPOSIT_TIMEOUT passed, next is DEPOSIT_CONFIDENCE_TIMEOUT
+        self.assertEqual(entry['etag'], '"{0}-1"'.format(version))
+        self.assertAlmostEqual(entry['expires_at'],
+                               time.time() + 600, delta=5)
+
+    def test_cache_status(self):
+        withdrawal = WithdrawalFactory()
+        version = status_cache.get_version('withdrawal', withdrawal.uid)
+        self.assertEqual(
+            status_cache.get_version('withdrawal', withdrawal.uid), version)
+        self.assertIsNone(status_cache.get_cached_status(
+            'withdrawal', withdrawal.uid, version))
+        entry = status_cache.make_entry(
+            withdrawal, version, {'status': 'new'})
+        status_cache.cache_status(withdrawal, version, entry)
+        self.assertEqual(
+            status_cache.get_cached_status(
+                'withdrawal', withdrawal.uid, version)['data'],
+            {'status': 'new'})
+        # Expired
+        with patch('transactions.utils.status_cache.time.time',
+                   return_value=entry['expires_at']):
+            self.assertIsNone(status_cache.get_cached_status(
+                'withdrawal', withdrawal.uid, version))
+
+    @patch('transactions.utils.status_events.get_connection')
+    @patch('transactions.utils.status_cache.transaction.on_commit',
+           side_effect=lambda func: func())
+    def test_bump_version(self, on_commit_mock, connection_mock):
+        deposit = DepositFactory()
+        version = status_cache.get_version('deposit', deposit.uid)
+        deposit.save()
+        self.assertEqual(status_cache.get_version('deposit', deposit.uid),
+                         version + 1)
+        self.assertEqual(
+            connection_mock.return_value.publish.call_args[0],
+            ('xbt:status:deposit:{0}'.format(deposit.uid), deposit.uid))
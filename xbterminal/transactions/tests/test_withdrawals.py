@@ -11,8 +11,9 @@ from transactions.withdrawals import (
     send_transaction,
     wait_for_confidence,
     wait_for_confirmation,
-    check_withdrawal_status,
-    check_withdrawal_confirmation)
+    check_withdrawals,
+    check_withdrawal_confirmation,
+    get_monitoring_tasks)
 from transactions.tests.factories import (
     WithdrawalFactory,
     BalanceChangeFactory,
@@ -45,9 +46,6 @@ class PrepareWithdrawalTestCase(TestCase):
                          withdrawal.coin.name)
         self.assertEqual(bc_mock.get_tx_fee.call_count, 1)
         self.assertEqual(bc_mock.import_address.call_count, 1)
-        self.assertEqual(run_task_mock.call_args[0][0].__name__,
-                         'check_withdrawal_status')
-        self.assertEqual(run_task_mock.call_args[0][1], [withdrawal.pk])
 
         self.assertEqual(withdrawal.account, device.account)
         self.assertEqual(withdrawal.device, device)
@@ -508,63 +506,45 @@ class WaitForConfirmationTestCase(TestCase):
         self.assertIs(cancel_mock.called, False)
 
 
-class CheckWithdrawalStatusTestCase(TestCase):
+class CheckWithdrawalsTestCase(TestCase):
 
-    @patch('transactions.withdrawals.cancel_current_task')
-    def test_new(self, cancel_mock):
-        withdrawal = WithdrawalFactory()
-        NegativeBalanceChangeFactory(withdrawal=withdrawal)
-        check_withdrawal_status(withdrawal.pk)
-        self.assertEqual(withdrawal.balancechange_set.count(), 1)
-        self.assertIs(cancel_mock.called, False)
-
-    @patch('transactions.withdrawals.cancel_current_task')
     @patch('transactions.withdrawals.logger')
-    def test_timeout(self, logger_mock, cancel_mock):
-        withdrawal = WithdrawalFactory(timeout=True)
-        NegativeBalanceChangeFactory(withdrawal=withdrawal)
-        check_withdrawal_status(withdrawal.pk)
-        self.assertEqual(withdrawal.balancechange_set.count(), 0)
-        self.assertIs(logger_mock.error.called, False)
-        self.assertIs(cancel_mock.called, True)
-
-    @patch('transactions.withdrawals.cancel_current_task')
-    @patch('transactions.withdrawals.logger')
-    def test_failed(self, logger_mock, cancel_mock):
-        withdrawal = WithdrawalFactory(failed=True)
-        NegativeBalanceChangeFactory(withdrawal=withdrawal)
-        check_withdrawal_status(withdrawal.pk)
-        self.assertEqual(withdrawal.balancechange_set.count(), 1)
-        self.assertIs(logger_mock.error.called, True)
-        self.assertIs(cancel_mock.called, True)
-
-    @patch('transactions.withdrawals.cancel_current_task')
-    @patch('transactions.withdrawals.logger')
-    def test_unconfirmed(self, logger_mock, cancel_mock):
-        withdrawal = WithdrawalFactory(unconfirmed=True)
-        NegativeBalanceChangeFactory(withdrawal=withdrawal)
-        check_withdrawal_status(withdrawal.pk)
-        self.assertEqual(withdrawal.balancechange_set.count(), 1)
-        self.assertIs(logger_mock.error.called, True)
-        self.assertIs(cancel_mock.called, True)
-
-    @patch('transactions.withdrawals.cancel_current_task')
-    @patch('transactions.withdrawals.logger')
-    def test_cancelled(self, logger_mock, cancel_mock):
-        withdrawal = WithdrawalFactory(cancelled=True)
-        NegativeBalanceChangeFactory(withdrawal=withdrawal)
-        check_withdrawal_status(withdrawal.pk)
-        self.assertEqual(withdrawal.balancechange_set.count(), 0)
-        self.assertIs(logger_mock.error.called, False)
-        self.assertIs(cancel_mock.called, True)
-
-    @patch('transactions.withdrawals.cancel_current_task')
-    def test_confirmed(self, cancel_mock):
-        withdrawal = WithdrawalFactory(confirmed=True)
-        NegativeBalanceChangeFactory(withdrawal=withdrawal)
-        check_withdrawal_status(withdrawal.pk)
-        self.assertEqual(withdrawal.balancechange_set.count(), 1)
-        self.assertIs(cancel_mock.called, True)
+    def test_check(self, logger_mock):
+        withdrawal_new = WithdrawalFactory()
+        withdrawal_timeout = WithdrawalFactory(timeout=True)
+        withdrawal_cancelled = WithdrawalFactory(cancelled=True)
+        withdrawal_failed = WithdrawalFactory(failed=True)
+        withdrawal_unconfirmed = WithdrawalFactory(unconfirmed=True)
+        withdrawal_confirmed = WithdrawalFactory(confirmed=True)
+        withdrawals = [
+            withdrawal_new,
+            withdrawal_timeout,
+            withdrawal_cancelled,
+            withdrawal_failed,
+            withdrawal_unconfirmed,
+            withdrawal_confirmed,
+        ]
+        for withdrawal in withdrawals:
+            NegativeBalanceChangeFactory(withdrawal=withdrawal)
+        check_withdrawals()
+
+        withdrawal_new.refresh_from_db()
+        self.assertIsNone(withdrawal_new.time_closed)
+        self.assertEqual(withdrawal_new.balancechange_set.count(), 1)
+        for withdrawal in withdrawals[1:]:
+            withdrawal.refresh_from_db()
+            self.assertIsNotNone(withdrawal.time_closed)
+        # Reserved addresses are unlocked
+        self.assertEqual(withdrawal_timeout.balancechange_set.count(), 0)
+        self.assertEqual(withdrawal_cancelled.balancechange_set.count(), 0)
+        self.assertEqual(withdrawal_failed.balancechange_set.count(), 1)
+        self.assertEqual(withdrawal_unconfirmed.balancechange_set.count(), 1)
+        self.assertEqual(withdrawal_confirmed.balancechange_set.count(), 1)
+        self.assertEqual(logger_mock.error.call_count, 2)
+
+        # Closed withdrawals are not processed again
+        check_withdrawals()
+        self.assertEqual(logger_mock.error.call_count, 2)
 
 
 class CheckWithdrawalConfirmationTestCase(TestCase):
@@ -599,3 +579,33 @@ class CheckWithdrawalConfirmationTestCase(TestCase):
         self.assertEqual(bc_mock.is_tx_confirmed.call_count, 1)
         withdrawal.refresh_from_db()
         self.assertIsNone(withdrawal.time_confirmed)
+
+
+class GetMonitoringTasksTestCase(TestCase):
+
+    def _get_key(self, func_name, withdrawal):
+        return 'periodic:transactions.withdrawals.{0}:{1}'.format(
+            func_name, withdrawal.pk)
+
+    def test_new_block(self):
+        WithdrawalFactory()
+        withdrawal_1 = WithdrawalFactory(sent=True)
+        withdrawal_2 = WithdrawalFactory(notified=True)
+        WithdrawalFactory(confirmed=True)
+        WithdrawalFactory(
+            sent=True,
+            customer_address='mxdkEanNu9KAe1Sz5oBBRo1NBozpGR3mRY',
+            account__currency__name='TBTC')
+        keys = get_monitoring_tasks('BTC')
+        self.assertEqual(sorted(keys), sorted([
+            self._get_key('wait_for_confidence', withdrawal_1),
+            self._get_key('wait_for_confirmation', withdrawal_2),
+        ]))
+
+    def test_wallet_transaction(self):
+        withdrawal = WithdrawalFactory(broadcasted=True)
+        WithdrawalFactory(sent=True)
+        keys = get_monitoring_tasks('BTC', withdrawal.outgoing_tx_id)
+        self.assertEqual(keys, [
+            self._get_key('wait_for_confirmation', withdrawal),
+        ])
@@ -0,0 +1,92 @@
+"""
+Serialized deposit and withdrawal statuses are cached by version,
+version is bumped after each save. Status also depends on time,
+so cached representation expires at the next status timeout
+"""
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+VERSION_CACHE_KEY_TEMPLATE = 'status-version-{model_name}-{uid}'
+STATUS_CACHE_KEY_TEMPLATE = 'status-{model_name}-{uid}-{version}'
+STATUS_CACHE_TIMEOUT = 3600  # seconds
+
+
+def _get_version_key(model_name, uid):
+    return VERSION_CACHE_KEY_TEMPLATE.format(model_name=model_name, uid=uid)
+
+
+def bump_version(obj):
+    """
+    Invalidate cached status after commit
+    Accepts:
+        obj: Deposit or Withdrawal instance
+    """
+    key = _get_version_key(obj._meta.model_name, obj.uid)
+
+    def _bump():
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Not cached
+            pass
+    transaction.on_commit(_bump)
+
+
+def get_version(model_name, uid):
+    """
+    Should be called before loading object from DB
+    """
+    key = _get_version_key(model_name, uid)
+    version = cache.get(key)
+    if version is None:
+        # Never reuses values of evicted counters
+        cache.add(key, int(time.time() * 1000), timeout=STATUS_CACHE_TIMEOUT)
+        version = cache.get(key)
+    return version
+
+
+def get_cached_status(model_name, uid, version):
+    """
+    Returns:
+        dict with 'etag' and 'data' keys or None
+    """
+    entry = cache.get(STATUS_CACHE_KEY_TEMPLATE.format(
+        model_name=model_name, uid=uid, version=version))
+    if entry is None or entry['expires_at'] <= time.time():
+        return None
+    return entry
+
+
+def make_entry(obj, version, data):
+    """
+    Accepts:
+        obj: Deposit or Withdrawal instance
+        version: version obtained before loading object
+        data: serialized object
+    Returns:
+        dict with 'etag' and 'data' keys
+    """
+    now = timezone.now()
+    deadlines = sorted(obj.time_created + timeout
+                       for timeout in obj.STATUS_TIMEOUTS)
+    passed = [deadline for deadline in deadlines if deadline <= now]
+    upcoming = [deadline for deadline in deadlines if deadline > now]
+    timeout = STATUS_CACHE_TIMEOUT
+    if upcoming:
+        timeout = min(timeout, (upcoming[0] - now).total_seconds())
+    return {
+        # Number of passed deadlines changes status without save
+        'etag': '"{0}-{1}"'.format(version, len(passed)),
+        'expires_at': time.time() + timeout,
+        'data': data,
+    }
+
+
+def cache_status(obj, version, entry):
+    cache.set(STATUS_CACHE_KEY_TEMPLATE.format(
+        model_name=obj._meta.model_name, uid=obj.uid, version=version),
+        entry,
+        timeout=int(entry['expires_at'] - time.time()) + 1)
@@ -0,0 +1,76 @@
+"""
+Deposit and withdrawal changes are published to Redis channels,
+clients waiting for status change are subscribed to them
+"""
+import logging
+import time
+
+from django.db import transaction
+import django_rq
+from redis import RedisError
+
+CHANNEL_TEMPLATE = 'xbt:status:{model_name}:{uid}'
+EVENTS_QUEUE = 'high'  # Determines Redis connection
+
+logger = logging.getLogger(__name__)
+
+
+def get_connection():
+    return django_rq.get_connection(EVENTS_QUEUE, use_strict_redis=True)
+
+
+def _get_channel(model_name, uid):
+    return CHANNEL_TEMPLATE.format(model_name=model_name, uid=uid)
+
+
+def publish_change(obj):
+    """
+    Notify subscribers after commit
+    Accepts:
+        obj: Deposit or Withdrawal instance
+    """
+    channel = _get_channel(obj._meta.model_name, obj.uid)
+
+    def _publish():
+        try:
+            get_connection().publish(channel, obj.uid)
+        except RedisError as error:
+            # Subscribers will get new status on timeout
+            logger.warning(error)
+    transaction.on_commit(_publish)
+
+
+class Subscription(object):
+    """
+    Should be created before reading status from DB,
+    otherwise changes can be missed
+    """
+
+    def __init__(self, model_name, uid):
+        self._pubsub = get_connection().pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(_get_channel(model_name, uid))
+
+    def wait(self, timeout):
+        """
+        Accepts:
+            timeout: seconds
+        Returns:
+            True if change has been published, False on timeout
+        """
+        deadline = time.time() + timeout
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            # Subscribe confirmations are returned as None
+            if self._pubsub.get_message(timeout=remaining) is not None:
+                return True
+
+    def close(self):
+        self._pubsub.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -9,12 +9,18 @@ from constance import config
 
 from api.utils.urls import get_admin_url
 from common.db import lock_table
-from common.rq_helpers import run_periodic_task, cancel_current_task
+from common.rq_helpers import (
+    get_task_key,
+    run_periodic_task,
+    cancel_current_task,
+    get_poll_interval,
+    reschedule_current_task)
 from transactions.constants import (
     COIN_DEC_PLACES,
     COIN_MIN_OUTPUT,
     WITHDRAWAL_CONFIDENCE_TIMEOUT,
-    WITHDRAWAL_CONFIRMATION_TIMEOUT)
+    WITHDRAWAL_CONFIRMATION_TIMEOUT,
+    STATUS_CHECK_BATCH_SIZE)
 from transactions.exceptions import TransactionError, TransactionModified
 from transactions.models import Withdrawal, BalanceChange
 from transactions.utils.compat import (
@@ -96,7 +102,9 @@ def prepare_withdrawal(device_or_account, amount):
             withdrawal.customer_coin_amount += change_coin_amount
         else:
             change_address = Address.create(withdrawal.coin.name, is_change=True)
-            bc.import_address(change_address.address, rescan=False)
+            change_bc = BlockChain(withdrawal.coin.name,
+                                   wallet=change_address.wallet_shard)
+            change_bc.import_address(change_address.address, rescan=False)
             balance_changes.append((change_address, change_coin_amount))
         # Save withdrawal object and balance changes
         withdrawal.save()
@@ -107,7 +115,6 @@ def prepare_withdrawal(device_or_account, amount):
                 address=address,
                 amount=amount)
             for address, amount in balance_changes])  # noqa: F812
-    run_periodic_task(check_withdrawal_status, [withdrawal.pk], interval=60)
     return withdrawal
 
 
@@ -132,7 +139,9 @@ def send_transaction(withdrawal, customer_address):
         if bch.amount < 0:
             # From wallet to customer
             private_key = bch.address.get_private_key()
-            unspent_outputs = bc.get_raw_unspent_outputs(
+            address_bc = BlockChain(withdrawal.coin.name,
+                                    wallet=bch.address.wallet_shard)
+            unspent_outputs = address_bc.get_raw_unspent_outputs(
                 bch.address.address,
                 minconf=config.TX_REQUIRED_CONFIRMATIONS)
             if sum(output['amount'] for output in unspent_outputs) != abs(bch.amount):
@@ -147,7 +156,8 @@ def send_transaction(withdrawal, customer_address):
     withdrawal.outgoing_tx_id = bc.send_raw_transaction(outgoing_tx)
     withdrawal.time_sent = timezone.now()
     withdrawal.save()
-    run_periodic_task(wait_for_confidence, [withdrawal.pk], interval=5)
+    run_periodic_task(wait_for_confidence, [withdrawal.pk],
+                      interval=config.POLL_CONFIDENCE_INTERVAL_MIN)
     logger.info('withdrawal sent (%s)', withdrawal.pk)
 
 
@@ -165,7 +175,13 @@ def wait_for_confidence(withdrawal_id):
         # Confidence threshold reached, cancel job
         cancel_current_task()
         return
-    bc = BlockChain(withdrawal.coin.name)
+    reschedule_current_task(get_poll_interval(
+        withdrawal.time_sent,
+        config.POLL_CONFIDENCE_INTERVAL_MIN,
+        config.POLL_CONFIDENCE_INTERVAL_MAX,
+        event_name=withdrawal.coin.name))
+    bc = BlockChain(withdrawal.coin.name,
+                    wallet=withdrawal.wallet_shard)
     try:
         tx_confirmed = bc.is_tx_confirmed(withdrawal.outgoing_tx_id, minconf=1)
     except TransactionModified as error:
@@ -186,7 +202,7 @@ def wait_for_confidence(withdrawal_id):
             withdrawal.time_broadcasted = timezone.now()
             withdrawal.save()
             run_periodic_task(wait_for_confirmation, [withdrawal.pk],
-                              interval=15)
+                              interval=config.POLL_CONFIRMATION_INTERVAL_MIN)
             logger.info('withdrawal confidence reached (%s)', withdrawal.pk)
 
 
@@ -200,7 +216,13 @@ def wait_for_confirmation(withdrawal_id):
     if withdrawal.time_created + WITHDRAWAL_CONFIRMATION_TIMEOUT < timezone.now():
         # Timeout, cancel job
         cancel_current_task()
-    bc = BlockChain(withdrawal.coin.name)
+    reschedule_current_task(get_poll_interval(
+        withdrawal.time_broadcasted,
+        config.POLL_CONFIRMATION_INTERVAL_MIN,
+        config.POLL_CONFIRMATION_INTERVAL_MAX,
+        event_name=withdrawal.coin.name))
+    bc = BlockChain(withdrawal.coin.name,
+                    wallet=withdrawal.wallet_shard)
     try:
         tx_confirmed = bc.is_tx_confirmed(withdrawal.outgoing_tx_id)
     except TransactionModified as error:
@@ -220,28 +242,63 @@ def wait_for_confirmation(withdrawal_id):
             logger.info('withdrawal confirmed (%s)', withdrawal.pk)
 
 
-def check_withdrawal_status(withdrawal_id):
+def get_monitoring_tasks(coin_name, tx_id=None):
     """
-    Periodic task for monitoring withdrawal status
+    Find periodic tasks which should react to blockchain event
     Accepts:
-        withdrawal_id: withdrawal ID, integer
+        coin_name: currency name
+        tx_id: wallet transaction ID (walletnotify),
+            None if new block has been found (blocknotify)
+    Returns:
+        list of task keys
     """
-    withdrawal = Withdrawal.objects.get(pk=withdrawal_id)
-    if withdrawal.status in ['timeout', 'cancelled']:
-        # Unlock reserved addresses
-        withdrawal.balancechange_set.all().delete()
-        cancel_current_task()
-    elif withdrawal.status in ['failed', 'unconfirmed']:
-        logger.error(
-            'withdrawal failed (%s)',
-            withdrawal.pk,
-            extra={'data': {
-                'withdrawal_admin_url': get_admin_url(withdrawal),
-            }})
-        cancel_current_task()
-    elif withdrawal.status == 'confirmed':
-        # Success
-        cancel_current_task()
+    tasks = {
+        'sent': wait_for_confidence,
+        'broadcasted': wait_for_confirmation,
+        'notified': wait_for_confirmation,
+    }
+    queryset = Withdrawal.objects.with_status().\
+        filter(coin__name=coin_name, db_status__in=list(tasks))
+    if tx_id is not None:
+        queryset = queryset.filter(outgoing_tx_id=tx_id)
+    return [get_task_key(tasks[status], [withdrawal_id])
+            for withdrawal_id, status
+            in queryset.values_list('pk', 'db_status')]
+
+
+def check_withdrawals():
+    """
+    Periodic task for monitoring status of all withdrawals,
+    finds withdrawals in final state and closes them in batches
+    """
+    now = timezone.now()
+    final_states = ['timeout', 'cancelled', 'failed', 'unconfirmed', 'confirmed']
+    for status in final_states:
+        while True:
+            with atomic():
+                batch = list(Withdrawal.objects.
+                             filter_status(status).
+                             filter(time_closed__isnull=True).
+                             select_for_update()[:STATUS_CHECK_BATCH_SIZE])
+                if not batch:
+                    break
+                withdrawal_ids = [withdrawal.pk for withdrawal in batch]
+                Withdrawal.objects.\
+                    filter(pk__in=withdrawal_ids).\
+                    update(time_closed=now)
+                if status in ['timeout', 'cancelled']:
+                    # Unlock reserved addresses
+                    BalanceChange.objects.\
+                        filter(withdrawal__in=withdrawal_ids).\
+                        delete()
+            if status in ['failed', 'unconfirmed']:
+                for withdrawal in batch:
+                    logger.error(
+                        'withdrawal failed (%s)',
+                        withdrawal.pk,
+                        extra={'data': {
+                            'withdrawal_admin_url': get_admin_url(withdrawal),
+                        }})
 
 
 def check_withdrawal_confirmation(withdrawal):
@@ -253,7 +310,8 @@ def check_withdrawal_confirmation(withdrawal):
     """
     if withdrawal.time_confirmed is not None:
         return True
-    bc = BlockChain(withdrawal.coin.name)
+    bc = BlockChain(withdrawal.coin.name,
+                    wallet=withdrawal.wallet_shard)
     if bc.is_tx_confirmed(withdrawal.outgoing_tx_id):
         withdrawal.time_confirmed = timezone.now()
         withdrawal.save()
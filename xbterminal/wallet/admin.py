@@ -62,6 +62,7 @@ class AddressAdmin(admin.ModelAdmin):
         'is_change',
         'index',
         'address',
+        'wallet_shard',
     ]
     list_filter = ['wallet_account__parent_key__coin_type']
     ordering = ['-id']
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-19 12:29
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallet', '0004_schema_wallet_key_dash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='address',
+            name='wallet_shard',
+            field=models.CharField(db_index=True, help_text='Name of bitcoind wallet where address is imported.', max_length=50, null=True),
+        ),
+    ]
@@ -8,6 +8,7 @@ from django.db.transaction import atomic
 from common.db import lock_table
 from wallet.constants import BIP44_PURPOSE, BIP44_COIN_TYPES, MAX_INDEX
 from wallet.utils.keys import derive_key, generate_p2pkh_script
+from wallet.utils.shards import get_wallet_shard
 
 
 class WalletKey(models.Model):
@@ -76,6 +77,11 @@ class Address(models.Model):
     address = models.CharField(
         max_length=50,
         unique=True)
+    wallet_shard = models.CharField(
+        max_length=50,
+        null=True,
+        db_index=True,
+        help_text='Name of bitcoind wallet where address is imported.')
 
     class Meta:
         ordering = ['wallet_account', 'is_change', 'index']
@@ -119,17 +125,16 @@ class Address(models.Model):
                 aggregate(Max('index'))['index__max']
             self.index = max_index + 1 if max_index is not None else 0
             self.address = self.get_script(as_address=True)
+            if self.wallet_shard is None:
+                coin_name = BIP44_COIN_TYPES.for_value(
+                    self.wallet_account.parent_key.coin_type).constant
+                self.wallet_shard = get_wallet_shard(coin_name)
         super(Address, self).save(*args, **kwargs)
 
-    @classmethod
-    @atomic
-    def create(cls, coin_name, is_change=False):
+    @staticmethod
+    def _get_wallet_account(coin_name, is_change, count):
         """
-        Accepts:
-            coin_name: coin name (currency name)
-            is_change: boolean
-        Returns:
-            address: Address instance
+        Find account which has enough free indexes, create new if needed
         """
         coin_type = BIP44_COIN_TYPES.for_constant(coin_name).value
         try:
@@ -137,11 +142,58 @@ class Address(models.Model):
         except WalletKey.DoesNotExist:
             raise ImproperlyConfigured
         try:
-            account = wallet_key.walletaccount_set.\
+            return wallet_key.walletaccount_set.\
                 filter(address__is_change=is_change).\
                 annotate(address_max_index=Max('address__index')).\
-                exclude(address_max_index__gte=MAX_INDEX).\
+                exclude(address_max_index__gt=MAX_INDEX - count).\
                 latest('index')
         except WalletAccount.DoesNotExist:
-            account = wallet_key.walletaccount_set.create()
+            return wallet_key.walletaccount_set.create()
+
+    @classmethod
+    @atomic
+    def create(cls, coin_name, is_change=False):
+        """
+        Accepts:
+            coin_name: coin name (currency name)
+            is_change: boolean
+        Returns:
+            address: Address instance
+        """
+        account = cls._get_wallet_account(coin_name, is_change, 1)
         return account.address_set.create(is_change=is_change)
+
+    @classmethod
+    @atomic
+    def create_many(cls, coin_name, count, is_change=False):
+        """
+        Derive several addresses and save them with single INSERT
+        Accepts:
+            coin_name: coin name (currency name)
+            count: number of addresses
+            is_change: boolean
+        Returns:
+            list of Address instances
+        """
+        account = cls._get_wallet_account(coin_name, is_change, count)
+        # Ensure that there is no race condition
+        # when indexes are determined
+        lock_table('wallet.Address')
+        max_index = account.address_set.\
+            filter(is_change=is_change).\
+            aggregate(Max('index'))['index__max']
+        first_index = max_index + 1 if max_index is not None else 0
+        wallet_shard = get_wallet_shard(coin_name)
+        addresses = []
+        for index in range(first_index, first_index + count):
+            address = cls(wallet_account=account,
+                          is_change=is_change,
+                          index=index,
+                          wallet_shard=wallet_shard)
+            address.address = address.get_script(as_address=True)
+            addresses.append(address)
+        cls.objects.bulk_create(addresses)
+        # Primary keys are not set by bulk_create
+        return list(account.address_set.
+                    filter(is_change=is_change, index__gte=first_index).
+                    order_by('index'))
@@ -152,6 +152,32 @@ class AddressTestCase(TestCase):
                             address_1.wallet_account)
         self.assertEqual(wallet_key.walletaccount_set.count(), 2)
 
+    def test_create_many_method(self):
+        wallet_key = WalletKeyFactory(coin_type=BIP44_COIN_TYPES.BTC)
+        address_1 = Address.create('BTC')
+        with self.assertNumQueries(8):
+            addresses = Address.create_many('BTC', 3)
+        self.assertEqual([address.index for address in addresses],
+                         [1, 2, 3])
+        for address in addresses:
+            self.assertIsNotNone(address.pk)
+            self.assertEqual(address.wallet_account,
+                             address_1.wallet_account)
+            self.assertIs(address.is_change, False)
+            self.assertEqual(address.get_private_key().address(),
+                             address.address)
+        self.assertEqual(wallet_key.walletaccount_set.count(), 1)
+
+    def test_create_many_method_max_index(self):
+        wallet_key = WalletKeyFactory(coin_type=BIP44_COIN_TYPES.BTC)
+        account = WalletAccountFactory(parent_key=wallet_key)
+        address_1 = AddressFactory(wallet_account=account)
+        address_1.index = MAX_INDEX - 1
+        address_1.save()
+        addresses = Address.create_many('BTC', 2)
+        self.assertNotEqual(addresses[0].wallet_account, account)
+        self.assertEqual(addresses[0].index, 0)
+
     def test_get_private_key(self):
         address = AddressFactory()
         private_key = address.get_private_key()
@@ -0,0 +1,72 @@
+import datetime
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from wallet.models import Address
+from wallet.tests.factories import AddressFactory, WalletKeyFactory
+from wallet.utils.shards import get_shard_opening_time, get_wallet_shard
+
+BLOCKCHAINS_SHARDED = {
+    'BTC': {
+        'HOST': 'localhost',
+        'PORT': 8332,
+        'USER': 'test',
+        'PASSWORD': 'test',
+        'WALLET_SHARDS': {
+            'PREFIX': 'xbt-btc',
+            'MAX_SIZE': 2,
+            'MAX_AGE': datetime.timedelta(days=1),
+        },
+    },
+}
+
+
+class ShardUtilsTestCase(TestCase):
+
+    def test_get_shard_opening_time(self):
+        opened_at = get_shard_opening_time('xbt-btc-20171020123000')
+        self.assertEqual(
+            opened_at,
+            datetime.datetime(2017, 10, 20, 12, 30, tzinfo=timezone.utc))
+
+    def test_get_wallet_shard_disabled(self):
+        self.assertIsNone(get_wallet_shard('BTC'))
+        address = AddressFactory()
+        self.assertIsNone(address.wallet_shard)
+
+    @override_settings(BLOCKCHAINS=BLOCKCHAINS_SHARDED)
+    def test_get_wallet_shard_new(self):
+        shard = get_wallet_shard('BTC')
+        self.assertIs(shard.startswith('xbt-btc-'), True)
+        self.assertLess(
+            timezone.now() - get_shard_opening_time(shard),
+            datetime.timedelta(minutes=1))
+
+    @override_settings(BLOCKCHAINS=BLOCKCHAINS_SHARDED)
+    def test_get_wallet_shard_size(self):
+        address_1 = AddressFactory(wallet_shard='xbt-btc-20171020000000')
+        opened_at = timezone.now().strftime('%Y%m%d%H%M%S')
+        address_2 = AddressFactory(
+            wallet_account=address_1.wallet_account,
+            wallet_shard='xbt-btc-' + opened_at)
+        self.assertEqual(get_wallet_shard('BTC'), address_2.wallet_shard)
+        AddressFactory(
+            wallet_account=address_1.wallet_account,
+            wallet_shard=address_2.wallet_shard)
+        # Full
+        self.assertNotEqual(get_wallet_shard('BTC'), address_2.wallet_shard)
+
+    @override_settings(BLOCKCHAINS=BLOCKCHAINS_SHARDED)
+    def test_get_wallet_shard_age(self):
+        AddressFactory(wallet_shard='xbt-btc-20171020000000')
+        shard = get_wallet_shard('BTC')
+        self.assertNotEqual(shard, 'xbt-btc-20171020000000')
+
+    @override_settings(BLOCKCHAINS=BLOCKCHAINS_SHARDED)
+    def test_address_create(self):
+        WalletKeyFactory()
+        address_1 = Address.create('BTC')
+        self.assertIs(address_1.wallet_shard.startswith('xbt-btc-'), True)
+        address_2 = Address.create('BTC', is_change=True)
+        self.assertEqual(address_2.wallet_shard, address_1.wallet_shard)
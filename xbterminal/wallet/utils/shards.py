@@ -0,0 +1,62 @@
+import datetime
+
+from django.apps import apps
+from django.db.models import Max
+from django.utils import timezone
+
+from transactions.services.bitcoind import get_blockchain_config
+
+SHARD_TIME_FORMAT = '%Y%m%d%H%M%S'
+
+
+def get_shard_opening_time(shard_name):
+    """
+    Accepts:
+        shard_name: wallet shard name, '<prefix>-<time>'
+    Returns:
+        datetime
+    """
+    time_str = shard_name.rsplit('-', 1)[1]
+    return timezone.make_aware(
+        datetime.datetime.strptime(time_str, SHARD_TIME_FORMAT),
+        timezone.utc)
+
+
+def get_wallet_shard(coin_name):
+    """
+    Determine bitcoind wallet for the new address.
+    New shard is started when current shard reaches
+    MAX_SIZE addresses or becomes older than MAX_AGE
+    Accepts:
+        coin_name: coin name (currency name)
+    Returns:
+        shard name or None if wallet sharding is not enabled
+    """
+    shards_config = get_blockchain_config(coin_name).get('WALLET_SHARDS')
+    if not shards_config:
+        return None
+    Address = apps.get_model('wallet', 'Address')
+    prefix = shards_config['PREFIX']
+    now = timezone.now()
+    current_shard = Address.objects.\
+        filter(wallet_shard__startswith=prefix + '-').\
+        aggregate(Max('wallet_shard'))['wallet_shard__max']
+    opened_at = now
+    if current_shard is not None:
+        max_size = shards_config.get('MAX_SIZE')
+        max_age = shards_config.get('MAX_AGE')
+        is_full = (
+            max_size is not None and
+            Address.objects.filter(wallet_shard=current_shard).count() >= max_size)
+        is_expired = (
+            max_age is not None and
+            get_shard_opening_time(current_shard) + max_age < now)
+        if not is_full and not is_expired:
+            return current_shard
+        # Shard names must be unique even if shard is filled within a second
+        opened_at = max(
+            now,
+            get_shard_opening_time(current_shard) + datetime.timedelta(seconds=1))
+    return '{prefix}-{time}'.format(
+        prefix=prefix,
+        time=opened_at.strftime(SHARD_TIME_FORMAT))
@@ -6,6 +6,7 @@ from fsm_admin.mixins import FSMTransitionMixin
 
 from website import forms, models
 from website.utils.qr import generate_qr_code
+from api.utils import rollout
 from api.utils.urls import get_link_to_object
 from transactions.models import BalanceChange
 
@@ -58,6 +59,11 @@ class DeviceAdmin(FSMTransitionMixin, admin.ModelAdmin):
         'last_activity',
         'is_online',
         'system_info',
+        'system_info_updated',
+        'activation_step',
+        'activation_step_time',
+        'activation_time_started',
+        'activation_jid',
     ]
     fsm_field = ['status']
     form = forms.DeviceAdminForm
@@ -299,4 +305,72 @@ class DeviceBatchAdmin(admin.ModelAdmin):
             batch.size)
 
 
+class FirmwareRolloutDeviceInline(admin.TabularInline):
+
+    model = models.FirmwareRolloutDevice
+    readonly_fields = [
+        'device',
+        'is_canary',
+        'status',
+        'jid',
+        'error',
+        'time_started',
+        'time_step_started',
+        'time_finished',
+    ]
+    max_num = 0
+    extra = 0
+    can_delete = False
+
+
+@admin.register(models.FirmwareRollout)
+class FirmwareRolloutAdmin(admin.ModelAdmin):
+
+    list_display = [
+        '__unicode__',
+        'batch',
+        'status',
+        'progress',
+        'created_at',
+    ]
+    inlines = [FirmwareRolloutDeviceInline]
+    actions = ['abort_rollout']
+
+    def get_readonly_fields(self, request, obj=None):
+        if obj:
+            return [
+                'batch',
+                'status',
+                'concurrency',
+                'canary_percent',
+                'error_threshold',
+                'time_limit',
+                'time_finished',
+            ]
+        return []
+
+    def get_fields(self, request, obj=None):
+        if obj:
+            return self.get_readonly_fields(request, obj)
+        return ['batch', 'concurrency', 'canary_percent', 'error_threshold',
+                'time_limit']
+
+    def save_model(self, request, obj, form, change):
+        super(FirmwareRolloutAdmin, self).save_model(
+            request, obj, form, change)
+        if not change:
+            rollout.start(obj)
+
+    def progress(self, obj):
+        return '{0}/{1}'.format(
+            obj.devices.filter(status__in=['succeeded', 'failed']).count(),
+            obj.devices.count())
+
+    def abort_rollout(self, request, queryset):
+        for obj in queryset.filter(status='in_progress'):
+            rollout.abort(obj)
+
+    abort_rollout.short_description = 'Abort selected rollouts'
+
+
 admin.site.register(models.UITheme)
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from website.utils.heartbeat import flush_heartbeats
+
+
+class Command(BaseCommand):
+
+    help = ('Save device heartbeats to database. '
+            'Should be run every minute')
+
+    def handle(self, *args, **options):
+        updated = flush_heartbeats()
+        self.stdout.write('{0} devices updated'.format(updated))
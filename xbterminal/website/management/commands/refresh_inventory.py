@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from constance import config
+
+from website.utils.devices import refresh_inventory
+
+
+class Command(BaseCommand):
+
+    help = ('Update package versions on devices with stale system info. '
+            'Should be run every 10 minutes')
+
+    def handle(self, *args, **options):
+        if not config.ENABLE_SALT:
+            return
+        device_count = refresh_inventory()
+        self.stdout.write('{0} devices queried'.format(device_count))
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-19 13:42
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0095_schema_currency_is_enabled'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='device',
+            name='activation_jid',
+            field=models.CharField(blank=True, max_length=30, null=True, verbose_name=b'Activation salt job ID'),
+        ),
+        migrations.AddField(
+            model_name='device',
+            name='activation_step',
+            field=models.CharField(blank=True, max_length=20, null=True),
+        ),
+        migrations.AddField(
+            model_name='device',
+            name='activation_step_time',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-19 13:52
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0096_schema_device_activation_step'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='device',
+            name='system_info_updated',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
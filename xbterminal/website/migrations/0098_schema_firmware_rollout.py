@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-19 14:00
+from __future__ import unicode_literals
+
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0097_schema_device_system_info_updated'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FirmwareRollout',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[(b'in_progress', 'In progress'), (b'completed', 'Completed'), (b'aborted', 'Aborted')], default=b'in_progress', max_length=20)),
+                ('concurrency', models.PositiveSmallIntegerField(default=10, validators=[django.core.validators.MinValueValidator(1)], verbose_name=b'Concurrency window')),
+                ('canary_percent', models.PositiveSmallIntegerField(default=5, validators=[django.core.validators.MaxValueValidator(100)], verbose_name=b'Canary devices, %')),
+                ('error_threshold', models.PositiveSmallIntegerField(default=10, validators=[django.core.validators.MaxValueValidator(100)], verbose_name=b'Error threshold, %')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('time_finished', models.DateTimeField(blank=True, null=True)),
+                ('batch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='website.DeviceBatch')),
+            ],
+            options={
+                'verbose_name': 'firmware rollout',
+            },
+        ),
+        migrations.CreateModel(
+            name='FirmwareRolloutDevice',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('is_canary', models.BooleanField(default=False)),
+                ('status', models.CharField(choices=[(b'pending', 'Pending'), (b'fetch_grains', 'Fetching grains'), (b'highstate', 'Highstate running'), (b'succeeded', 'Succeeded'), (b'failed', 'Failed'), (b'skipped', 'Skipped')], default=b'pending', max_length=20)),
+                ('jid', models.CharField(blank=True, max_length=30, null=True, verbose_name=b'Salt job ID')),
+                ('error', models.TextField(blank=True)),
+                ('time_started', models.DateTimeField(blank=True, null=True)),
+                ('time_finished', models.DateTimeField(blank=True, null=True)),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='website.Device')),
+                ('rollout', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='devices', to='website.FirmwareRollout')),
+            ],
+            options={
+                'ordering': ['-is_canary', 'id'],
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='firmwarerolloutdevice',
+            unique_together=set([('rollout', 'device')]),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-19 15:26
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0098_schema_firmware_rollout'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='device',
+            name='activation_time_started',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
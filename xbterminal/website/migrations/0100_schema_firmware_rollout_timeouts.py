@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-19 15:32
+from __future__ import unicode_literals
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0099_schema_device_activation_time_started'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='firmwarerollout',
+            name='time_limit',
+            field=models.PositiveSmallIntegerField(default=24, help_text=b'Rollout is aborted when time limit is reached.', validators=[django.core.validators.MinValueValidator(1)], verbose_name=b'Time limit, hours'),
+        ),
+        migrations.AddField(
+            model_name='firmwarerolloutdevice',
+            name='time_step_started',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
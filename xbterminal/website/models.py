@@ -13,7 +13,7 @@ from django.contrib.postgres.fields import JSONField
 from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.db import models
-from django.db.models.signals import pre_save, post_delete
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
 from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
@@ -30,6 +30,7 @@ from website.validators import (
     validate_name,
     validate_coin_address,
     validate_public_key)
+from website.utils import device_config, heartbeat
 from website.utils.files import (
     get_verification_file_name,
     verification_file_path_gen)
@@ -326,8 +327,8 @@ class MerchantAccount(models.Model):
             status = None
         else:
             status = self.get_verification_status_display()
-        active_dt = timezone.now() - datetime.timedelta(minutes=2)
-        active = self.device_set.filter(last_activity__gte=active_dt).count()
+        active = heartbeat.count_online(
+            list(self.device_set.values_list('key', flat=True)))
         total = self.device_set.count()
         today = timezone.localtime(timezone.now()).\
             replace(hour=0, minute=0, second=0, microsecond=0)
@@ -690,6 +691,20 @@ class Device(models.Model):
         blank=True, null=True)
 
     system_info = JSONField(default=dict, blank=True)
+    system_info_updated = models.DateTimeField(blank=True, null=True)
+
+    # State of activation process, see api.utils.activation
+    activation_step = models.CharField(
+        max_length=20,
+        blank=True,
+        null=True)
+    activation_step_time = models.DateTimeField(blank=True, null=True)
+    activation_time_started = models.DateTimeField(blank=True, null=True)
+    activation_jid = models.CharField(
+        'Activation salt job ID',
+        max_length=30,
+        blank=True,
+        null=True)
 
     created_at = models.DateTimeField(auto_now_add=True)
     last_activity = models.DateTimeField(blank=True, null=True)
@@ -774,11 +789,7 @@ class Device(models.Model):
             order_by('created_at')
 
     def is_online(self):
-        timeout = 120  # seconds
-        if self.last_activity is None:
-            return False
-        delta = timezone.now() - self.last_activity
-        return delta.total_seconds() < timeout
+        return heartbeat.is_online(self.key)
 
     is_online.boolean = True
 
@@ -794,6 +805,106 @@ def device_generate_activation_code(sender, instance, **kwargs):
                 break
 
 
+@receiver(post_save, sender=Device)
+@receiver(post_delete, sender=Device)
+def device_config_changed(sender, instance, **kwargs):
+    device_config.bump_versions([instance.key])
+
+
+@receiver(post_save, sender=MerchantAccount)
+@receiver(post_save, sender=Account)
+def merchant_config_changed(sender, instance, **kwargs):
+    merchant = instance if sender is MerchantAccount else instance.merchant
+    device_config.bump_versions(
+        list(merchant.device_set.values_list('key', flat=True)))
+
+
+@receiver(post_save, sender=Currency)
+@receiver(post_save, sender=Language)
+def global_config_changed(sender, instance, **kwargs):
+    device_config.bump_versions()
+
+
+class FirmwareRollout(models.Model):
+
+    ROLLOUT_STATUSES = [
+        ('in_progress', _('In progress')),
+        ('completed', _('Completed')),
+        ('aborted', _('Aborted')),
+    ]
+
+    batch = models.ForeignKey(DeviceBatch)
+    status = models.CharField(
+        max_length=20,
+        choices=ROLLOUT_STATUSES,
+        default='in_progress')
+    concurrency = models.PositiveSmallIntegerField(
+        'Concurrency window',
+        default=10,
+        validators=[MinValueValidator(1)])
+    canary_percent = models.PositiveSmallIntegerField(
+        'Canary devices, %',
+        default=5,
+        validators=[MaxValueValidator(100)])
+    error_threshold = models.PositiveSmallIntegerField(
+        'Error threshold, %',
+        default=10,
+        validators=[MaxValueValidator(100)])
+    time_limit = models.PositiveSmallIntegerField(
+        'Time limit, hours',
+        default=24,
+        validators=[MinValueValidator(1)],
+        help_text='Rollout is aborted when time limit is reached.')
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    time_finished = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        verbose_name = 'firmware rollout'
+
+    def __unicode__(self):
+        return u'rollout #{0}'.format(self.pk)
+
+
+class FirmwareRolloutDevice(models.Model):
+
+    DEVICE_STATUSES = [
+        ('pending', _('Pending')),
+        ('fetch_grains', _('Fetching grains')),
+        ('highstate', _('Highstate running')),
+        ('succeeded', _('Succeeded')),
+        ('failed', _('Failed')),
+        ('skipped', _('Skipped')),
+    ]
+
+    rollout = models.ForeignKey(
+        FirmwareRollout,
+        related_name='devices')
+    device = models.ForeignKey(Device)
+    is_canary = models.BooleanField(default=False)
+    status = models.CharField(
+        max_length=20,
+        choices=DEVICE_STATUSES,
+        default='pending')
+    jid = models.CharField(
+        'Salt job ID',
+        max_length=30,
+        blank=True,
+        null=True)
+    error = models.TextField(blank=True)
+
+    time_started = models.DateTimeField(blank=True, null=True)
+    time_step_started = models.DateTimeField(blank=True, null=True)
+    time_finished = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['-is_canary', 'id']
+        unique_together = ['rollout', 'device']
+
+    def __unicode__(self):
+        return self.device.key
+
+
 # TODO: remove this functions
 
 def gen_payment_reference():
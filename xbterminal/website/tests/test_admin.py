@@ -6,9 +6,10 @@ from website.tests.factories import (
     CurrencyFactory,
     MerchantAccountFactory,
     AccountFactory,
+    DeviceBatchFactory,
     DeviceFactory)
-from website.models import Account, Device
-from website.admin import AccountAdmin, DeviceAdmin
+from website.models import Account, Device, FirmwareRollout
+from website.admin import AccountAdmin, DeviceAdmin, FirmwareRolloutAdmin
 
 
 class AccountAdminTestCase(TestCase):
@@ -107,3 +108,29 @@ class DeviceAdminTestCase(TestCase):
         self.assertIs(form.is_valid(), True)
         device_updated = form.save()
         self.assertEqual(device_updated.pk, device.pk)
+
+
+class FirmwareRolloutAdminTestCase(TestCase):
+
+    def setUp(self):
+        self.ma = FirmwareRolloutAdmin(FirmwareRollout, AdminSite())
+
+    @mock.patch('website.admin.rollout.start')
+    def test_create(self, start_mock):
+        batch = DeviceBatchFactory.create()
+        data = {
+            'batch': batch.pk,
+            'concurrency': 20,
+            'canary_percent': 10,
+            'error_threshold': 5,
+            'time_limit': 12,
+        }
+        form_cls = self.ma.get_form(mock.Mock())
+        form = form_cls(data=data)
+        self.assertIs(form.is_valid(), True)
+        rollout = form.save(commit=False)
+        self.ma.save_model(mock.Mock(), rollout, form, False)
+        self.assertEqual(rollout.status, 'in_progress')
+        self.assertEqual(rollout.concurrency, 20)
+        self.assertEqual(rollout.time_limit, 12)
+        self.assertEqual(start_mock.call_args[0][0], rollout)
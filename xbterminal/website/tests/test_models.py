@@ -2,6 +2,7 @@
 import datetime
 from decimal import Decimal
 import os
+import time
 
 from django.conf import settings
 from django.contrib.auth.models import Group
@@ -9,6 +10,7 @@ from django.db import IntegrityError
 from django.test import TestCase
 from django.utils import timezone
 
+from mock import patch
 from oauth2_provider.models import Application
 from django_fsm import TransitionNotAllowed
 
@@ -171,7 +173,8 @@ class MerchantAccountTestCase(TestCase):
         self.assertEqual(merchant.verification_status, 'unverified')
         self.assertEqual(len(merchant.activation_code), 6)
 
-    def test_merchant_factory(self):
+    @patch('website.utils.heartbeat.get_connection')
+    def test_merchant_factory(self, connection_mock):
         merchant = MerchantAccountFactory.create()
         self.assertTrue(merchant.is_profile_complete)
         self.assertIsNotNone(merchant.info)
@@ -213,7 +216,8 @@ class MerchantAccountTestCase(TestCase):
             'uploaded')
         self.assertIsNotNone(document)
 
-    def test_info_new_merchant(self):
+    @patch('website.utils.heartbeat.get_connection')
+    def test_info_new_merchant(self, connection_mock):
         merchant = MerchantAccountFactory.create()
         info = merchant.info
         self.assertEqual(info['name'], merchant.company_name)
@@ -223,7 +227,8 @@ class MerchantAccountTestCase(TestCase):
         self.assertEqual(info['tx_count'], 0)
         self.assertEqual(info['tx_sum'], 0)
 
-    def test_info_with_transactions(self):
+    @patch('website.utils.heartbeat.get_connection')
+    def test_info_with_transactions(self, connection_mock):
         merchant = MerchantAccountFactory.create(
             verification_status='pending')
         account = AccountFactory.create(merchant=merchant)
@@ -233,8 +238,10 @@ class MerchantAccountTestCase(TestCase):
         active_device = DeviceFactory.create(
             merchant=merchant,
             account=account,
-            status='active',
-            last_activity=timezone.now())
+            status='active')
+        pipe_mock = connection_mock.return_value.pipeline.return_value.\
+            __enter__.return_value
+        pipe_mock.execute.return_value = [time.time(), None]
         transactions = BalanceChangeFactory.create_batch(
             3,
             deposit__account=account,
@@ -628,16 +635,19 @@ class DeviceTestCase(TestCase):
         self.assertEqual(transactions[1].pk, tx_4.pk)
         self.assertEqual(transactions[2].pk, tx_5.pk)
 
-    def test_is_online(self):
+    @patch('website.utils.heartbeat.get_connection')
+    def test_is_online(self, connection_mock):
+        pipe_mock = connection_mock.return_value.pipeline.return_value.\
+            __enter__.return_value
         device = DeviceFactory.create()
-        self.assertIsNone(device.last_activity)
+        pipe_mock.execute.return_value = [None]
         self.assertIs(device.is_online(), False)
-        device.last_activity = (timezone.now() -
-                                datetime.timedelta(minutes=5))
+        pipe_mock.execute.return_value = [time.time() - 300]
         self.assertIs(device.is_online(), False)
-        device.last_activity = (timezone.now() -
-                                datetime.timedelta(minutes=1))
+        pipe_mock.execute.return_value = [time.time() - 60]
         self.assertIs(device.is_online(), True)
+        self.assertEqual(pipe_mock.zscore.call_args[0],
+                         ('xbt:heartbeats', device.key))
 
 
 class DeviceBatchTestCase(TestCase):
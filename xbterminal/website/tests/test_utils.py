@@ -1,12 +1,21 @@
+import calendar
+import datetime
+import time
 import unicodecsv
 
 from mock import patch, Mock
 from django.conf import settings
 from django.core import mail
+from django.core.cache import cache
 from django.test import TestCase
+from django.utils import timezone
 
 from website.models import Device, KYC_DOCUMENT_TYPES
-from website.utils.devices import get_device_info, MAIN_PACKAGES
+from website.utils.devices import (
+    refresh_inventory,
+    collect_inventory,
+    MAIN_PACKAGES)
+from website.utils import device_config, heartbeat
 from website.utils.kyc import upload_documents
 from website.utils.files import encode_base64, decode_base64
 from website.utils.reports import (
@@ -21,26 +30,169 @@ from transactions.tests.factories import BalanceChangeFactory
 
 class DeviceUtilsTestCase(TestCase):
 
-    @patch('website.utils.devices.Salt')
-    def test_get_device_info(self, salt_cls_mock):
-        versions = {
-            'xbterminal-rpc': '1.0.0',
-            'xbterminal-gui': '1.0.0',
-        }
-        salt_cls_mock.return_value = salt_mock = Mock(**{
-            'get_pkg_versions.return_value': versions,
+    @patch('website.utils.devices.rq_helpers.run_periodic_task')
+    @patch('website.utils.devices.get_salt')
+    def test_refresh_inventory(self, get_salt_mock, run_mock):
+        get_salt_mock.return_value = salt_mock = Mock(**{
+            'start_job.return_value': 'jid-1',
         })
-        device = DeviceFactory.create()
+        now = timezone.now()
+        device_1 = DeviceFactory.create(
+            status='active', last_activity=now)
+        device_2 = DeviceFactory.create(
+            status='active', last_activity=now,
+            system_info_updated=now - datetime.timedelta(days=2))
+        # Fresh
+        DeviceFactory.create(
+            status='active', last_activity=now,
+            system_info_updated=now)
+        # Offline
+        DeviceFactory.create(status='active', last_activity=None)
+        DeviceFactory.create(status='registered', last_activity=now)
 
-        get_device_info(device.key)
-        self.assertIs(salt_mock.login.called, True)
-        self.assertEqual(salt_mock.get_pkg_versions.call_args[0][0],
-                         device.key)
-        self.assertEqual(salt_mock.get_pkg_versions.call_args[0][1],
+        self.assertEqual(refresh_inventory(), 2)
+        device_keys, fun = salt_mock.start_job.call_args[0]
+        self.assertEqual(set(device_keys), {device_1.key, device_2.key})
+        self.assertEqual(fun, 'pkg.info_installed')
+        self.assertEqual(salt_mock.start_job.call_args[1]['arg'],
                          MAIN_PACKAGES)
-        updated_device = Device.objects.get(pk=device.pk)
-        self.assertEqual(updated_device.system_info,
-                         {'packages': versions})
+        self.assertEqual(run_mock.call_args[0][0], collect_inventory)
+        self.assertEqual(run_mock.call_args[0][1][:2], ['jid-1', 2])
+        self.assertEqual(run_mock.call_args[1]['queue'], 'low')
+
+    @patch('website.utils.devices.get_salt')
+    def test_refresh_inventory_no_devices(self, get_salt_mock):
+        self.assertEqual(refresh_inventory(), 0)
+        self.assertIs(get_salt_mock.called, False)
+
+    @patch('website.utils.devices.rq_helpers.cancel_current_task')
+    @patch('website.utils.devices.get_salt')
+    def test_collect_inventory(self, get_salt_mock, cancel_mock):
+        started_at = timezone.now()
+        device_1 = DeviceFactory.create(status='active')
+        device_2 = DeviceFactory.create(status='active')
+        device_3 = DeviceFactory.create(status='active')
+        get_salt_mock.return_value = salt_mock = Mock(**{
+            'get_job_results.return_value': {
+                device_1.key: {'xbterminal-rpc': {'version': '1.0.0'}},
+                device_2.key: 'Minion did not return',
+            },
+        })
+        collect_inventory('jid-1', 3, started_at.isoformat())
+        self.assertEqual(salt_mock.get_job_results.call_args[0][0],
+                         'jid-1')
+        device_1 = Device.objects.get(pk=device_1.pk)
+        self.assertEqual(device_1.system_info,
+                         {'packages': {'xbterminal-rpc': '1.0.0'}})
+        self.assertIsNotNone(device_1.system_info_updated)
+        self.assertIsNone(
+            Device.objects.get(pk=device_2.pk).system_info_updated)
+        self.assertIs(cancel_mock.called, False)
+
+        salt_mock.get_job_results.return_value[device_3.key] = \
+            {'xbterminal-rpc': {'version': '1.0.1'}}
+        collect_inventory('jid-1', 3, started_at.isoformat())
+        device_3 = Device.objects.get(pk=device_3.pk)
+        self.assertEqual(device_3.system_info,
+                         {'packages': {'xbterminal-rpc': '1.0.1'}})
+        self.assertIs(cancel_mock.called, True)
+
+    @patch('website.utils.devices.rq_helpers.cancel_current_task')
+    @patch('website.utils.devices.get_salt')
+    def test_collect_inventory_timeout(self, get_salt_mock, cancel_mock):
+        started_at = timezone.now() - datetime.timedelta(minutes=10)
+        get_salt_mock.return_value = Mock(**{
+            'get_job_results.return_value': {},
+        })
+        collect_inventory('jid-1', 3, started_at.isoformat())
+        self.assertIs(cancel_mock.called, True)
+
+
+class HeartbeatTestCase(TestCase):
+
+    @patch('website.utils.heartbeat.get_connection')
+    def test_record_heartbeat(self, connection_mock):
+        heartbeat.record_heartbeat('test')
+        key, timestamp, device_key = \
+            connection_mock.return_value.zadd.call_args[0]
+        self.assertEqual(key, 'xbt:heartbeats')
+        self.assertAlmostEqual(timestamp, time.time(), delta=1)
+        self.assertEqual(device_key, 'test')
+
+    @patch('website.utils.heartbeat.get_connection')
+    def test_count_online(self, connection_mock):
+        pipe_mock = connection_mock.return_value.pipeline.return_value.\
+            __enter__.return_value
+        pipe_mock.execute.return_value = [
+            time.time() - 10, time.time() - 1000, None]
+        self.assertEqual(heartbeat.count_online(['a', 'b', 'c']), 1)
+        self.assertEqual(pipe_mock.zscore.call_count, 3)
+
+    @patch('website.utils.heartbeat.get_connection')
+    def test_flush_heartbeats(self, connection_mock):
+        device_1, device_2, device_3 = DeviceFactory.create_batch(3)
+        timestamp_1 = time.time() - 10
+        timestamp_2 = time.time() - 20
+        connection_mock.return_value.zrangebyscore.return_value = [
+            (device_1.key, timestamp_1),
+            (device_2.key, timestamp_2),
+        ]
+        self.assertEqual(heartbeat.flush_heartbeats(), 2)
+        self.assertAlmostEqual(
+            connection_mock.return_value.zrangebyscore.call_args[0][1],
+            time.time() - 300, delta=1)
+        self.assertAlmostEqual(
+            connection_mock.return_value.zremrangebyscore.call_args[0][2],
+            time.time() - 300, delta=1)
+        device_1 = Device.objects.get(pk=device_1.pk)
+        self.assertAlmostEqual(
+            calendar.timegm(device_1.last_activity.utctimetuple()),
+            timestamp_1, delta=1)
+        device_2 = Device.objects.get(pk=device_2.pk)
+        self.assertAlmostEqual(
+            calendar.timegm(device_2.last_activity.utctimetuple()),
+            timestamp_2, delta=1)
+        self.assertIsNone(Device.objects.get(pk=device_3.pk).last_activity)
+
+    @patch('website.utils.heartbeat.get_connection')
+    def test_flush_heartbeats_empty(self, connection_mock):
+        connection_mock.return_value.zrangebyscore.return_value = []
+        self.assertEqual(heartbeat.flush_heartbeats(), 0)
+
+
+class DeviceConfigTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    @patch('website.utils.device_config.transaction.on_commit',
+           side_effect=lambda func: func())
+    def test_versions(self, on_commit_mock):
+        device_1, device_2 = DeviceFactory.create_batch(2)
+        etag_1 = device_config.get_etag(device_1.key)
+        etag_2 = device_config.get_etag(device_2.key)
+        self.assertEqual(device_config.get_etag(device_1.key), etag_1)
+        # Device
+        device_1.save()
+        self.assertNotEqual(device_config.get_etag(device_1.key), etag_1)
+        self.assertEqual(device_config.get_etag(device_2.key), etag_2)
+        # Merchant
+        etag_1 = device_config.get_etag(device_1.key)
+        device_2.merchant.save()
+        self.assertEqual(device_config.get_etag(device_1.key), etag_1)
+        self.assertNotEqual(device_config.get_etag(device_2.key), etag_2)
+        # Currency
+        etag_2 = device_config.get_etag(device_2.key)
+        device_1.merchant.currency.save()
+        self.assertNotEqual(device_config.get_etag(device_1.key), etag_1)
+        self.assertNotEqual(device_config.get_etag(device_2.key), etag_2)
+
+    def test_cache_config(self):
+        etag = device_config.get_etag('test')
+        self.assertIsNone(device_config.get_cached_config('test', etag))
+        device_config.cache_config('test', etag, {'status': 'active'})
+        self.assertEqual(device_config.get_cached_config('test', etag),
+                         {'status': 'active'})
 
 
 class KYCUtilsTestCase(TestCase):
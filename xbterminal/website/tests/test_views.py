@@ -251,7 +251,6 @@ class ActivationWizardTestCase(TestCase):
                                     form_data_2,
                                     format='multipart')
         self.assertEqual(response.status_code, 302)
-        self.assertTrue(rq_helpers_mock.run_task.called)
         self.assertTrue(rq_helpers_mock.run_periodic_task.called)
         self.assertEqual(len(mail.outbox), 0)
         device = Device.objects.get(pk=device.pk)
@@ -295,7 +294,6 @@ class ActivationWizardTestCase(TestCase):
                                     form_data_3,
                                     format='multipart')
         self.assertEqual(response.status_code, 302)
-        self.assertTrue(rq_helpers_mock.run_task.called)
         self.assertTrue(rq_helpers_mock.run_periodic_task.called)
         device = Device.objects.get(pk=device.pk)
         self.assertIsNotNone(device.merchant)
@@ -312,7 +310,8 @@ class ActivationWizardTestCase(TestCase):
 
 class DeviceListViewTestCase(TestCase):
 
-    def test_get(self):
+    @patch('website.utils.heartbeat.get_connection')
+    def test_get(self, connection_mock):
         merchant = MerchantAccountFactory.create()
         account = AccountFactory.create(merchant=merchant)
         device_1, device_2 = DeviceFactory.create_batch(
@@ -396,7 +395,8 @@ class DeviceStatusViewTestCase(TestCase):
         response = self.client.get(url)
         self.assertEqual(response.status_code, 404)
 
-    def test_post_suspend(self):
+    @patch('website.utils.heartbeat.get_connection')
+    def test_post_suspend(self, connection_mock):
         device = DeviceFactory.create(merchant=self.merchant)
         self.client.login(username=self.merchant.user.email,
                           password='password')
@@ -407,7 +407,8 @@ class DeviceStatusViewTestCase(TestCase):
         device_updated = Device.objects.get(key=device.key)
         self.assertEqual(device_updated.status, 'suspended')
 
-    def test_post_activate(self):
+    @patch('website.utils.heartbeat.get_connection')
+    def test_post_activate(self, connection_mock):
         device = DeviceFactory.create(merchant=self.merchant,
                                       status='suspended')
         self.client.login(username=self.merchant.user.email,
@@ -466,9 +467,8 @@ class ActivateDeviceViewTestCase(TestCase):
 
         self.assertEqual(response.status_code, 404)
 
-    @patch('api.utils.activation.rq_helpers.run_task')
     @patch('api.utils.activation.rq_helpers.run_periodic_task')
-    def test_post_valid_code(self, run_periodic_mock, run_mock):
+    def test_post_valid_code(self, run_periodic_mock):
         merchant = MerchantAccountFactory.create()
         account = AccountFactory.create(merchant=merchant)
         self.assertEqual(merchant.device_set.count(), 0)
@@ -481,9 +481,8 @@ class ActivateDeviceViewTestCase(TestCase):
         }
         url = reverse('website:activate_device')
         response = self.client.post(url, form_data, follow=True)
-        self.assertTrue(run_mock.called)
-        self.assertEqual(run_mock.call_args[1]['queue'], 'low')
         self.assertTrue(run_periodic_mock.called)
+        self.assertEqual(run_periodic_mock.call_args[1]['queue'], 'low')
         expected_url = reverse('website:device_activation',
                                kwargs={'device_key': device.key})
         self.assertRedirects(response, expected_url)
@@ -506,9 +505,8 @@ class ActivateDeviceViewTestCase(TestCase):
                       response.context['form'].errors)
         self.assertIn('activation_url', response.context)
 
-    @patch('api.utils.activation.rq_helpers.run_task')
     @patch('api.utils.activation.rq_helpers.run_periodic_task')
-    def test_post_nologin(self, run_periodic_mock, run_mock):
+    def test_post_nologin(self, run_periodic_mock):
         self.client.logout()
         merchant = MerchantAccountFactory.create()
         AccountFactory.create(merchant=merchant)
@@ -521,7 +519,6 @@ class ActivateDeviceViewTestCase(TestCase):
             kwargs={'merchant_code': merchant.activation_code})
         response = self.client.post(url, form_data, follow=True)
 
-        self.assertTrue(run_mock.called)
         self.assertTrue(run_periodic_mock.called)
         expected_url = reverse(
             'website:device_activation_nologin',
@@ -1276,7 +1273,8 @@ class MerchantDeviceListViewTestCase(TestCase):
         self.controller = UserFactory.create(
             groups__names=['controllers'])
 
-    def test_get(self):
+    @patch('website.utils.heartbeat.get_connection')
+    def test_get(self, connection_mock):
         merchant = MerchantAccountFactory.create()
         device = DeviceFactory.create(merchant=merchant)
         self.client.login(username=self.controller.email,
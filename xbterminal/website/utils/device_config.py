@@ -0,0 +1,72 @@
+"""
+Serialized device configuration is cached by version.
+Device version is bumped on changes of device, merchant or account,
+global version is bumped on changes of currencies and languages
+"""
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+VERSION_CACHE_KEY_TEMPLATE = 'device-config-version-{scope}'
+CONFIG_CACHE_KEY_TEMPLATE = 'device-config-{device_key}-{etag}'
+CONFIG_CACHE_TIMEOUT = 24 * 3600  # seconds
+
+GLOBAL_SCOPE = 'global'
+
+
+def _get_initial_version():
+    # Never reuses values of evicted counters
+    return int(time.time() * 1000)
+
+
+def _bump(scopes):
+    for scope in scopes:
+        key = VERSION_CACHE_KEY_TEMPLATE.format(scope=scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _get_initial_version(), timeout=None)
+
+
+def bump_versions(device_keys=None):
+    """
+    Invalidate cached configuration after commit
+    Accepts:
+        device_keys: list of device keys, bump global version if None
+    """
+    if device_keys is None:
+        scopes = [GLOBAL_SCOPE]
+    else:
+        scopes = ['device-{0}'.format(key) for key in device_keys]
+    transaction.on_commit(lambda: _bump(scopes))
+
+
+def get_etag(device_key):
+    """
+    Should be called before loading configuration from DB
+    Accepts:
+        device_key
+    Returns:
+        entity tag for current configuration
+    """
+    keys = [VERSION_CACHE_KEY_TEMPLATE.format(scope=scope) for scope
+            in [GLOBAL_SCOPE, 'device-{0}'.format(device_key)]]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, _get_initial_version(), timeout=None)
+            versions[key] = cache.get(key)
+    return '"{0}"'.format('-'.join(str(versions[key]) for key in keys))
+
+
+def get_cached_config(device_key, etag):
+    return cache.get(CONFIG_CACHE_KEY_TEMPLATE.format(
+        device_key=device_key, etag=etag))
+
+
+def cache_config(device_key, etag, data):
+    cache.set(CONFIG_CACHE_KEY_TEMPLATE.format(
+        device_key=device_key, etag=etag),
+        data,
+        timeout=CONFIG_CACHE_TIMEOUT)
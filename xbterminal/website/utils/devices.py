@@ -1,7 +1,22 @@
+import datetime
 import logging
 
+from django.contrib.postgres.fields import JSONField
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import dateparse, timezone
+
 from website.models import Device
-from api.utils.salt import Salt
+from website.utils.heartbeat import ONLINE_TIMEOUT
+from api.utils.salt import SaltError, get_salt, parse_pkg_versions
+from common import rq_helpers
+
+DEVICE_ONLINE_TIMEOUT = datetime.timedelta(seconds=ONLINE_TIMEOUT)
+INVENTORY_MAX_AGE = datetime.timedelta(hours=24)
+INVENTORY_BATCH_SIZE = 500
+INVENTORY_JOB_TIMEOUT = datetime.timedelta(minutes=5)
+INVENTORY_CHECK_INTERVAL = 15  # seconds
+INVENTORY_QUEUE = 'low'
 
 logger = logging.getLogger(__name__)
 
@@ -28,23 +43,81 @@ MAIN_PACKAGES = [
 ]
 
 
-def get_device_info(device_key):
+def refresh_inventory():
+    """
+    Query package versions from all online devices
+    with stale system info using one salt job
+    Returns:
+        number of targeted devices
+    """
+    now = timezone.now()
+    device_keys = list(
+        Device.objects.
+        filter(status='active',
+               last_activity__gte=now - DEVICE_ONLINE_TIMEOUT).
+        filter(Q(system_info_updated__isnull=True) |
+               Q(system_info_updated__lt=now - INVENTORY_MAX_AGE)).
+        annotate(inventory_time=Coalesce('system_info_updated',
+                                         'created_at')).
+        order_by('inventory_time').
+        values_list('key', flat=True)[:INVENTORY_BATCH_SIZE])
+    if not device_keys:
+        return 0
+    salt = get_salt()
+    jid = salt.start_job(device_keys, 'pkg.info_installed',
+                         arg=MAIN_PACKAGES)
+    rq_helpers.run_periodic_task(
+        collect_inventory,
+        [jid, len(device_keys), now.isoformat()],
+        queue=INVENTORY_QUEUE,
+        interval=INVENTORY_CHECK_INTERVAL)
+    logger.info('inventory job %s started, %s devices',
+                jid, len(device_keys))
+    return len(device_keys)
+
+
+def collect_inventory(jid, device_count, started_at):
     """
-    Asynchronous task
-    Retrieves system information from device using salt
+    Periodic task
+    Saves results of inventory job as they arrive
     Accepts:
-        device_key
+        jid: salt job ID
+        device_count: number of targeted devices
+        started_at: job start time, ISO 8601 string
     """
-    device = Device.objects.get(key=device_key)
-    salt = Salt()
-    salt.login()
-    try:
-        versions = salt.get_pkg_versions(device.key, MAIN_PACKAGES)
-    except AssertionError:
-        logger.warning(
-            'device is offline',
-            extra={'data': {'device_key': device.key}})
-    else:
-        device.system_info = {'packages': versions}
-        device.save()
-        logger.info('device system info updated')
+    started_at = dateparse.parse_datetime(started_at)
+    salt = get_salt()
+    results = salt.get_job_results(jid)
+    system_infos = {}
+    for device_key, result in results.items():
+        try:
+            versions = parse_pkg_versions(result)
+        except SaltError as error:
+            logger.warning(
+                'inventory error',
+                extra={'data': {'device_key': device_key,
+                                'error': str(error)}})
+            continue
+        system_infos[device_key] = {'packages': versions}
+    # Devices updated by previous runs are skipped
+    device_keys = Device.objects.\
+        filter(key__in=system_infos.keys()).\
+        filter(Q(system_info_updated__isnull=True) |
+               Q(system_info_updated__lt=started_at)).\
+        values_list('key', flat=True)
+    if device_keys:
+        Device.objects.filter(key__in=device_keys).update(
+            system_info=Case(
+                *[When(key=device_key,
+                       then=Value(system_infos[device_key],
+                                  output_field=JSONField()))
+                  for device_key in device_keys],
+                default=F('system_info')),
+            system_info_updated=timezone.now())
+        logger.info('system info updated, %s devices', len(device_keys))
+    if len(results) >= device_count:
+        rq_helpers.cancel_current_task(queue=INVENTORY_QUEUE)
+    elif started_at + INVENTORY_JOB_TIMEOUT < timezone.now():
+        logger.warning('inventory job %s timed out, %s devices missing',
+                       jid, device_count - len(results))
+        rq_helpers.cancel_current_task(queue=INVENTORY_QUEUE)
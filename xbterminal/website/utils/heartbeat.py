@@ -0,0 +1,88 @@
+"""
+Device heartbeats are recorded in Redis sorted set
+(device key -> timestamp) and periodically written
+to Device.last_activity with single UPDATE
+"""
+import datetime
+import logging
+import time
+
+from django.apps import apps
+from django.db import models
+from django.utils import timezone
+import django_rq
+
+HEARTBEATS_KEY = 'xbt:heartbeats'
+HEARTBEATS_QUEUE = 'high'  # Determines Redis connection
+
+ONLINE_TIMEOUT = 120  # seconds
+# Heartbeats older than this are flushed and removed
+FLUSH_WINDOW = 300  # seconds
+
+logger = logging.getLogger(__name__)
+
+
+def get_connection():
+    return django_rq.get_connection(HEARTBEATS_QUEUE, use_strict_redis=True)
+
+
+def record_heartbeat(device_key):
+    get_connection().zadd(HEARTBEATS_KEY, time.time(), device_key)
+
+
+def get_last_seen(device_keys):
+    """
+    Accepts:
+        device_keys: list of device keys
+    Returns:
+        dict, device key -> timestamp or None
+    """
+    with get_connection().pipeline(transaction=False) as pipe:
+        for device_key in device_keys:
+            pipe.zscore(HEARTBEATS_KEY, device_key)
+        timestamps = pipe.execute()
+    return dict(zip(device_keys, timestamps))
+
+
+def count_online(device_keys):
+    """
+    Accepts:
+        device_keys: list of device keys
+    Returns:
+        number of online devices
+    """
+    min_timestamp = time.time() - ONLINE_TIMEOUT
+    return sum(1 for timestamp in get_last_seen(device_keys).values()
+               if timestamp and timestamp > min_timestamp)
+
+
+def is_online(device_key):
+    return count_online([device_key]) == 1
+
+
+def flush_heartbeats():
+    """
+    Save recent heartbeats to DB
+    Returns:
+        number of updated devices
+    """
+    connection = get_connection()
+    min_timestamp = time.time() - FLUSH_WINDOW
+    heartbeats = connection.zrangebyscore(
+        HEARTBEATS_KEY, min_timestamp, '+inf', withscores=True)
+    connection.zremrangebyscore(HEARTBEATS_KEY, '-inf', min_timestamp)
+    if not heartbeats:
+        return 0
+    Device = apps.get_model('website', 'Device')
+    updated = Device.objects.\
+        filter(key__in=[device_key for device_key, _ in heartbeats]).\
+        update(last_activity=models.Case(
+            *[models.When(key=device_key,
+                          then=models.Value(
+                              datetime.datetime.fromtimestamp(
+                                  timestamp, timezone.utc),
+                              output_field=models.DateTimeField()))
+              for device_key, timestamp in heartbeats],
+            default=models.F('last_activity')))
+    logger.info('%s heartbeats flushed', updated)
+    return updated
@@ -102,6 +102,7 @@ INSTALLED_APPS = [
     'raven.contrib.django.raven_compat',
     'formtools',
 
+    'common',
     'website',
     'operations',
     'api',
@@ -194,6 +195,12 @@ RQ_QUEUES = {
 
 RQ_EXCEPTION_HANDLERS = ['common.rq_helpers.sentry_exc_handler']
 
+# Number of threads for common.rq_workers.ThreadPoolWorker
+RQ_WORKER_CONCURRENCY = 20
+
+# Number of common.scheduler shards
+SCHEDULER_SHARDS = 8
+
 # Internationalization
 
 LANGUAGE_CODE = 'en'
@@ -236,6 +243,20 @@ CONTACT_EMAIL_RECIPIENTS = ["info@xbterminal.io"]
 
 # Blockchains
 
+# Watch-only addresses can be distributed between several bitcoind wallets
+# (requires multiwallet support), add WALLET_SHARDS to coin settings:
+#   'WALLET_SHARDS': {
+#       'PREFIX': 'xbt-btc',  # Wallet names will be 'xbt-btc-<time>'
+#       'MAX_SIZE': 10000,  # Max number of addresses in one wallet
+#       'MAX_AGE': datetime.timedelta(days=30),
+#   },
+# Additional nodes can be listed in REPLICAS, read-only calls will be
+# distributed between all nodes and fail over to available nodes,
+# wallet and write calls are sent only to primary node:
+#   'REPLICAS': [
+#       {'HOST': 'node2', 'PORT': 8332, 'USER': 'xbt', 'PASSWORD': 'xbt'},
+#   ],
+
 BLOCKCHAINS = {
     'BTC': {
         'HOST': 'localhost',
@@ -310,6 +331,12 @@ CONSTANCE_CONFIG = {
     'POOL_TX_MAX_OUTPUT': (Decimal('0.05'),
                            'Maximum value of TX output in the pool'),
     'ENABLE_SALT': (True, 'Enable Salt integration'),
+    'POLL_PAYMENT_INTERVAL_MIN': (2, 'Min interval of payment polling, seconds'),
+    'POLL_PAYMENT_INTERVAL_MAX': (30, 'Max interval of payment polling, seconds'),
+    'POLL_CONFIDENCE_INTERVAL_MIN': (5, 'Min interval of TX confidence polling, seconds'),
+    'POLL_CONFIDENCE_INTERVAL_MAX': (30, 'Max interval of TX confidence polling, seconds'),
+    'POLL_CONFIRMATION_INTERVAL_MIN': (15, 'Min interval of TX confirmation polling, seconds'),
+    'POLL_CONFIRMATION_INTERVAL_MAX': (300, 'Max interval of TX confirmation polling, seconds'),
 }
 
 # Sentry
@@ -362,6 +389,8 @@ if TESTING:
     }
     # Disable RQ
     RQ_QUEUES = {}
+    # Tests of Redis scripts, database is flushed
+    TEST_REDIS_URL = 'redis://127.0.0.1:6379/15'
     # Don't connect to bitcoind
     BITCOIND_AUTH = {
         'mainnet': (None, None),
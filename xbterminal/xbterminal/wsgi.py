@@ -10,5 +10,15 @@ https://docs.djangoproject.com/en/1.6/howto/deployment/wsgi/
 import os
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "xbterminal.settings")
 
+try:
+    from gevent import monkey
+    from psycogreen.gevent import patch_psycopg
+except ImportError:
+    pass
+else:
+    if monkey.is_module_patched('socket'):
+        # uWSGI gevent loop, make database queries cooperative
+        patch_psycopg()
+
 from django.core.wsgi import get_wsgi_application  # flake8: noqa
 application = get_wsgi_application()